@@ -1,3 +1,3 @@
 from .prepare import prepare_file
 from .analysis import generate_analysis, analyze_constituency
-from .spreadsheet_utils import translate_trees, translate_tsv_dir, xlsx_to_tsv, tsv_to_xlsx
+from .spreadsheet_utils import translate_trees, translate_tsv_dir, xlsx_to_tsv, tsv_to_xlsx, convert_dir
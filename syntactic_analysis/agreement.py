@@ -0,0 +1,236 @@
+import csv
+import json
+from collections import Counter, defaultdict
+from itertools import combinations
+from pathlib import Path
+
+from nltk.tree import Tree
+
+from .analysis import check_tree, parse_rows, strip_empty_rows
+from .corpus import SHEET_ERRORS, iter_sheets
+
+# spans are encoded as integers: label id in the high bits, then start, then end
+SPAN_BITS = 16
+SPAN_MASK = (1 << 2 * SPAN_BITS) - 1
+
+
+class Labels:
+    """Interns labels as small integers, shared by all the spans being compared."""
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __getitem__(self, label):
+        if label not in self.ids:
+            self.ids[label] = len(self.names) + 1
+            self.names.append(label)
+        return self.ids[label]
+
+    def name(self, span):
+        return self.names[(span >> 2 * SPAN_BITS) - 1]
+
+
+def encode(label_id, start, end):
+    return (label_id << 2 * SPAN_BITS) | (start << SPAN_BITS) | end
+
+
+def decode(span):
+    return (span >> SPAN_BITS) & ((1 << SPAN_BITS) - 1), span & ((1 << SPAN_BITS) - 1)
+
+
+def tree_spans(tree, labels):
+    """
+    The constituents of a tree, as encoded labeled spans. End is exclusive.
+    POS tags are not constituents, so they are left out.
+    """
+    spans = set()
+
+    def walk(node, start):
+        end = start
+        for child in node:
+            end = walk(child, end) if isinstance(child, Tree) else end + 1
+        if node.height() > 2:
+            spans.add(encode(labels[node.label()], start, end))
+        return end
+
+    walk(tree, 0)
+    return spans
+
+
+def grid_spans(raw_tree, labels):
+    """
+    Same as tree_spans(), read from the bracket rows of a sheet (everything above the "P" row,
+    as returned by parse_rows()) without building the tree.
+    """
+    spans = set()
+    for row in raw_tree[:-1]:
+        start = label = None
+        for col, cell in enumerate(row):
+            if cell.startswith("["):
+                start, label = col, cell.strip("[]")
+            if cell.endswith("]") and start is not None:
+                spans.add(encode(labels[label], start, col + 1))
+                start = label = None
+    return spans
+
+
+def sheet_spans(content, labels, translate_tree="en_bo"):
+    rows = list(csv.reader(content.split("\n"), delimiter="\t"))
+    raw_tree, _ = parse_rows(strip_empty_rows(rows), translate_tree=translate_tree)
+    errors = check_tree(raw_tree[:-1])
+    if errors:
+        raise SyntaxError("Errors in following rows: " + " | ".join(errors))
+    return grid_spans(raw_tree, labels)
+
+
+class Agreement:
+    """
+    Bracket agreement counts, accumulated over pairs of sheets. The first annotation of
+    each pair is taken as the reference, but the F1 score is symmetric.
+    Counts are summed (micro-average) and can be merged with `+`.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        # (reference label, candidate label) for the spans bracketed by both
+        self.confusion = Counter()
+
+    def add(self, reference, candidate, labels):
+        matched = reference & candidate
+        ref_spans = {s & SPAN_MASK: s for s in reference}
+        cand_spans = {s & SPAN_MASK: s for s in candidate}
+        unlabeled = ref_spans.keys() & cand_spans.keys()
+
+        self.counts["sheets"] += 1
+        self.counts["matched"] += len(matched)
+        self.counts["reference"] += len(reference)
+        self.counts["candidate"] += len(candidate)
+        self.counts["unlabeled"] += len(unlabeled)
+        self.counts["crossing"] += crossing(
+            cand_spans.keys() - unlabeled, ref_spans.keys()
+        )
+        for span in unlabeled:
+            self.confusion[
+                (labels.name(ref_spans[span]), labels.name(cand_spans[span]))
+            ] += 1
+
+    def __iadd__(self, other):
+        self.counts.update(other.counts)
+        self.confusion.update(other.confusion)
+        return self
+
+    def __add__(self, other):
+        merged = Agreement()
+        merged += self
+        merged += other
+        return merged
+
+    def scores(self):
+        c = self.counts
+        scores = {}
+        for kind, matched in [("labeled", c["matched"]), ("unlabeled", c["unlabeled"])]:
+            precision = matched / c["candidate"] if c["candidate"] else 0
+            recall = matched / c["reference"] if c["reference"] else 0
+            f1 = (
+                2 * precision * recall / (precision + recall)
+                if precision + recall
+                else 0
+            )
+            scores[kind] = {"precision": precision, "recall": recall, "f1": f1}
+        scores["crossing"] = c["crossing"] / c["sheets"] if c["sheets"] else 0
+        scores["sheets"] = c["sheets"]
+        return scores
+
+    def to_dict(self):
+        return {
+            "scores": self.scores(),
+            "counts": dict(self.counts),
+            "confusion": [
+                [ref, cand, count]
+                for (ref, cand), count in self.confusion.most_common()
+            ],
+        }
+
+
+def crossing(candidate, reference):
+    """Amount of candidate spans crossing at least one reference span. Spans are unlabeled."""
+    reference = [decode(s) for s in reference]
+    count = 0
+    for start, end in map(decode, candidate):
+        for ref_start, ref_end in reference:
+            if ref_start < start < ref_end < end or start < ref_start < end < ref_end:
+                count += 1
+                break
+    return count
+
+
+def corpus_spans(in_dir, labels, header_sheets=0, translate_tree="en_bo"):
+    """
+    {(workbook, sheet): spans} for all the sheets of in_dir. Unparsable sheets are left out.
+    The tsv files directly in in_dir belong to the "" workbook, so that they match across annotators.
+    """
+    spans = {}
+    for workbook, sheet, content in iter_sheets(in_dir, header_sheets=header_sheets):
+        if workbook == Path(in_dir).name:
+            workbook = ""
+        try:
+            spans[(workbook, sheet)] = sheet_spans(content, labels, translate_tree)
+        except SHEET_ERRORS as e:
+            print(f"\t{in_dir}: {workbook}/{sheet}: {e}")
+    return spans
+
+
+def compare_annotators(annotators, header_sheets=0, translate_tree="en_bo"):
+    """
+    Scores every pair of annotators on the sheets they both annotated.
+
+    :param annotators: {annotator: in_dir}, the folders containing the same workbooks
+    :return: {(annotator1, annotator2): {"total": Agreement, "workbooks": {workbook: Agreement}}}
+    """
+    labels = Labels()
+    spans = {
+        name: corpus_spans(in_dir, labels, header_sheets, translate_tree)
+        for name, in_dir in annotators.items()
+    }
+
+    results = {}
+    for a, b in combinations(sorted(annotators), 2):
+        workbooks = defaultdict(Agreement)
+        for key in sorted(spans[a].keys() & spans[b].keys()):
+            workbooks[key[0]].add(spans[a][key], spans[b][key], labels)
+        total = Agreement()
+        for agreement in workbooks.values():
+            total += agreement
+        results[(a, b)] = {"total": total, "workbooks": dict(workbooks)}
+    return results
+
+
+def per_annotator(results):
+    """Sums the agreement of each annotator with all the others"""
+    annotators = defaultdict(Agreement)
+    for pair, r in results.items():
+        for name in pair:
+            annotators[name] += r["total"]
+    return dict(annotators)
+
+
+def write_report(results, filename):
+    report = {
+        "pairs": [
+            {
+                "annotators": list(pair),
+                "total": r["total"].to_dict(),
+                "workbooks": {
+                    w: a.to_dict() for w, a in sorted(r["workbooks"].items())
+                },
+            }
+            for pair, r in results.items()
+        ],
+        "annotators": {
+            name: a.to_dict() for name, a in sorted(per_annotator(results).items())
+        },
+    }
+    Path(filename).write_text(
+        json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8"
+    )
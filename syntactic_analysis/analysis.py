@@ -5,12 +5,20 @@ import re
 from pathlib import Path
 from tempdir import TempDir
 
-import xlrd
-from pdf2image import convert_from_bytes
 from nltk.tree import ParentedTree, Tree
 from nltk.treeprettyprinter import TreePrettyPrinter
 
+from .corpus import iter_workbook_sheets
+from .file_utils import link_file
+from .hashcons import TreeTable
+from .journal import JOURNAL, Journal
 from .latex import LatexMkBuilder
+from .outputs import OUTPUTS, Sheet, parse_formats
+from .raster import DEFAULT_DPI, write_png
+from .schedule import Scheduler
+from .shard import shard_sheets, write_manifest
+from .svgfont import font_subset, tree_text
+from .tiles import measure
 
 
 def parse_tagset():
@@ -41,17 +49,76 @@ def analyze_constituency(
     font=None,
     header_sheets=0,
     translate_tree=True,
+    dpi=DEFAULT_DPI,
+    grayscale=False,
+    colors=None,
+    embed_font=False,
+    max_leaves=None,
+    resume=False,
+    shards=1,
+    shard=0,
+    workers=1,
 ):
+    """
+    A sheet that fails is reported and skipped. The outcome of every sheet is recorded in a
+    journal in out_dir, and with resume=True, the sheets already done in a previous run are skipped.
+
+    With shards > 1, the sheets are split in that many shards of about the same size, and only
+    the sheets of shard number `shard` are analyzed. Every shard needs its own out_dir, the
+    folders are then combined with shard.merge_shards().
+
+    The sheets are rendered by `workers` threads, the most expensive first (see Scheduler).
+
+    format is the name of an output (see outputs.OUTPUTS) or several of them, like
+    {"png", "svg"}: every sheet is then parsed once and written in all of them.
+
+    Trees with more than max_leaves leaves are written in tiles, see tiles.split_tree().
+    None, the default, writes them whole. tiles.MAX_LEAVES keeps xelatex and the pngs
+    within bounds.
+    """
     # ensure the in and out folders exist
     if not in_dir.is_dir():
         in_dir.mkdir(exist_ok=True)
     if not out_dir.is_dir():
         out_dir.mkdir(exist_ok=True)
 
+    journal = Journal(
+        out_dir / JOURNAL,
+        resume=resume,
+        params=render_params(
+            format,
+            write_all=write_all,
+            align_leafs=align_leafs,
+            draw_square=draw_square,
+            font=font,
+            translate_tree=translate_tree,
+            dpi=dpi,
+            grayscale=grayscale,
+            colors=colors,
+            embed_font=embed_font,
+            max_leaves=max_leaves,
+        ),
+    )
+    # trees already rendered, shared by all the sheets
+    table = TreeTable()
+
+    sheets = None
+    if shards > 1:
+        sheets = shard_sheets(in_dir, shards, shard, header_sheets=header_sheets)
+        write_manifest(out_dir, shards, shard, sheets)
+
+    scheduler = Scheduler(
+        "+".join(parse_formats(format)), write_all=write_all, workers=workers
+    )
+
     # process all tsv in the input folder
     for tsv in in_dir.glob("*.tsv"):
-        print(tsv)
-        analyze_tsv_sentence(
+        if journal.is_done(tsv.stem) or (sheets is not None and tsv.stem not in sheets):
+            continue
+        scheduler.add(
+            tsv.stem,
+            tsv.read_text(encoding="utf-8-sig"),
+            analyze_tsv_sentence,
             tsv,
             out_dir,
             format=format,
@@ -60,6 +127,12 @@ def analyze_constituency(
             draw_square=draw_square,
             font=font,
             translate_tree=translate_tree,
+            dpi=dpi,
+            grayscale=grayscale,
+            colors=colors,
+            embed_font=embed_font,
+            max_leaves=max_leaves,
+            table=table,
         )
 
     for xlsx in in_dir.glob("*.xlsx"):
@@ -74,8 +147,27 @@ def analyze_constituency(
             draw_square=draw_square,
             font=font,
             translate_tree=translate_tree,
+            dpi=dpi,
+            grayscale=grayscale,
+            colors=colors,
+            embed_font=embed_font,
+            max_leaves=max_leaves,
+            resume=resume,
+            journal=journal,
+            table=table,
+            sheets=sheets,
+            scheduler=scheduler,
         )
 
+    print(f"rendering {len(scheduler.jobs)} sheets")
+    scheduler.run(journal)
+
+    failed = journal.failed()
+    if failed:
+        print(f"{len(failed)} sheets failed, see {out_dir / JOURNAL}:")
+        for sheet in failed:
+            print("\t", sheet)
+
 
 def analyze_excel_file(
     filename,
@@ -87,7 +179,23 @@ def analyze_excel_file(
     draw_square=False,
     font=None,
     translate_tree=True,
+    dpi=DEFAULT_DPI,
+    grayscale=False,
+    colors=None,
+    embed_font=False,
+    max_leaves=None,
+    resume=False,
+    journal=None,
+    table=None,
+    sheets=None,
+    workers=1,
+    scheduler=None,
 ):
+    """
+    :param sheets: ids of the sheets to analyze, "<workbook stem>/<sheet>". All if None.
+    :param scheduler: if given, the sheets are added to it, to be run with the sheets of other
+                      workbooks. Otherwise they are run here by `workers` threads.
+    """
     filename, out_dir = Path(filename), Path(out_dir)
 
     # create and / or empty output folder
@@ -95,27 +203,50 @@ def analyze_excel_file(
         out_dir.mkdir(exist_ok=True)
     out_dir = out_dir / filename.stem
     out_dir.mkdir(exist_ok=True)
-    for f in out_dir.glob("*.*"):
-        f.unlink()
+    if not resume:
+        for f in out_dir.glob("*.*"):
+            f.unlink()
+    if journal is None:
+        journal = Journal(
+            out_dir / JOURNAL,
+            resume=resume,
+            params=render_params(
+                format,
+                write_all=write_all,
+                align_leafs=align_leafs,
+                draw_square=draw_square,
+                font=font,
+                translate_tree=translate_tree,
+                dpi=dpi,
+                grayscale=grayscale,
+                colors=colors,
+                embed_font=embed_font,
+                max_leaves=max_leaves,
+            ),
+        )
+
+    if table is None:
+        table = TreeTable()
+
+    batch = scheduler or Scheduler(
+        "+".join(parse_formats(format)), write_all=write_all, workers=workers
+    )
 
     tmp_dir = TempDir(basedir=out_dir)
 
-    # write all sheets to temp tsv files
-    workbook = xlrd.open_workbook(filename)
-    sheets = workbook.sheet_names()[header_sheets:]
-    for s in sheets:
-        sheet = workbook.sheet_by_name(s)
+    # process all sheets, through temp tsv files
+    for s, content in iter_workbook_sheets(filename, header_sheets=header_sheets):
+        sheet_id = f"{filename.stem}/{s}"
+        if journal.is_done(sheet_id) or (sheets is not None and sheet_id not in sheets):
+            continue
         tsv = Path(tmp_dir.name) / f"{s}.tsv"
-        with tsv.open("w") as w:
-            writer = csv.writer(w, delimiter="\t")
-            for rownum in range(sheet.nrows):
-                writer.writerow(sheet.row_values(rownum))
-
-    # process all tsv in the input folder
-    for tsv in sorted(Path(tmp_dir.name).glob("*.tsv")):
-        print("\t", tsv.stem)
-        analyze_tsv_sentence(
+        tsv.write_text(content, encoding="utf-8-sig")
+        batch.add(
+            sheet_id,
+            content,
+            analyze_tmp_tsv,
             tsv,
+            tmp_dir,
             out_dir=out_dir,
             format=format,
             write_all=write_all,
@@ -123,8 +254,39 @@ def analyze_excel_file(
             draw_square=draw_square,
             font=font,
             translate_tree=translate_tree,
+            dpi=dpi,
+            grayscale=grayscale,
+            colors=colors,
+            embed_font=embed_font,
+            max_leaves=max_leaves,
+            table=table,
         )
 
+    if scheduler is None:
+        batch.run(journal)
+
+
+def render_params(format, **options):
+    """
+    The options the outputs of a sheet depend on, as recorded in the journal: a sheet is
+    only skipped on resume if it was done with the same ones.
+    """
+    params = {"format": parse_formats(format)}
+    for name, value in sorted(options.items()):
+        params[name] = str(value) if isinstance(value, Path) else value
+    return params
+
+
+def analyze_tmp_tsv(tsv, tmp_dir, out_dir, **kwargs):
+    """
+    analyze_tsv_sentence() on a tsv file of tmp_dir, removed afterwards.
+    The TempDir is kept alive until all its scheduled sheets are done.
+    """
+    try:
+        analyze_tsv_sentence(tsv, out_dir, **kwargs)
+    finally:
+        tsv.unlink()
+
 
 def analyze_tsv_sentence(
     filename,
@@ -135,7 +297,25 @@ def analyze_tsv_sentence(
     draw_square=False,
     font=None,
     translate_tree=True,
+    dpi=DEFAULT_DPI,
+    grayscale=False,
+    colors=None,
+    embed_font=False,
+    max_leaves=None,
+    table=None,
 ):
+    """
+    :param format: name of an output (see outputs.OUTPUTS), or several of them. The sheet
+                   is parsed once for all of them.
+    :param embed_font: svgs embed the subset of the font they use, see BoTree.build_svg()
+    :param max_leaves: larger trees are written in tiles, "<sheet>_tile<n>" being the
+                       subtree replaced in the others by the leaf tiles.stub(n). The
+                       tiles of svgs link to each other. None writes them whole.
+    :param table: TreeTable shared by the sheets analyzed together, so that identical trees
+                  are only rendered once
+    """
+    names = parse_formats(format)
+
     # read the tsv file in a single block
     content = filename.read_text(encoding="utf-8-sig")
 
@@ -143,86 +323,65 @@ def analyze_tsv_sentence(
     tree, version_trees, rules = generate_analysis(
         content, translate_tree=translate_tree
     )
-    if align_leafs:
-        from_roof = tree.height() * 25
-        # add a bit
-        if tree.height() >= 8:
-            from_roof += 25
-    else:
-        from_roof = None
+    from_roof = roof_height(tree) if align_leafs else None
 
     # write rules
     Path(out_dir / f"{filename.stem}_rules.txt").write_text(rules, encoding="utf-8-sig")
 
-    # write others
-    if format == "png":
-        tree.build_png(
-            Path(out_dir / f"{filename.stem}.png"),
-            from_roof=from_roof,
-            draw_square=draw_square,
-            font=font,
-        )
-        if write_all:
-            for num, v in enumerate(version_trees):
-                v.build_png(
-                    Path(out_dir / f"{filename.stem}_version{num + 1}.png"),
-                    from_roof=from_roof,
-                    draw_square=draw_square,
-                    font=font,
-                )
-
-    elif format == "pdf":
-        tree.build_pdf(
-            Path(out_dir / f"{filename.stem}.pdf"),
-            from_roof=from_roof,
-            draw_square=draw_square,
-            font=font,
-        )
-        if write_all:
-            for num, v in enumerate(version_trees):
-                v.build_pdf(
-                    Path(out_dir / f"{filename.stem}_version{num + 1}.pdf"),
-                    from_roof=from_roof,
-                    draw_square=draw_square,
-                    font=font,
-                )
+    # Identical trees, within the sheet or across the sheets sharing the table, are
+    # rendered once and the other files are linked to the first one.
+    if table is None:
+        table = TreeTable()
+    sheet = Sheet(
+        filename.stem,
+        out_dir,
+        tree,
+        version_trees,
+        write_all=write_all,
+        from_roof=from_roof,
+        draw_square=draw_square,
+        font=font,
+        dpi=dpi,
+        grayscale=grayscale,
+        colors=colors,
+        embed_font=embed_font,
+        max_leaves=max_leaves,
+    )
+    for name in names:
+        output = OUTPUTS[name]
+        if output.extension is None:
+            output.write(sheet)
+            continue
 
-    elif format == "svg":
-        Path(out_dir / f"{filename.stem}.svg").write_text(
-            tree.build_svg(font=font), encoding="utf-8-sig"
+        render, links = table.dedupe(
+            [
+                (t, Path(out_dir / f"{filename.stem}{suffix}{output.extension}"))
+                for t, suffix in sheet.trees()
+            ],
+            name,
+            *sheet.params,
+            links=lambda t: sheet.links(t, output.extension),
         )
-        if write_all:
-            for num, v in enumerate(version_trees):
-                Path(out_dir / f"{filename.stem}_version{num + 1}.svg").write_text(
-                    v.build_svg(font=font), encoding="utf-8-sig"
-                )
+        try:
+            output.write(sheet, render)
+        except Exception:
+            table.forget(f for _, f in render)
+            raise
+        table.done(f for _, f in render)
 
-    elif format == "latex":
-        Path(out_dir / f"{filename.stem}.tex").write_text(
-            tree.gen_latex(from_roof=from_roof, draw_square=draw_square, font=font)
-        )
-        if write_all:
-            for num, v in enumerate(version_trees):
-                Path(out_dir / f"{filename.stem}_version{num + 1}.tex").write_text(
-                    v.gen_latex(
-                        from_roof=from_roof, draw_square=draw_square, font=font
-                    ),
-                    encoding="utf-8-sig",
-                )
+        for src, dst in links:
+            table.wait(src)
+            link_file(src, dst)
 
-    elif format == "mshang":
-        mshang = generate_mshang_link(tree)
-        if write_all:
-            mshang += "\n\nextra trees:\n"
-            mshang += "\n\n".join([generate_mshang_link(t) for t in version_trees])
-        Path(out_dir / f"{filename.stem}_mshang.txt").write_text(
-            mshang, encoding="utf-8-sig"
-        )
 
-    else:
-        raise SyntaxError(
-            'allowed formats are: "png" "pdf" "svg", "latex" and "mshang"'
-        )
+def roof_height(tree):
+    """Distance from the root at which the leafs are aligned"""
+    height = measure(tree)[1]
+    from_roof = height * 25
+    # add a bit
+    if height >= 8:
+        from_roof += 25
+    return from_roof
 
 
 def generate_analysis(raw_content, translate_tree=True):
@@ -254,7 +413,6 @@ def generate_analysis(raw_content, translate_tree=True):
     return tree, version_trees, rules
 
 
-# unused
 def generate_trees(raw_content, translate_tree=True):
     rows = list(csv.reader(raw_content.split("\n"), delimiter="\t"))
     rows = strip_empty_rows(rows)
@@ -425,11 +583,63 @@ def normalize_raw_tree(raw_tree, mode='en_bo'):
     return raw_tree
 
 
+def font_path(font=None):
+    return Path(__file__).parent / "fonts" / (font or "monlam_uni_ouchan2.ttf")
+
+
+def gen_latex_preamble(from_roof=None, draw_square=False, font=None):
+    """
+    The part of the documents generated by BoTree.gen_latex() that doesn't depend on the tree.
+    Everything above the endofdump marker can be precompiled in a format (see LatexMkBuilder),
+    the font is loaded below it because XeTeX can't dump native fonts.
+    """
+    preamble = """\\documentclass{article}
+\\usepackage{polyglossia}
+\\usepackage{fontspec} 
+\\usepackage{tikz-qtree}
+"""
+    square = """\\tikzset{edge from parent/.style=
+{draw,
+edge from parent path={(\\tikzparentnode.south)
+-- +(0,-8pt)
+-| (\\tikzchildnode)}}}
+"""
+
+    if from_roof:
+        preamble += (
+            "\\tikzset{frontier/.style={distance from root="
+            + str(from_roof)
+            + "pt}}\n"
+        )
+    if draw_square:
+        preamble += square
+    preamble += f"""
+\\csname endofdump\\endcsname
+\\newfontfamily\\monlam[Path = {font_path(font).parent}/]{{{font_path(font).name}}}
+\\newcommand{{\\bo}}[1]{{\\monlam{{#1}}}}
+"""
+    return preamble
+
+
 class BoTreePrettyPrinter(TreePrettyPrinter):
-    def svg(self, nodecolor="blue", leafcolor="red", funccolor="green", font=None):
+    def svg(
+        self,
+        nodecolor="blue",
+        leafcolor="red",
+        funccolor="green",
+        font=None,
+        subset=None,
+        embed=True,
+        links=None,
+    ):
         """
+        :param subset: FontSubset used instead of font. It is embedded in the svg unless embed
+                       is False, for svgs put together in a page that embeds it once.
+        :param links: leaf -> url, the leaves made links to it (the stubs of tiles)
         :return: SVG representation of a tree.
         """
+        if subset is not None:
+            font = subset.family
         if not font:
             font = "Noto Sans Tibetan"
         fontsize = 12
@@ -450,6 +660,8 @@ class BoTreePrettyPrinter(TreePrettyPrinter):
                 height * vscale + 3 * vstart,
             )
         ]
+        if subset is not None and embed:
+            result.append(f"\t<defs>{subset.style()}</defs>")
 
         children = defaultdict(set)
         for n in self.nodes:
@@ -505,7 +717,7 @@ class BoTreePrettyPrinter(TreePrettyPrinter):
                     color = funccolor
             else:
                 color = "black"
-            result += [
+            text = (
                 '\t<text style="text-anchor: middle; fill: %s; '
                 'font-size: %dpx; font-family: %s" x="%g" y="%g">%s</text>'
                 % (
@@ -516,43 +728,54 @@ class BoTreePrettyPrinter(TreePrettyPrinter):
                     y,
                     escape(node.label() if isinstance(node, Tree) else node),
                 )
-            ]
+            )
+            if links and not isinstance(node, Tree) and node in links:
+                text = '\t<a href="%s">%s</a>' % (escape(links[node]), text.strip())
+            result.append(text)
 
         result += ["</svg>"]
         return "\n".join(result)
 
 
 class BoTree(Tree):
-    def build_svg(self, sentence=None, highlight=(), font=None):
+    def build_svg(
+        self,
+        sentence=None,
+        highlight=(),
+        font=None,
+        embed_font=False,
+        subset=None,
+        links=None,
+    ):
         """
         Pretty-print this tree as .svg
         For explanation of the arguments, see the documentation for
         `nltk.treeprettyprinter.TreePrettyPrinter`.
+
+        :param embed_font: embed the subset of the font file `font` (the Monlam font by default)
+                           covering the tree, so that the svg renders the same everywhere
+        :param subset: FontSubset shared by a batch of trees (see batch_subset()). Without
+                       embed_font, the svg uses it but expects the page to embed it.
+        :param links: leaf -> url, see BoTreePrettyPrinter.svg()
         """
-        return BoTreePrettyPrinter(self, sentence, highlight).svg(font=font)
+        if embed_font and subset is None:
+            subset = font_subset(tree_text([self]), font=font)
+        return BoTreePrettyPrinter(self, sentence, highlight).svg(
+            font=font if subset is None else None,
+            subset=subset,
+            embed=embed_font,
+            links=links,
+        )
 
     def gen_latex(self, from_roof=None, draw_square=False, font=None):
         qtree = self.pformat_latex_qtree()
         qtree = re.sub(r"([^a-zA-Z\[\].\s\\_]+)", r"\\bo{\1}", qtree)
-        header1 = """\\documentclass{article}
-\\usepackage{polyglossia}
-\\usepackage{fontspec} 
-\\usepackage{tikz-qtree}
-
-\\newfontfamily\\monlam[Path = """
-
-        if font:
-            header2 = "/fonts/]{" + font
-        else:
-            header2 = "/fonts/]{monlam_uni_ouchan2.ttf"
-        header2 += """}
-\\newcommand{\\bo}[1]{\\monlam{#1}}
-
+        body = """
 \\begin{document}
 
 \\hoffset=-1in
 \\voffset=-1in
-\\setbox0\hbox{
+\\setbox0\\hbox{
 \\begin{tikzpicture}
 \\tikzset{every tree node/.style={align=center,anchor=north}}
 """
@@ -565,21 +788,10 @@ class BoTree(Tree):
 
 
 \\stop"""
-        square = """\\tikzset{edge from parent/.style=
-{draw,
-edge from parent path={(\\tikzparentnode.south)
--- +(0,-8pt)
--| (\\tikzchildnode)}}}"""
-
-        if from_roof:
-            header2 += (
-                "\\tikzset{frontier/.style={distance from root="
-                + str(from_roof)
-                + "pt}}\n"
-            )
-        if draw_square:
-            header2 += square
-        document = header1 + str(Path(__file__).parent) + header2 + qtree + footer
+        preamble = gen_latex_preamble(
+            from_roof=from_roof, draw_square=draw_square, font=font
+        )
+        document = preamble + body + qtree + footer
         document = document.replace("\\", "\\")
         return document
 
@@ -589,13 +801,20 @@ edge from parent path={(\\tikzparentnode.south)
         source = self.gen_latex(from_roof=from_roof, draw_square=draw_square, font=font)
         bld_cls = lambda: LatexMkBuilder()
         builder = bld_cls()
-        pdf = builder.build_pdf(source, texinputs)
+        pdf = builder.build_pdf(source, texinputs, depends=[font_path(font)])
         pdf.save_to(filename)
 
-    def build_png(self, filename, from_roof=None, draw_square=False, font=None):
+    def build_png(
+        self,
+        filename,
+        from_roof=None,
+        draw_square=False,
+        font=None,
+        dpi=DEFAULT_DPI,
+        grayscale=False,
+        colors=None,
+    ):
         source = self.gen_latex(from_roof=from_roof, draw_square=draw_square, font=font)
-        bld_cls = lambda: LatexMkBuilder()
-        builder = bld_cls()
-        pdf = builder.build_pdf(source, [])
-        png = convert_from_bytes(bytes(pdf), fmt="png")[0]
-        png.save(filename)
+        builder = LatexMkBuilder()
+        pdf = builder.build_pdf(source, [], depends=[font_path(font)])
+        write_png(pdf, filename, dpi=dpi, grayscale=grayscale, colors=colors)
@@ -0,0 +1,78 @@
+import csv
+from io import StringIO
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+# errors of a sheet that can't be parsed, as raised by generate_trees() and generate_analysis()
+SHEET_ERRORS = (SyntaxError, AssertionError, ValueError, IndexError)
+
+
+def iter_workbooks(in_dir):
+    """
+    The workbooks found in in_dir, as (name, path) pairs:
+     - .xlsx files
+     - folders of .tsv files, as written by xlsx_to_tsv()
+     - the .tsv files directly in in_dir, grouped under the name of in_dir
+    """
+    in_dir = Path(in_dir)
+    if list(in_dir.glob("*.tsv")):
+        yield in_dir.name, in_dir
+    for path in sorted(in_dir.iterdir()):
+        if path.suffix == ".xlsx" and not path.name.startswith("~$"):
+            yield path.stem, path
+        elif path.is_dir() and list(path.glob("*.tsv")):
+            yield path.name, path
+
+
+def iter_workbook_sheets(path, header_sheets=0):
+    """Yields (sheet_name, content) for every sheet of a workbook, content being tsv"""
+    path = Path(path)
+    if path.is_dir():
+        for tsv in sorted(path.glob("*.tsv")):
+            yield tsv.stem, tsv.read_text(encoding="utf-8-sig")
+    elif path.suffix == ".xlsx":
+        workbook = load_workbook(filename=path, read_only=True)
+        try:
+            for name in workbook.sheetnames[header_sheets:]:
+                yield name, rows_to_tsv(workbook[name].values)
+        finally:
+            workbook.close()
+    elif path.suffix == ".tsv":
+        yield path.stem, path.read_text(encoding="utf-8-sig")
+    else:
+        raise NotImplementedError
+
+
+def iter_sheets(in_dir, header_sheets=0):
+    """Yields (workbook, sheet_name, content) for every sheet of in_dir, one at a time"""
+    for workbook, path in iter_workbooks(in_dir):
+        for sheet, content in iter_workbook_sheets(path, header_sheets=header_sheets):
+            yield workbook, sheet, content
+
+
+def iter_trees(sheets, translate_tree="en_bo", on_error=None):
+    """
+    Yields (workbook, sheet_name, tree, version_trees) for every sheet of sheets, an iterable
+    of (workbook, sheet_name, content) like iter_sheets(). The sheets that can't be parsed
+    are reported and skipped, calling on_error(workbook, sheet_name) if given.
+    """
+    from .analysis import generate_trees  # analysis imports this module
+
+    for workbook, sheet, content in sheets:
+        try:
+            tree, version_trees = generate_trees(content, translate_tree=translate_tree)
+        except SHEET_ERRORS as e:
+            print(f"\t{workbook}/{sheet}: {e}")
+            if on_error is not None:
+                on_error(workbook, sheet)
+            continue
+        yield workbook, sheet, tree, version_trees
+
+
+def rows_to_tsv(rows, lineterminator="\n"):
+    out = StringIO()
+    writer = csv.writer(out, delimiter="\t", lineterminator=lineterminator)
+    for row in rows:
+        writer.writerow(["" if cell is None else cell for cell in row])
+    return out.getvalue()
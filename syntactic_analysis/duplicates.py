@@ -0,0 +1,252 @@
+import csv
+import random
+import zlib
+from collections import defaultdict, namedtuple
+from difflib import SequenceMatcher
+from hashlib import sha1
+from operator import eq
+
+from .corpus import iter_sheets
+
+MASK = (1 << 64) - 1
+# entries kept per LSH bucket: formulaic sentences would otherwise make some buckets as
+# large as the corpus. The first entries are kept, the annotated sheets being added first.
+MAX_BUCKET = 64
+
+Match = namedtuple("Match", "key kind similarity words rows")
+
+
+def normalize(word):
+    """Words compared without the spaces and the tsek they end with"""
+    return word.replace("_", " ").strip().rstrip("་").strip()
+
+
+def sheet_words_n_rows(content):
+    """
+    The words of the "W" row of a sheet and the bracket rows above the "P" row, the first
+    column (the markers) included. (None, None) if the sheet has no "P" or "W" row.
+    """
+    rows = list(csv.reader(content.split("\n"), delimiter="\t"))
+    markers = [row[0] if row else "" for row in rows]
+    if "P" not in markers or "W" not in markers:
+        return None, None
+    p, w = markers.index("P"), markers.index("W")
+    words = [c for c in rows[w][1:] if c.strip()]
+    tree_rows = [row for row in rows[:p] if "".join(row[1:]).strip()]
+    return words, tree_rows
+
+
+class MinHasher:
+    """
+    MinHash signatures of the sets of word n-grams of sentences. The n-grams are hashed
+    once to well mixed 64 bits values, and each hash function of the signature xors them
+    with its own random mask, which is much cheaper than affine permutations in Python.
+    Words are hashed with crc32 and the masks are seeded, so signatures are the same in
+    every process.
+    """
+
+    def __init__(self, num_perm=32, shingle_size=2, seed=1):
+        rng = random.Random(seed)
+        self.masks = [rng.getrandbits(64) for _ in range(num_perm)]
+        self.shingle_size = shingle_size
+        self._hashes = {}
+
+    def word_hash(self, word):
+        h = self._hashes.get(word)
+        if h is None:
+            h = self._hashes[word] = zlib.crc32(word.encode("utf-8"))
+        return h
+
+    def shingles(self, words):
+        hashes = [self.word_hash(w) for w in words]
+        n = min(self.shingle_size, len(hashes))
+        shingles = set()
+        for i in range(len(hashes) - n + 1):
+            h = 0
+            for x in hashes[i : i + n]:
+                h = (h * 1000003 ^ x) & MASK
+            shingles.add(mix(h))
+        return shingles
+
+    def signature(self, words):
+        shingles = self.shingles(words)
+        if not shingles:
+            return ()
+        return tuple(min([s ^ m for s in shingles]) for m in self.masks)
+
+
+def mix(h):
+    """Finalizer of MurmurHash3: spreads every bit of h over the 64 bits"""
+    h = ((h ^ (h >> 33)) * 0xFF51AFD7ED558CCD) & MASK
+    h = ((h ^ (h >> 33)) * 0xC4CEB9FE1A85EC53) & MASK
+    return h ^ (h >> 33)
+
+
+def similarity(sig1, sig2):
+    """Estimate of the Jaccard similarity of the shingles of two signatures"""
+    if not sig1 or not sig2:
+        return 0.0
+    return sum(map(eq, sig1, sig2)) / len(sig1)
+
+
+class DuplicateIndex:
+    """
+    Finds the sentences already seen that are identical or similar to a new one: exact
+    duplicates by the hash of their words, near duplicates by locality-sensitive hashing
+    of their MinHash signatures, split in bands. Only the sentences of the candidate buckets
+    are compared, so a query costs about the same whatever the size of the index.
+
+    Sentences come from the annotated sheets (with their bracket rows, to pre-fill the
+    sheets of their duplicates) and from the texts being prepared.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=32, bands=8, shingle_size=2):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        # id -> key, signature, words and bracket rows of the sentences
+        self.keys, self.signatures, self.words, self.rows = [], [], [], []
+        self.exact = {}  # digest of the words -> id
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def digest(words):
+        return sha1("\t".join(words).encode("utf-8")).digest()
+
+    def _bands(self, signature):
+        r = self.rows_per_band
+        for b in range(self.bands):
+            yield b, signature[b * r : (b + 1) * r]
+
+    def query(self, words, signature=None):
+        """
+        :param words: normalized words of a sentence
+        :return: the Match of the closest sentence, or None if none is similar enough.
+                 Annotated sheets are preferred over the sentences of equal similarity.
+        """
+        i = self.exact.get(self.digest(words))
+        if i is not None:
+            return Match(self.keys[i], "exact", 1.0, self.words[i], self.rows[i])
+
+        signature = self.hasher.signature(words) if signature is None else signature
+        candidates = set()
+        for b, band in self._bands(signature):
+            candidates.update(self.buckets[b].get(band, ()))
+        best, best_score = None, None
+        for i in candidates:
+            score = (
+                similarity(signature, self.signatures[i]),
+                self.rows[i] is not None,
+            )
+            if score[0] >= self.threshold and (best is None or score > best_score):
+                best, best_score = i, score
+        if best is None:
+            return None
+        return Match(
+            self.keys[best], "near", best_score[0], self.words[best], self.rows[best]
+        )
+
+    def add(self, key, words, rows=None, signature=None):
+        """
+        Indexes a sentence. Exact duplicates of a sentence already indexed are not added.
+        :param rows: the bracket rows of its sheet, if it is annotated
+        """
+        digest = self.digest(words)
+        if digest in self.exact:
+            return self.exact[digest]
+        signature = self.hasher.signature(words) if signature is None else signature
+        i = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        self.words.append(words)
+        self.rows.append(rows)
+        self.exact[digest] = i
+        for b, band in self._bands(signature):
+            bucket = self.buckets[b][band]
+            if len(bucket) < MAX_BUCKET:
+                bucket.append(i)
+        return i
+
+    def check(self, key, words, rows=None):
+        """Queries the index for a sentence, then adds it. :return: the Match or None"""
+        words = [normalize(w) for w in words]
+        signature = self.hasher.signature(words)
+        match = self.query(words, signature)
+        self.add(key, words, rows, signature)
+        return match
+
+    def add_corpus(self, in_dir, header_sheets=0):
+        """
+        Indexes the annotated sheets of in_dir, read one at a time.
+        :return: the amount of sheets indexed
+        """
+        added = 0
+        for workbook, sheet, content in iter_sheets(
+            in_dir, header_sheets=header_sheets
+        ):
+            words, rows = sheet_words_n_rows(content)
+            if not words or not rows:
+                continue
+            self.add(f"{workbook}/{sheet}", [normalize(w) for w in words], rows)
+            added += 1
+        return added
+
+    @classmethod
+    def from_corpus(cls, in_dir, header_sheets=0, **kwargs):
+        index = cls(**kwargs)
+        index.add_corpus(in_dir, header_sheets=header_sheets)
+        return index
+
+
+def row_spans(row):
+    """(start, end, label) of the constituents of a bracket row, end included"""
+    spans, start, label = [], None, None
+    for num, cell in enumerate(row):
+        cell = cell.strip()
+        if cell.startswith("[") and cell.endswith("]"):
+            spans.append((num, num, cell[1:-1]))
+        elif cell.startswith("["):
+            start, label = num, cell[1:]
+        elif cell == "]" and start is not None:
+            spans.append((start, num, label))
+            start = None
+    return spans
+
+
+def project_rows(rows, old_words, new_words):
+    """
+    Bracket rows of a sheet moved onto the words of a similar sentence: the words both
+    sentences share are aligned and every constituent spans the new words between its
+    first and last aligned words. Constituents without aligned words are left out.
+    :param rows: bracket rows, with the column of the markers
+    :return: bracket rows for new_words, with the column of the markers
+    """
+    if old_words == new_words:
+        return [row[: len(new_words) + 1] for row in rows]
+    mapping = {}
+    matcher = SequenceMatcher(None, old_words, new_words, autojunk=False)
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            mapping[a + k] = b + k
+
+    projected = []
+    for row in rows:
+        new_row = [""] * len(new_words)
+        for start, end, label in row_spans(row[1:]):
+            aligned = [mapping[i] for i in range(start, end + 1) if i in mapping]
+            if not aligned:
+                continue
+            if aligned[0] == aligned[-1]:
+                new_row[aligned[0]] = f"[{label}]"
+            else:
+                new_row[aligned[0]] = f"[{label}"
+                new_row[aligned[-1]] = "]"
+        if any(new_row):
+            projected.append([""] + new_row)
+    return projected
@@ -0,0 +1,161 @@
+import json
+import re
+from pathlib import Path
+
+from nltk.tree import Tree
+
+from .corpus import iter_sheets, iter_trees
+
+FORMATS = {"penn": ".mrg", "jsonl": ".jsonl", "conll": ".conll"}
+# size of the output files, a new shard is started above it
+MAX_BYTES = 64 * 1024 * 1024
+
+PENN_ESCAPES = {"(": "-LRB-", ")": "-RRB-"}
+
+
+class ShardedWriter:
+    """Writes <name>-00000<suffix>, <name>-00001<suffix>... each one holding at most max_bytes."""
+
+    def __init__(self, out_dir, name, suffix, max_bytes=MAX_BYTES):
+        self.out_dir, self.name, self.suffix = Path(out_dir), name, suffix
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.file = None
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        if self.file is None or (self.size and self.size + len(data) > self.max_bytes):
+            self._next_shard()
+        self.file.write(data)
+        self.size += len(data)
+
+    def _next_shard(self):
+        self.close()
+        path = self.out_dir / f"{self.name}-{len(self.shards):05}{self.suffix}"
+        self.shards.append(path)
+        self.file = path.open("wb")
+        self.size = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def strip_version(label):
+    return re.sub(r"--extra\d+$", "", label)
+
+
+def penn_escape(text):
+    return "".join(PENN_ESCAPES.get(c, c) for c in text)
+
+
+def to_penn(tree):
+    """The tree on a single line, with brackets in labels and words escaped as in the Penn Treebank"""
+    if not isinstance(tree, Tree):
+        return penn_escape(tree)
+    children = " ".join(to_penn(child) for child in tree)
+    return f"({penn_escape(strip_version(tree.label()))} {children})"
+
+
+def words_and_pos(tree):
+    return [word for word, _ in tree.pos()], [pos for _, pos in tree.pos()]
+
+
+def parse_bits(tree):
+    """
+    The CoNLL-2012 parse column: for every word, the constituents opening at it, "*" for the word,
+    and the constituents closing after it. POS tags are in their own column.
+    """
+    opening = [""] * len(tree.leaves())
+    closing = [""] * len(tree.leaves())
+
+    def walk(node, start):
+        end = start
+        for child in node:
+            end = walk(child, end) if isinstance(child, Tree) else end + 1
+        if node.height() > 2:
+            # parents are reached after their children, so they go in front
+            opening[start] = f"({strip_version(node.label())}" + opening[start]
+            closing[end - 1] += ")"
+        return end
+
+    walk(tree, 0)
+    return [o + "*" + c for o, c in zip(opening, closing)]
+
+
+def to_conll(tree, sheet_id, version, labels):
+    lines = [f"# sent_id = {sheet_id}", f"# version = {version}"]
+    if labels:
+        lines.append(f"# labels = {labels}")
+    words, pos = words_and_pos(tree)
+    for num, (word, tag, bit) in enumerate(zip(words, pos, parse_bits(tree))):
+        lines.append(f"{num + 1}\t{word}\t{tag}\t{bit}")
+    return "\n".join(lines) + "\n\n"
+
+
+def to_jsonl(tree, workbook, sheet, version, labels):
+    words, pos = words_and_pos(tree)
+    record = {
+        "id": f"{workbook}/{sheet}",
+        "workbook": workbook,
+        "sheet": sheet,
+        "version": version,
+        "labels": labels,
+        "words": words,
+        "pos": pos,
+        "tree": to_penn(tree),
+    }
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_corpus(
+    in_dir,
+    out_dir,
+    formats=("penn", "jsonl", "conll"),
+    header_sheets=0,
+    translate_tree="en_bo",
+    versions=True,
+    max_bytes=MAX_BYTES,
+    name="treebank",
+):
+    """
+    Exports the trees of all the sheets of in_dir in a single pass, without rendering anything.
+    The main tree of each sheet is version 0, the trees of the simplified sentences follow.
+    Sheets that can't be parsed are skipped.
+
+    :param formats: any of "penn" (one tree per line), "jsonl" and "conll"
+    :param translate_tree: direction in which the labels are translated, recorded in the outputs
+    :return: {format: [shard files]}
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for f in formats:
+        if f not in FORMATS:
+            raise SyntaxError(f"allowed formats are: {', '.join(FORMATS)}")
+    writers = {f: ShardedWriter(out_dir, name, FORMATS[f], max_bytes) for f in formats}
+    labels = translate_tree or ""
+
+    try:
+        sheets = iter_sheets(in_dir, header_sheets=header_sheets)
+        for workbook, sheet, tree, version_trees in iter_trees(
+            sheets, translate_tree=translate_tree
+        ):
+            trees = [tree] + (version_trees if versions else [])
+            for version, t in enumerate(trees):
+                if "penn" in writers:
+                    writers["penn"].write(to_penn(t) + "\n")
+                if "jsonl" in writers:
+                    writers["jsonl"].write(
+                        to_jsonl(t, workbook, sheet, version, labels)
+                    )
+                if "conll" in writers:
+                    writers["conll"].write(
+                        to_conll(t, f"{workbook}/{sheet}", version, labels)
+                    )
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {f: w.shards for f, w in writers.items()}
@@ -0,0 +1,44 @@
+import os
+import secrets
+import shutil
+import stat
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def atomic_file(filename):
+    """
+    Yields a temporary path next to filename, that replaces filename once written. A file
+    replaced keeps its mode, a new one gets the mode open() would give it.
+    """
+    filename = Path(filename)
+    while True:
+        tmp = filename.parent / f".{filename.name}.{secrets.token_hex(4)}.tmp"
+        try:
+            # unlike mkstemp(), which makes it private, the umask applies
+            os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            break
+        except FileExistsError:
+            continue
+    try:
+        if filename.is_file():
+            os.chmod(tmp, stat.S_IMODE(filename.stat().st_mode))
+        yield tmp
+        os.replace(tmp, filename)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def link_file(src, dst):
+    """Hard links dst to src, or copies src where hard links are not supported."""
+    src, dst = Path(src), Path(dst)
+    if src == dst:
+        return
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
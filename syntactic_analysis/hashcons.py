@@ -0,0 +1,98 @@
+import threading
+
+from nltk.tree import Tree
+
+
+class TreeTable:
+    """
+    Hash-consing of trees: structurally identical subtrees are interned as a single object,
+    within a tree and across all the trees interned in the same table.
+    Two interned trees are equal if and only if they are the same object.
+
+    The table also remembers the file each distinct tree was rendered to, so that an identical
+    tree met later (the same tree or version in another sheet) is linked to it instead
+    of being rendered again. Sheets rendered concurrently wait for the renders they link to.
+    """
+
+    def __init__(self):
+        # (label, child ids or words) -> interned node
+        self.nodes = {}
+        # (id of interned tree, render parameters...) -> first file rendered
+        self.rendered = {}
+        # file -> Event set once it is rendered (or failed)
+        self.events = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def intern(self, tree):
+        """:return: the interned copy of tree, an instance of the same class"""
+        with self.lock:
+            return self._intern(tree)
+
+    def _intern(self, tree):
+        children = [
+            self._intern(child) if isinstance(child, Tree) else child for child in tree
+        ]
+        label = tree.label()
+        key = (
+            label,
+            tuple(id(c) if isinstance(c, Tree) else c for c in children),
+        )
+        node = self.nodes.get(key)
+        if node is None:
+            # interned nodes are kept alive by the table, so their ids stay unique
+            node = self.nodes[key] = type(tree)(label, children)
+        return node
+
+    def dedupe(self, outputs, *params, links=None):
+        """
+        Splits the outputs to write into those that need rendering and those that are
+        copies of a tree already rendered with the same parameters. The trees are compared
+        with their root label, the suffix of version trees included.
+
+        :param outputs: list of (tree, filename)
+        :param params: the render parameters, all hashable
+        :param links: function giving the {leaf: filename} a tree links to (see
+                      Sheet.links()), so that tiles are only identical if their stubs
+                      link to the same files
+        :return: [(tree, filename)] to render, [(rendered filename, filename)] to link
+        """
+        render, linked = [], []
+        with self.lock:
+            for tree, filename in outputs:
+                key = (id(self._intern(tree)),) + params
+                if links is not None:
+                    key += (tuple(sorted(links(tree).items())),)
+                if key in self.rendered:
+                    linked.append((self.rendered[key], filename))
+                else:
+                    self.rendered[key] = filename
+                    self.events[filename] = threading.Event()
+                    render.append((tree, filename))
+        return render, linked
+
+    def done(self, filenames):
+        """Marks the files returned to render by dedupe() as written"""
+        with self.lock:
+            for filename in filenames:
+                self.events.pop(filename).set()
+
+    def forget(self, filenames):
+        """Forgets renders that failed, so that identical trees are rendered again."""
+        filenames = set(filenames)
+        with self.lock:
+            self.rendered = {
+                k: f for k, f in self.rendered.items() if f not in filenames
+            }
+            for filename in filenames:
+                if filename in self.events:
+                    self.events.pop(filename).set()
+
+    def wait(self, filename):
+        """Waits until a file being rendered in another thread is written"""
+        with self.lock:
+            event = self.events.get(filename)
+        if event is not None:
+            event.wait()
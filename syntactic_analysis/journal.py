@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+JOURNAL = ".journal.jsonl"
+# longest error message kept, LatexBuildError holds the whole log
+MAX_ERROR = 2000
+
+
+class Journal:
+    """
+    Append-only record of the sheets processed in an output folder.
+    Each line is a json object: {"sheet": ..., "status": "done" | "failed", "error": ...,
+    "time": ..., "params": ...}
+    The last line written for a sheet is its current status.
+
+    params are the options the outputs depend on (formats, fonts...). On resume, only the
+    lines written with the same params count: a sheet done for other outputs is done again.
+    Without params, all the lines count.
+    """
+
+    def __init__(self, filename, resume=True, params=None):
+        self.filename = Path(filename)
+        # as read back from the journal
+        self.params = None if params is None else json.loads(json.dumps(params))
+        self.status = {}
+        self.errors = {}
+        # sheets can be run from several threads, see Scheduler
+        self.lock = threading.Lock()
+        if resume and self.filename.is_file():
+            for line in self.filename.read_text(encoding="utf-8").split("\n"):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # empty line or line cut by an interrupted run
+                    continue
+                if self.params is None or entry.get("params") == self.params:
+                    self._update(entry)
+        else:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            self.filename.write_text("", encoding="utf-8")
+
+    def _update(self, entry):
+        self.status[entry["sheet"]] = entry["status"]
+        if entry["status"] == "failed":
+            self.errors[entry["sheet"]] = entry.get("error")
+        else:
+            self.errors.pop(entry["sheet"], None)
+
+    def is_done(self, sheet):
+        return self.status.get(sheet) == "done"
+
+    def record(self, sheet, status, error=None):
+        entry = {"sheet": sheet, "status": status, "time": time.time()}
+        if error is not None:
+            entry["error"] = error[:MAX_ERROR]
+        if self.params is not None:
+            entry["params"] = self.params
+        with self.lock:
+            self._update(entry)
+            with self.filename.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def failed(self):
+        return dict(self.errors)
+
+    def run(self, sheet, func, *args, **kwargs):
+        """
+        Calls func and records its outcome. Exceptions are recorded and printed, not raised.
+        :return: True if func succeeded
+        """
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"\tFAILED {sheet}: {error[:200]}")
+            self.record(sheet, "failed", error)
+            return False
+        self.record(sheet, "done")
+        return True
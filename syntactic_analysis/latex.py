@@ -4,6 +4,7 @@ import platform
 import subprocess
 from subprocess import CalledProcessError
 import re
+from hashlib import sha1
 
 from future.utils import raise_from
 from data import Data as I
@@ -13,6 +14,13 @@ from tempdir import TempDir
 # Adapted and simplified from latex package
 
 
+FORMAT_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "bo-constituency-analysis"
+    / "formats"
+)
+
+
 class LatexMkBuilder(object):
     """A latexmk based builder for LaTeX files.
 
@@ -23,17 +31,106 @@ class LatexMkBuilder(object):
 
     The build process consists of copying the source file to a temporary
     directory and running latexmk on it, which will take care of reruns.
+
+    When ``use_format`` is set, the preamble of the source (everything above
+    ``\\begin{document}``) is dumped once in a format file with
+    `mylatexformat <https://ctan.org/pkg/mylatexformat>`_, and the following
+    builds sharing the same preamble start from it instead of loading all the
+    packages again. Formats are cached in ``format_dir``, keyed by the preamble,
+    the TeX version and the files listed in ``depends``. If dumping fails, the
+    plain build is used.
     """
 
-    def __init__(self):
+    # the keys for which dumping a format failed in this process
+    failed_formats = set()
+
+    def __init__(self, use_format=True, format_dir=None):
         # The path to the ``xelatex`` binary (will be looked up on ``$PATH``).
         self.xelatex = "xelatex"
+        self.use_format = use_format
+        self.format_dir = Path(format_dir) if format_dir else FORMAT_DIR
+        self._tex_version = None
+
+    def tex_version(self):
+        if self._tex_version is None:
+            self._tex_version = bytes.decode(
+                subprocess.check_output([self.xelatex, "--version"])
+            )
+        return self._tex_version
+
+    def format_key(self, source, depends=()):
+        preamble, sep, _ = source.partition("\\begin{document}")
+        if not sep:
+            return None
+
+        key = sha1()
+        key.update(self.tex_version().encode("utf-8"))
+        key.update(preamble.encode("utf-8"))
+        for dep in depends:
+            stat = Path(dep).stat()
+            key.update(
+                f"{Path(dep).resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+            )
+        return key.hexdigest()
+
+    def get_format(self, source, depends=()):
+        """Returns the name of the format to use for ``source``, dumping it if needed.
+
+        :return: the name of the format, to be found in ``format_dir``, or ``None``
+                 if the source can't be built from a format.
+        """
+        try:
+            key = self.format_key(source, depends=depends)
+        except (OSError, CalledProcessError):
+            return None
+        if key is None or key in self.failed_formats:
+            return None
+
+        name = f"bo-{key}"
+        if (self.format_dir / f"{name}.fmt").is_file():
+            return name
+
+        self.format_dir.mkdir(parents=True, exist_ok=True)
+        with TempDir() as tmpdir:
+            Path(tmpdir, "preamble.tex").write_text(source, encoding="utf-8")
+            args = [
+                self.xelatex,
+                "-ini",
+                f"-jobname={name}",
+                "&xelatex",
+                "mylatexformat.ltx",
+                "preamble.tex",
+            ]
+            try:
+                subprocess.check_call(
+                    args,
+                    cwd=tmpdir,
+                    stdin=open(os.devnull, "r"),
+                    stdout=open(os.devnull, "w"),
+                    stderr=open(os.devnull, "w"),
+                )
+            except (OSError, CalledProcessError):
+                self.failed_formats.add(key)
+                return None
+
+            fmt = Path(tmpdir, f"{name}.fmt")
+            if not fmt.is_file():
+                self.failed_formats.add(key)
+                return None
+            # atomic, concurrent builders may be dumping the same format
+            os.replace(fmt, self.format_dir / f"{name}.fmt")
+
+        return name
 
     @data("source")
-    def build_pdf(self, source, texinputs=[]):
+    def build_pdf(self, source, texinputs=[], depends=()):
         texinputs.append(
             bytes.decode(subprocess.check_output(["which", "xelatex"])).strip()
         )
+        fmt = None
+        if self.use_format:
+            fmt = self.get_format(str(source), depends=depends)
+
         with TempDir() as tmpdir, source.temp_saved(suffix=".latex", dir=tmpdir) as tmp:
 
             # close temp file, so other processes can access it also on Windows
@@ -48,20 +145,38 @@ class LatexMkBuilder(object):
             newenv = os.environ.copy()
             newenv["TEXINPUTS"] = os.pathsep.join(texinputs) + os.pathsep
 
+            if fmt:
+                try:
+                    self.run(
+                        args[:1] + [f"-fmt={fmt}"] + args[1:],
+                        tmpdir,
+                        {
+                            **newenv,
+                            "TEXFORMATS": str(self.format_dir) + os.pathsep,
+                        },
+                    )
+                    return I(open(output_fn, "rb").read(), encoding=None)
+                except CalledProcessError:
+                    # fall back on the full build
+                    pass
+
             try:
-                subprocess.check_call(
-                    args,
-                    cwd=tmpdir,
-                    env=newenv,
-                    stdin=open(os.devnull, "r"),
-                    stdout=open(os.devnull, "w"),
-                    stderr=open(os.devnull, "w"),
-                )
+                self.run(args, tmpdir, newenv)
             except CalledProcessError as e:
                 raise_from(LatexBuildError(base_fn + ".log"), e)
 
             return I(open(output_fn, "rb").read(), encoding=None)
 
+    def run(self, args, cwd, env):
+        subprocess.check_call(
+            args,
+            cwd=cwd,
+            env=env,
+            stdin=open(os.devnull, "r"),
+            stdout=open(os.devnull, "w"),
+            stderr=open(os.devnull, "w"),
+        )
+
 
 class LatexBuildError(Exception):
     """LaTeX call exception."""
@@ -0,0 +1,368 @@
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter, defaultdict
+from hashlib import sha1
+
+from .corpus import iter_sheets, iter_trees
+from .file_utils import atomic_file
+
+MAGIC = b"BOLX"
+VERSION = 1
+# version, words, POS, sheets, postings, and the sizes of the word, POS and sheet blobs
+HEADER = struct.Struct("<4s8I")
+DIGEST_SIZE = 20
+
+
+class Lexicon:
+    """
+    Words of the analyzed sheets with their POS, kept per sheet so that sheets can be
+    updated or removed. Saved as a LexiconIndex, from which it can be loaded back.
+    """
+
+    def __init__(self):
+        # sheet id -> (sha1 of the sheet content, Counter of (word, POS))
+        self.sheets = {}
+
+    def __len__(self):
+        return len(self.sheets)
+
+    def add_sheet(self, sheet, tree, digest=b""):
+        """Adds the words of a tree, replacing those previously added for the same sheet"""
+        self.sheets[sheet] = (digest, Counter(tree.pos()))
+
+    def remove_sheet(self, sheet):
+        self.sheets.pop(sheet, None)
+
+    def entries(self):
+        """{word: {sheet id: Counter of POS}}"""
+        entries = defaultdict(dict)
+        for sheet, (_, words) in self.sheets.items():
+            for (word, pos), count in words.items():
+                entries[word].setdefault(sheet, Counter())[pos] += count
+        return entries
+
+    def conflicts(self):
+        """
+        Words tagged with more than one POS, the most divergent first (the ones whose
+        less frequent POS are the most frequent).
+        :return: list of {"word": ..., "pos": {POS: count}, "sheets": {POS: [sheet ids]}}
+        """
+        conflicts = []
+        for word, sheets in self.entries().items():
+            total = Counter()
+            by_pos = defaultdict(list)
+            for sheet, counts in sorted(sheets.items()):
+                total.update(counts)
+                for pos in counts:
+                    by_pos[pos].append(sheet)
+            if len(total) > 1:
+                conflicts.append(
+                    {"word": word, "pos": dict(total.most_common()), "sheets": by_pos}
+                )
+        conflicts.sort(
+            key=lambda c: (
+                -(sum(c["pos"].values()) - max(c["pos"].values())),
+                c["word"],
+            )
+        )
+        return conflicts
+
+    def update_corpus(self, in_dir, header_sheets=0, translate_tree="en_bo"):
+        """
+        Brings the lexicon up to date with in_dir: only the sheets whose content changed are
+        parsed again, and the sheets that are gone are removed.
+        :return: the amount of sheets (updated, removed)
+        """
+        seen, digests = set(), {}
+
+        def changed():
+            for workbook, sheet, content in iter_sheets(
+                in_dir, header_sheets=header_sheets
+            ):
+                sheet_id = f"{workbook}/{sheet}"
+                seen.add(sheet_id)
+                digest = sha1(content.encode("utf-8")).digest()
+                if sheet_id not in self.sheets or self.sheets[sheet_id][0] != digest:
+                    digests[sheet_id] = digest
+                    yield workbook, sheet, content
+
+        updated = 0
+        for workbook, sheet, tree, _ in iter_trees(
+            changed(),
+            translate_tree=translate_tree,
+            on_error=lambda workbook, sheet: self.remove_sheet(f"{workbook}/{sheet}"),
+        ):
+            sheet_id = f"{workbook}/{sheet}"
+            self.add_sheet(sheet_id, tree, digests[sheet_id])
+            updated += 1
+
+        removed = self.sheets.keys() - seen
+        for sheet_id in removed:
+            self.remove_sheet(sheet_id)
+        return updated, len(removed)
+
+    def save(self, filename):
+        """
+        Writes the lexicon as a sorted string table (see LexiconIndex), in little endian:
+
+            header
+            word offsets, posting offsets    uint32 * (words + 1)
+            postings                         uint32 * 3 * postings: (POS id, sheet id, count)
+            POS offsets                      uint32 * (POS + 1)
+            sheet offsets                    uint32 * (sheets + 1)
+            sheet digests                    20 bytes * sheets
+            words, POS, sheet ids            utf-8 blobs
+
+        Words are sorted by their utf-8 bytes, which is also the order of their code points.
+        """
+        sheet_names = sorted(self.sheets)
+        sheet_ids = {s: i for i, s in enumerate(sheet_names)}
+        entries = self.entries()
+        pos_names = sorted(
+            {p for sheets in entries.values() for c in sheets.values() for p in c}
+        )
+        pos_ids = {p: i for i, p in enumerate(pos_names)}
+
+        words = sorted(entries, key=lambda w: w.encode("utf-8"))
+        postings = array("I")
+        posting_offsets = array("I", [0])
+        for word in words:
+            for sheet, counts in sorted(entries[word].items()):
+                for pos, count in sorted(counts.items()):
+                    postings.extend((pos_ids[pos], sheet_ids[sheet], count))
+            posting_offsets.append(len(postings) // 3)
+
+        word_offsets, word_blob = blob(words)
+        pos_offsets, pos_blob = blob(pos_names)
+        sheet_offsets, sheet_blob = blob(sheet_names)
+        digests = b"".join(
+            self.sheets[s][0].ljust(DIGEST_SIZE, b"\0") for s in sheet_names
+        )
+
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            len(words),
+            len(pos_names),
+            len(sheet_names),
+            len(postings) // 3,
+            len(word_blob),
+            len(pos_blob),
+            len(sheet_blob),
+        )
+        with atomic_file(filename) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(header)
+                for a in [
+                    word_offsets,
+                    posting_offsets,
+                    postings,
+                    pos_offsets,
+                    sheet_offsets,
+                ]:
+                    f.write(little_endian(a))
+                f.write(digests)
+                f.write(word_blob)
+                f.write(pos_blob)
+                f.write(sheet_blob)
+
+    @classmethod
+    def load(cls, filename):
+        lexicon = cls()
+        with LexiconIndex(filename) as index:
+            sheets = [
+                (index.sheet_name(i), index.digest(i)) for i in range(index.n_sheets)
+            ]
+            words = [Counter() for _ in sheets]
+            for i in range(len(index)):
+                word = index.word(i)
+                for pos, sheet, count in index.postings(i):
+                    words[sheet][(word, index.pos_names[pos])] += count
+        for (sheet, digest), counts in zip(sheets, words):
+            lexicon.sheets[sheet] = (digest, counts)
+        return lexicon
+
+
+def blob(strings):
+    offsets = array("I", [0])
+    encoded = []
+    for s in strings:
+        encoded.append(s.encode("utf-8"))
+        offsets.append(offsets[-1] + len(encoded[-1]))
+    return offsets, b"".join(encoded)
+
+
+def little_endian(a):
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+class LexiconIndex:
+    """
+    Read-only lexicon, memory-mapped from a file written by Lexicon.save().
+    Words are found by binary search in the sorted string table, without loading it.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.n_words,
+            n_pos,
+            self.n_sheets,
+            n_postings,
+            word_size,
+            pos_size,
+            sheet_size,
+        ) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a lexicon index")
+
+        self._offset = HEADER.size
+        self.word_offsets = self._array(self.n_words + 1)
+        self.posting_offsets = self._array(self.n_words + 1)
+        self.postings_array = self._array(3 * n_postings)
+        pos_offsets = self._array(n_pos + 1)
+        self.sheet_offsets = self._array(self.n_sheets + 1)
+        self.digests = self._offset
+        self.words = self.digests + DIGEST_SIZE * self.n_sheets
+        pos = self.words + word_size
+        self.sheets = pos + pos_size
+
+        self.pos_names = [
+            self.data[pos + pos_offsets[i] : pos + pos_offsets[i + 1]].decode("utf-8")
+            for i in range(n_pos)
+        ]
+
+    def _array(self, length):
+        start, self._offset = self._offset, self._offset + 4 * length
+        view = memoryview(self.data)[start : self._offset].cast("I")
+        if sys.byteorder == "big":
+            view = array("I", view)
+            view.byteswap()
+        return view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for name in [
+            "word_offsets",
+            "posting_offsets",
+            "postings_array",
+            "sheet_offsets",
+        ]:
+            if isinstance(getattr(self, name), memoryview):
+                getattr(self, name).release()
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.n_words
+
+    def _word_bytes(self, i):
+        return self.data[
+            self.words + self.word_offsets[i] : self.words + self.word_offsets[i + 1]
+        ]
+
+    def word(self, i):
+        return self._word_bytes(i).decode("utf-8")
+
+    def sheet_name(self, i):
+        return self.data[
+            self.sheets
+            + self.sheet_offsets[i] : self.sheets
+            + self.sheet_offsets[i + 1]
+        ].decode("utf-8")
+
+    def digest(self, i):
+        return self.data[
+            self.digests + DIGEST_SIZE * i : self.digests + DIGEST_SIZE * (i + 1)
+        ]
+
+    def postings(self, i):
+        """(POS id, sheet id, count) of the i-th word"""
+        p = self.postings_array
+        for n in range(self.posting_offsets[i], self.posting_offsets[i + 1]):
+            yield p[3 * n], p[3 * n + 1], p[3 * n + 2]
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.n_words
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, word):
+        """:return: the number of the word, or None"""
+        key = word.encode("utf-8")
+        i = self._lower_bound(key)
+        if i < self.n_words and self._word_bytes(i) == key:
+            return i
+        return None
+
+    def __contains__(self, word):
+        return self.find(word) is not None
+
+    def lookup(self, word):
+        """:return: {POS: count} of the word, empty if it is unknown"""
+        i = self.find(word)
+        counts = Counter()
+        if i is not None:
+            for pos, _, count in self.postings(i):
+                counts[self.pos_names[pos]] += count
+        return dict(counts.most_common())
+
+    def sheets_of(self, word):
+        i = self.find(word)
+        if i is None:
+            return []
+        return sorted({self.sheet_name(s) for _, s, _ in self.postings(i)})
+
+    def suggest(self, word):
+        """:return: the most frequent POS of the word, or None"""
+        counts = self.lookup(word)
+        return next(iter(counts), None)
+
+    def prefix(self, prefix, limit=None):
+        """:return: the words starting with prefix, in order"""
+        key = prefix.encode("utf-8")
+        words = []
+        i = self._lower_bound(key)
+        while i < self.n_words and (limit is None or len(words) < limit):
+            word = self._word_bytes(i)
+            if not word.startswith(key):
+                break
+            words.append(word.decode("utf-8"))
+            i += 1
+        return words
+
+
+def build_lexicon(in_dir, filename, header_sheets=0, translate_tree="en_bo"):
+    """
+    Writes the lexicon of all the sheets of in_dir to filename. If filename already exists,
+    only the sheets that changed since it was written are parsed.
+    :return: the Lexicon
+    """
+    try:
+        lexicon = Lexicon.load(filename)
+    except (FileNotFoundError, ValueError):
+        lexicon = Lexicon()
+    updated, removed = lexicon.update_corpus(
+        in_dir, header_sheets=header_sheets, translate_tree=translate_tree
+    )
+    print(f"{updated} sheets updated, {removed} removed")
+    lexicon.save(filename)
+    return lexicon
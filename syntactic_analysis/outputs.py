@@ -0,0 +1,259 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from .file_utils import atomic_file
+from .latex import LatexMkBuilder
+from .raster import DEFAULT_DPI, pdf_buffer, write_pngs
+from .svgfont import batch_subset
+from .tiles import split_tree
+
+# name -> Output, in the order the outputs of a sheet are written
+OUTPUTS = {}
+
+
+def register_output(cls):
+    """Class decorator making an Output available to analyze_tsv_sentence() under its name"""
+    OUTPUTS[cls.name] = cls()
+    return cls
+
+
+def parse_formats(format):
+    """
+    :param format: the name of an output, or an iterable of names
+    :return: the names, in the order of OUTPUTS
+    """
+    names = {format} if isinstance(format, str) else set(format)
+    unknown = names - OUTPUTS.keys()
+    if unknown or not names:
+        allowed = ", ".join(f'"{n}"' for n in OUTPUTS)
+        raise SyntaxError(f"allowed formats are: {allowed}")
+    return [n for n in OUTPUTS if n in names]
+
+
+def write_file(filename, content):
+    """
+    Writes content (text or bytes) through a temporary file that replaces filename: the
+    files hard linked to the previous one (see link_file()) keep their content.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8-sig")
+    with atomic_file(filename) as tmp:
+        Path(tmp).write_bytes(content)
+
+
+class Sheet:
+    """
+    A parsed sheet, handed to all the outputs asked for. What several outputs need (the LaTeX
+    source of a tree for latex and pdf, its pdf for pdf and png) is built on first use
+    and kept for the others.
+
+    Trees with more than max_leaves leaves are written in tiles (see split_tree()), each
+    aligning its leaves at its own height. None writes them whole.
+    """
+
+    def __init__(
+        self,
+        name,
+        out_dir,
+        tree,
+        version_trees,
+        write_all=False,
+        from_roof=None,
+        draw_square=False,
+        font=None,
+        dpi=DEFAULT_DPI,
+        grayscale=False,
+        colors=None,
+        embed_font=False,
+        max_leaves=None,
+    ):
+        self.name = name
+        self.out_dir = Path(out_dir)
+        self.tree = tree
+        self.version_trees = version_trees
+        self.write_all = write_all
+        self.from_roof = from_roof
+        self.draw_square = draw_square
+        self.font = font
+        self.dpi = dpi
+        self.grayscale = grayscale
+        self.colors = colors
+        self.embed_font = embed_font
+        self.max_leaves = max_leaves
+        self._trees = None
+        # id of a tile -> (tile, {stub: suffix of the tile it stands for})
+        self._tiles = {}
+        # id of a tree -> (tree, LaTeX source), (tree, pdf)
+        self._latex = {}
+        self._pdfs = {}
+        self._builder = None
+
+    @property
+    def params(self):
+        """The parameters the files depend on, see TreeTable.dedupe()"""
+        return (
+            self.from_roof,
+            self.draw_square,
+            self.font,
+            self.dpi,
+            self.grayscale,
+            self.colors,
+            self.embed_font,
+        )
+
+    def trees(self):
+        """(tree, suffix of its files) of the trees to write, large trees split in tiles"""
+        if self._trees is not None:
+            return self._trees
+        trees = [(self.tree, "")]
+        if self.write_all:
+            trees += [(v, f"_version{n + 1}") for n, v in enumerate(self.version_trees)]
+        if self.max_leaves is None:
+            self._trees = trees
+            return trees
+
+        self._trees = []
+        for tree, suffix in trees:
+            tiles = split_tree(tree, max_leaves=self.max_leaves)
+            if len(tiles) == 1:
+                self._trees.append((tree, suffix))
+                continue
+            for n, (tile, stubs) in enumerate(tiles):
+                self._tiles[id(tile)] = (
+                    tile,
+                    {leaf: f"{suffix}_tile{k}" for k, leaf in stubs.items()},
+                )
+                self._trees.append((tile, f"{suffix}_tile{n}" if n else suffix))
+        return self._trees
+
+    def roof(self, tree):
+        """from_roof for a tree: tiles are aligned at their own height"""
+        from .analysis import roof_height
+
+        if self.from_roof is not None and id(tree) in self._tiles:
+            return roof_height(tree)
+        return self.from_roof
+
+    def links(self, tree, extension):
+        """stub of a tile -> name of its file, for the stubs of tree"""
+        if id(tree) not in self._tiles:
+            return {}
+        stubs = self._tiles[id(tree)][1]
+        return {leaf: f"{self.name}{s}{extension}" for leaf, s in stubs.items()}
+
+    def latex(self, tree):
+        # the trees are kept with what is built from them, so that their ids stay unique
+        if id(tree) not in self._latex:
+            source = tree.gen_latex(
+                from_roof=self.roof(tree), draw_square=self.draw_square, font=self.font
+            )
+            self._latex[id(tree)] = (tree, source)
+        return self._latex[id(tree)][1]
+
+    def pdf(self, tree):
+        """The pdf of the tree, as a buffer"""
+        from .analysis import font_path
+
+        if id(tree) not in self._pdfs:
+            if self._builder is None:
+                self._builder = LatexMkBuilder()
+            pdf = self._builder.build_pdf(
+                self.latex(tree), [], depends=[font_path(self.font)]
+            )
+            self._pdfs[id(tree)] = (tree, pdf_buffer(pdf))
+        return self._pdfs[id(tree)][1]
+
+
+class Output(ABC):
+    """
+    A format analyze_tsv_sentence() writes, registered with register_output().
+    Outputs with an extension write a file per tree, the trees identical to one already
+    written being linked to its file. The others write a file per sheet.
+    """
+
+    name = None
+    extension = None
+
+    @abstractmethod
+    def write(self, sheet, files):
+        """
+        :param files: (tree, filename) to write, for the outputs with an extension
+        """
+
+
+@register_output
+class MshangOutput(Output):
+    """Links to the tree (and the versions with write_all) on mshang.ca"""
+
+    name = "mshang"
+
+    def write(self, sheet, files=None):
+        from .analysis import generate_mshang_link
+
+        mshang = generate_mshang_link(sheet.tree)
+        if sheet.write_all:
+            mshang += "\n\nextra trees:\n"
+            mshang += "\n\n".join(
+                [generate_mshang_link(t) for t in sheet.version_trees]
+            )
+        Path(sheet.out_dir / f"{sheet.name}_mshang.txt").write_text(
+            mshang, encoding="utf-8-sig"
+        )
+
+
+@register_output
+class LatexOutput(Output):
+    name = "latex"
+    extension = ".tex"
+
+    def write(self, sheet, files):
+        for tree, filename in files:
+            write_file(filename, sheet.latex(tree))
+
+
+@register_output
+class PdfOutput(Output):
+    name = "pdf"
+    extension = ".pdf"
+
+    def write(self, sheet, files):
+        for tree, filename in files:
+            write_file(filename, sheet.pdf(tree))
+
+
+@register_output
+class PngOutput(Output):
+    """The pdfs are compiled one after the other, their rasterization is done concurrently"""
+
+    name = "png"
+    extension = ".png"
+
+    def write(self, sheet, files):
+        write_pngs(
+            ((sheet.pdf(tree), filename) for tree, filename in files),
+            dpi=sheet.dpi,
+            grayscale=sheet.grayscale,
+            colors=sheet.colors,
+        )
+
+
+@register_output
+class SvgOutput(Output):
+    name = "svg"
+    extension = ".svg"
+
+    def write(self, sheet, files):
+        # a single font subset for the trees of the sheet
+        subset = None
+        if sheet.embed_font:
+            subset = batch_subset([t for t, _ in files], sheet.font)
+        for tree, filename in files:
+            write_file(
+                filename,
+                tree.build_svg(
+                    font=sheet.font,
+                    embed_font=sheet.embed_font,
+                    subset=subset,
+                    links=sheet.links(tree, self.extension),
+                ),
+            )
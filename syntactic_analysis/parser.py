@@ -0,0 +1,353 @@
+import math
+import pickle
+import re
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from nltk.tree import Tree
+from openpyxl import Workbook, load_workbook
+
+from .analysis import BoTree, tagset
+from .corpus import iter_sheets, iter_trees
+from .statistics import parse_rules
+
+NEG = -math.inf
+# marks the intermediate symbols created by binarization
+BIN = "|<"
+
+
+class Grammar:
+    """
+    Probabilistic grammar induced from the analyzed sheets, binarized and with its symbols
+    interned as integers for the CKY parser.
+    """
+
+    def __init__(self):
+        self.rules = Counter()  # (lhs, rhs tuple) -> count
+        self.roots = Counter()
+        self.symbols = []
+        self.ids = {}
+        self.compiled = False
+
+    def add_tree(self, tree, count=1):
+        """Adds the rules of a tree. The suffix of version trees' roots is removed."""
+        self.roots[re.sub(r"--extra\d+$", "", tree.label())] += count
+        for production in tree.productions():
+            if not production.is_lexical():
+                lhs = re.sub(r"--extra\d+$", "", str(production.lhs()))
+                rhs = tuple(str(s) for s in production.rhs())
+                self.rules[(lhs, rhs)] += count
+        self.compiled = False
+
+    def add_rules(self, content):
+        """Adds the rules of a _rules.txt file written by analyze_constituency()"""
+        sections = parse_rules(content)
+        for num, rule in enumerate(sections["rules"]):
+            lhs, rhs = rule.split(" -> ")
+            if num == 0:
+                # productions start with the root
+                self.roots[lhs] += 1
+            self.rules[(lhs, tuple(rhs.split()))] += 1
+        for rule in sections["extra rules"]:
+            lhs, rhs = rule.split(" -> ")
+            self.rules[(lhs, tuple(rhs.split()))] += 1
+        self.compiled = False
+
+    @classmethod
+    def from_corpus(cls, in_dir, header_sheets=0, translate_tree="en_bo"):
+        grammar = cls()
+        sheets = iter_sheets(in_dir, header_sheets=header_sheets)
+        for _, _, tree, versions in iter_trees(sheets, translate_tree=translate_tree):
+            grammar.add_tree(tree)
+            for version in versions:
+                grammar.add_tree(version)
+        return grammar
+
+    @classmethod
+    def from_output(cls, out_dir):
+        """Grammar of the _rules.txt files found in out_dir and its subfolders"""
+        grammar = cls()
+        for rules in sorted(Path(out_dir).rglob("*_rules.txt")):
+            grammar.add_rules(rules.read_text(encoding="utf-8-sig"))
+        return grammar
+
+    def intern(self, symbol):
+        if symbol not in self.ids:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.ids[symbol]
+
+    def compile(self):
+        """Binarizes the rules (right factored) and turns counts into log probabilities."""
+        self.symbols, self.ids = [], {}
+        self.binary = defaultdict(list)  # (left << 32 | right) -> [(parent, logprob)]
+        self.unary = defaultdict(list)  # child -> [(parent, logprob)]
+
+        totals = Counter()
+        for (lhs, _), count in self.rules.items():
+            totals[lhs] += count
+        for (lhs, rhs), count in sorted(self.rules.items()):
+            self.rules_for(self.intern(lhs), rhs, math.log(count / totals[lhs]))
+
+        root_total = sum(self.roots.values())
+        self.root_scores = {
+            self.intern(r): math.log(c / root_total) for r, c in self.roots.items()
+        }
+        self.compiled = True
+
+    def rules_for(self, parent, rhs, logprob):
+        """Registers parent -> rhs, binarizing what is left of rhs"""
+        if len(rhs) == 1:
+            self.unary[self.intern(rhs[0])].append((parent, logprob))
+        elif len(rhs) == 2:
+            left, right = self.intern(rhs[0]), self.intern(rhs[1])
+            self.binary[(left << 32) | right].append((parent, logprob))
+        else:
+            lhs = self.symbols[parent].split(BIN)[0]
+            rest = f"{lhs}{BIN}{'-'.join(rhs[1:])}>"
+            new = rest not in self.ids
+            self.rules_for(parent, (rhs[0], rest), logprob)
+            if new:
+                self.rules_for(self.intern(rest), rhs[1:], 0.0)
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            pickle.dump((self.rules, self.roots), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        grammar = cls()
+        with open(filename, "rb") as f:
+            grammar.rules, grammar.roots = pickle.load(f)
+        return grammar
+
+
+class Chart:
+    """
+    Scores and backpointers of all the (span, symbol) pairs, in flat arrays.
+    Spans (i, j) are numbered so that all spans ending at j follow those ending before.
+    """
+
+    def __init__(self, length, symbols):
+        self.symbols = symbols
+        size = (length * (length + 1) // 2) * symbols
+        self.score = array("d", [NEG]) * size
+        self.split = array("i", [0]) * size
+        self.left = array("i", [-1]) * size
+        self.right = array("i", [-1]) * size
+        # symbols with a score, per span
+        self.active = {}
+
+    def index(self, i, j, symbol):
+        return ((j * (j - 1) // 2) + i) * self.symbols + symbol
+
+
+def cky(grammar, tags, beam=10.0, max_cell=50):
+    """
+    Viterbi CKY over a sequence of POS tags.
+
+    :param beam: in each cell, entries scoring below the best one minus beam (log prob) are pruned
+    :param max_cell: maximum amount of entries kept in each cell
+    :return: the best tree, with tags as leaves, or None if the sequence can't be parsed
+    """
+    if not grammar.compiled:
+        grammar.compile()
+    n = len(tags)
+    if not n or any(t not in grammar.ids for t in tags):
+        return None
+
+    chart = Chart(n, len(grammar.symbols))
+    score, split, left, right = chart.score, chart.split, chart.left, chart.right
+
+    def update(i, j, symbol, value, k, b, c):
+        idx = chart.index(i, j, symbol)
+        if value > score[idx]:
+            score[idx] = value
+            split[idx], left[idx], right[idx] = k, b, c
+            return True
+        return False
+
+    def close(i, j):
+        """Unary rules, then pruning"""
+        agenda = list(chart.active[(i, j)])
+        while agenda:
+            child = agenda.pop()
+            child_score = score[chart.index(i, j, child)]
+            for parent, logprob in grammar.unary.get(child, ()):
+                if update(i, j, parent, child_score + logprob, -1, child, -1):
+                    chart.active[(i, j)].add(parent)
+                    agenda.append(parent)
+        entries = sorted(
+            chart.active[(i, j)],
+            key=lambda s: score[chart.index(i, j, s)],
+            reverse=True,
+        )
+        if entries:
+            best = score[chart.index(i, j, entries[0])]
+            entries = [e for e in entries if score[chart.index(i, j, e)] >= best - beam]
+        chart.active[(i, j)] = entries[:max_cell]
+
+    for i, tag in enumerate(tags):
+        symbol = grammar.ids[tag]
+        update(i, i + 1, symbol, 0.0, -2, -1, -1)
+        chart.active[(i, i + 1)] = {symbol}
+        close(i, i + 1)
+
+    for length in range(2, n + 1):
+        for i in range(n - length + 1):
+            j = i + length
+            chart.active[(i, j)] = set()
+            for k in range(i + 1, j):
+                for b in chart.active[(i, k)]:
+                    b_score = score[chart.index(i, k, b)]
+                    for c in chart.active[(k, j)]:
+                        rules = grammar.binary.get((b << 32) | c)
+                        if not rules:
+                            continue
+                        c_score = b_score + score[chart.index(k, j, c)]
+                        for parent, logprob in rules:
+                            if update(i, j, parent, c_score + logprob, k, b, c):
+                                chart.active[(i, j)].add(parent)
+            close(i, j)
+
+    best, best_score = None, NEG
+    for symbol, logprob in grammar.root_scores.items():
+        value = score[chart.index(0, n, symbol)] + logprob
+        if value > best_score:
+            best, best_score = symbol, value
+    if best is None:
+        return None
+
+    def build(i, j, symbol):
+        idx = chart.index(i, j, symbol)
+        label = grammar.symbols[symbol]
+        if split[idx] == -2:
+            return label
+        if split[idx] == -1:
+            return Tree(label, [build(i, j, left[idx])])
+        k = split[idx]
+        return Tree(label, [build(i, k, left[idx]), build(k, j, right[idx])])
+
+    return debinarize(build(0, n, best))
+
+
+def debinarize(tree):
+    children = []
+    for child in tree:
+        if isinstance(child, Tree):
+            child = debinarize(child)
+            if BIN in child.label():
+                children.extend(child)
+                continue
+        children.append(child)
+    return Tree(tree.label(), children)
+
+
+def parse(grammar, tags, words, beam=10.0, max_cell=50):
+    """
+    :return: the best BoTree over the words, or None
+    """
+    tree = cky(grammar, tags, beam=beam, max_cell=max_cell)
+    if tree is None:
+        return None
+    tree = BoTree.convert(tree)
+    for pos, word in zip(tree.treepositions("leaves"), words):
+        tree[pos] = BoTree(tree[pos], [word.replace(" ", "_")])
+    return tree
+
+
+def tree_to_rows(tree):
+    """
+    The bracket rows of a sheet for a tree whose preterminals are POS tags.
+    Each constituent goes on the row of its depth, POS tags are left out (they are in the "P" row).
+    """
+    constituents = []
+
+    def walk(node, start, depth):
+        end = start
+        for child in node:
+            if isinstance(child, Tree) and child.height() > 2:
+                end = walk(child, end, depth + 1)
+            else:
+                end += 1
+        constituents.append((depth, start, end, node.label()))
+        return end
+
+    width = walk(tree, 0, 0)
+    rows = [[""] * width for _ in range(max(c[0] for c in constituents) + 1)]
+    for depth, start, end, label in constituents:
+        if end - start == 1:
+            rows[depth][start] = f"[{label}]"
+        else:
+            rows[depth][start] = f"[{label}"
+            rows[depth][end - 1] = "]"
+    return rows
+
+
+def prefill_sheet(rows, grammar, translate_tree="en_bo", beam=10.0, max_cell=50):
+    """
+    Fills the empty rows above the "P" row of a prepared sheet (see prepare_file())
+    with the best parse of its POS tags. Rows are added on top if there are not enough.
+
+    :param translate_tree: how the tags of the sheet are translated to match the grammar
+    :return: the new rows, or None if the sheet already has brackets, has no "P" or "W"
+             row (header or notes sheets) or can't be parsed
+    """
+    markers = [row[0] if row else "" for row in rows]
+    if "P" not in markers or "W" not in markers:
+        return None
+    p, w = markers.index("P"), markers.index("W")
+    if any("".join(row) for row in rows[:p]):
+        return None
+
+    translation = {}
+    if translate_tree == "en_bo":
+        translation = dict(tagset)
+    elif translate_tree == "bo_en":
+        translation = {tib: ud for ud, tib in tagset}
+    tags = [translation.get(t, t) for t in rows[p][1:] if t]
+    words = rows[w][1 : len(tags) + 1]
+
+    tree = parse(grammar, tags, words, beam=beam, max_cell=max_cell)
+    if tree is None:
+        return None
+
+    width = len(rows[p])
+    tree_rows = [[""] + row for row in tree_to_rows(tree)]
+    tree_rows = [row + [""] * (width - len(row)) for row in tree_rows]
+    padding = [[""] * width for _ in range(p - len(tree_rows))]
+    return padding + tree_rows + rows[p:]
+
+
+def prefill_workbook(
+    filename, grammar, out_file, translate_tree="en_bo", header_sheets=0
+):
+    """
+    Writes a copy of a workbook prepared by prepare_file(), with the trees of its
+    empty sheets pre-filled.
+    :param header_sheets: amount of sheets at the start of the workbook copied as they are
+    :return: the amount of sheets that were filled
+    """
+    workbook = load_workbook(filename=filename, read_only=True)
+    out = Workbook(write_only=True)
+    filled = 0
+    try:
+        for num, name in enumerate(workbook.sheetnames):
+            rows = [
+                ["" if c is None else str(c) for c in row]
+                for row in workbook[name].values
+            ]
+            new_rows = None
+            if num >= header_sheets:
+                new_rows = prefill_sheet(rows, grammar, translate_tree=translate_tree)
+            if new_rows is not None:
+                rows = new_rows
+                filled += 1
+            sheet = out.create_sheet(name)
+            for row in rows:
+                sheet.append(row)
+    finally:
+        workbook.close()
+    out.save(out_file)
+    return filled
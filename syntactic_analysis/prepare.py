@@ -1,11 +1,17 @@
 from pathlib import Path
 import csv
 
-from botok import Text, WordTokenizer
 import xlsxwriter
 
+from .duplicates import DuplicateIndex, normalize, project_rows
+from .segmentation import Segmentation, Token
+from .textunits import sentencify
 
-# tok = BoTokenizer('GMD')
+_tokenizer = None
+
+LINES = 10  # amount of copies of the sentence for the simplification
+TREE = 10  # amount of lines left for constructing the tree
+DUPLICATE_MODES = [None, "flag", "skip", "prefill"]
 pos_eqvl = {
     "NUM": "གྲངས་ཚིག",
     "punct": "རྟགས་ཤད།",
@@ -27,14 +33,38 @@ pos_eqvl = {
 }
 
 
+def get_tokenizer():
+    """
+    botok's tokenizer, loaded on first use since it loads (or downloads) its dialect pack.
+    Its trie is mapped from a snapshot shared by all the processes, see triesnap.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        from .triesnap import snapshot_tokenizer
+
+        _tokenizer = snapshot_tokenizer()
+    return _tokenizer
+
+
 def tokenize(string):
-    return tok.tokenize(string)
+    tokens = []
+    for t in get_tokenizer().tokenize(string):
+        is_text = t.chunk_type == "TEXT"
+        tokens.append(
+            Token(
+                t.text,
+                "syl" if is_text else t.chunk_type.lower(),
+                t.pos if is_text else "punct",
+                t.syls_idx or [],
+            )
+        )
+    return tokens
 
 
 def tokenize_lines(string):
     out = []
     for line in string.split("\n"):
-        out.append(tok.tokenize(line))
+        out.append(tokenize(line))
     return out
 
 
@@ -44,16 +74,18 @@ def prepare_sentences(sentences):
 
 
 def prepare_analysis(sentences):
-    LINES = 10  # amount of copies of the sentence for the simplification
-    TREE = 10  # amount of lines left for constructing the tree
-
     return [generate_sheet(sent, TREE, LINES) for sent in sentences]
 
 
-def generate_sheet(sent, lines_above, amount_sentence):
+def generate_sheet(sent, lines_above, amount_sentence, tree_rows=None):
+    """
+    :param tree_rows: bracket rows to pre-fill the tree with, placed right above the "P" row
+    """
     sheet = []
     words, pos = extract_words_n_pos(sent)
-    sheet.extend([[""] * len(words)] * lines_above)
+    tree_rows = [row + [""] * (len(words) - len(row)) for row in tree_rows or []]
+    sheet.extend([[""] * len(words)] * max(lines_above - len(tree_rows), 0))
+    sheet.extend(tree_rows)
     sheet.append(pos)
     sheet.append(words)
     sheet.extend([[""] + words[1:]] * amount_sentence)
@@ -70,33 +102,160 @@ def extract_words_n_pos(sent):
     return words, pos
 
 
-def prepare_file(in_file, out_dir, xlsx=True):
+def segment_file(in_file, out_dir, tokenizer=tokenize):
+    """
+    The sentences of in_file, segmented incrementally: only the parts of the text that
+    changed since the segmentation stored in out_dir are tokenized and segmented again.
+    The new segmentation replaces the stored one.
+
+    :return: (Segmentation, {old sentence number: new number or None}, the numbers of the
+             new or edited sentences). On the first run, all the sentences are new.
+    """
     in_file, out_dir = Path(in_file), Path(out_dir)
-    # pipeline = BoPipeline('dummy',
-    #                       tokenize,
-    #                       sentencify,
-    #                       prepare_analysis)
+    stored = out_dir / f"{in_file.stem}.segments.json"
+    content = in_file.read_text(encoding="utf-8-sig")
+    try:
+        previous = Segmentation.load(stored)
+    except (FileNotFoundError, ValueError):
+        segmentation = Segmentation.from_text(content, tokenizer)
+        mapping, changed = {}, set(range(len(segmentation)))
+    else:
+        segmentation, mapping, changed = previous.update(content, tokenizer)
+    segmentation.save(stored)
+    return segmentation, mapping, changed
 
-    pipeline = BoPipeline("dummy", tokenize_lines, prepare_sentences, prepare_analysis)
 
-    content = in_file.read_text(encoding="utf-8-sig")
-    sheets = pipeline.pipe_str(content)
+def renumber_sheets(out_dir, stem, mapping, changed):
+    """
+    Moves the .csv sheets of a previous run of prepare_file() to the new numbers of their
+    sentences, see segment_file(). The sheets of the sentences gone or edited are deleted.
+    """
+
+    def sheet(num):
+        return out_dir / f"{stem}_{num + 1}.csv"
+
+    moved = {}
+    for old, new in mapping.items():
+        if new != old and sheet(old).is_file():
+            # through a temporary name: the new number may be the old one of another sheet
+            tmp = out_dir / f".{stem}_{old + 1}.csv.renumbered"
+            sheet(old).replace(tmp)
+            moved[tmp] = new
+    for tmp, new in moved.items():
+        if new is None or new in changed:
+            tmp.unlink()
+        else:
+            tmp.replace(sheet(new))
+
+
+def prepare_file(
+    in_file,
+    out_dir,
+    xlsx=True,
+    duplicates=None,
+    index=None,
+    tokenizer=tokenize,
+    incremental=False,
+):
+    """
+    Writes a sheet for every sentence of in_file: the sheets of a workbook <stem>.xlsx,
+    or a .csv file per sentence, in out_dir. Sheets are written as the sentences are read.
+
+    :param duplicates: what is done with the sentences identical or similar to an annotated
+                       sheet of the index or to a previous sentence of in_file:
+                        - None: they are not looked for
+                        - "flag": they are listed in <stem>_duplicates.tsv
+                        - "skip": they are listed and get no sheet
+                        - "prefill": they are listed, and the tree of those matching an
+                          annotated sheet is pre-filled from it
+    :param index: DuplicateIndex holding the annotated sheets, see DuplicateIndex.from_corpus().
+                  An empty one by default.
+    :param tokenizer: function returning the tokens of a string, with the attributes of Token
+    :param incremental: segment the text with segment_file(), from the segmentation of the
+                        previous run. The new numbers of the sentences of the previous run
+                        are written in <stem>_renumbered.tsv, to keep their sheets attached.
+                        The .csv files are moved to the new numbers of their sentences, and
+                        only the sentences new or edited get a new one; a workbook is always
+                        written whole.
+    :return: {sentence number: Match} of the duplicates found
+    """
+    if duplicates not in DUPLICATE_MODES:
+        raise ValueError(f"duplicates must be one of {DUPLICATE_MODES}")
+    in_file, out_dir = Path(in_file), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if duplicates and index is None:
+        index = DuplicateIndex()
+
+    if incremental:
+        segmentation, mapping, changed = segment_file(
+            in_file, out_dir, tokenizer=tokenizer
+        )
+        sentences = segmentation.sentence_tokens()
+        if not xlsx:
+            renumber_sheets(out_dir, in_file.stem, mapping, changed)
+        with (out_dir / f"{in_file.stem}_renumbered.tsv").open(
+            "w", encoding="utf-8", newline=""
+        ) as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(["old", "new"])
+            for old, new in sorted(mapping.items()):
+                writer.writerow([old, "" if new is None else new])
+    else:
+        content = in_file.read_text(encoding="utf-8-sig")
+        sentences = sentencify(tokenizer(content))
+        changed = None
+
+    workbook = None
     if xlsx:
-        workbook = xlsxwriter.Workbook(in_file.stem + ".xlsx")
-        for num, sheet in enumerate(sheets):
+        workbook = xlsxwriter.Workbook(
+            str(out_dir / f"{in_file.stem}.xlsx"), {"constant_memory": True}
+        )
+    found = {}
+    for num, sent in enumerate(sentences):
+        tree_rows = None
+        if duplicates:
+            words = [normalize(token.content) for token in sent[1]]
+            match = index.check(f"{in_file.stem}/{num}", words)
+            if match:
+                found[num] = match
+                if duplicates == "skip":
+                    continue
+                if duplicates == "prefill" and match.rows:
+                    tree_rows = project_rows(match.rows, match.words, words)
+        out_file = out_dir / f"{in_file.stem}_{num + 1}.csv"
+        if (
+            not xlsx
+            and changed is not None
+            and num not in changed
+            and out_file.is_file()
+        ):
+            continue
+        sheet = generate_sheet(sent, TREE, LINES, tree_rows=tree_rows)
+
+        if xlsx:
             worksheet = workbook.add_worksheet(str(num))
             for r, row in enumerate(sheet):
                 for c, content in enumerate(row):
                     worksheet.write_string(r, c, content)
-        workbook.close()
-
-    else:
-        for num, sheet in enumerate(sheets):
-            out_file = out_dir / f"{in_file.stem}_{num + 1}.csv"
+        else:
             with out_file.open("w") as csvfile:
                 writer = csv.writer(csvfile)
                 for line in sheet:
                     writer.writerow(line)
+    if xlsx:
+        workbook.close()
+
+    if duplicates:
+        report = out_dir / f"{in_file.stem}_duplicates.tsv"
+        with report.open("w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(["sentence", "kind", "similarity", "match"])
+            for num, match in found.items():
+                writer.writerow([num, match.kind, f"{match.similarity:.2f}", match.key])
+        print(
+            f"{in_file.name}: {len(found)} duplicates out of {len(sentences)} sentences"
+        )
+    return found
 
 
 if __name__ == "__main__":
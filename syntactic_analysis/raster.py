@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from data import Data
+from pdf2image import convert_from_bytes
+
+from .file_utils import atomic_file
+
+# pdf2image's own default, kept so that existing outputs don't change size
+DEFAULT_DPI = 200
+
+
+def pdf_buffer(pdf):
+    """
+    The buffer of a pdf, without copying it.
+
+    :param pdf: a buffer (bytes, memoryview...) or the Data returned by
+                LatexMkBuilder.build_pdf()
+    """
+    if isinstance(pdf, Data):
+        # its bytes as they are, unless it reads from a file
+        pdf = pdf.data if pdf.data is not None else bytes(pdf)
+    return memoryview(pdf)
+
+
+def rasterize(pdf, dpi=DEFAULT_DPI, page=1, grayscale=False, colors=None):
+    """Rasterize a single page of a pdf.
+
+    :param pdf: the pdf, see pdf_buffer(). It is handed to poppler without a copy
+    :param dpi: resolution of the output image
+    :param page: the page to rasterize, 1-based. The trees only have one.
+    :param grayscale: ask poppler for a single-channel image
+    :param colors: if given, quantize the image to a palette of that many colors
+    :return: a PIL image
+    """
+    image = convert_from_bytes(
+        pdf_buffer(pdf),
+        dpi=dpi,
+        first_page=page,
+        last_page=page,
+        fmt="png",
+        single_file=True,
+        grayscale=grayscale,
+    )[0]
+    if colors:
+        image = image.quantize(colors=colors)
+    return image
+
+
+def save_png(image, filename):
+    """Through a temporary file replacing filename, as outputs.write_file()"""
+    with atomic_file(filename) as tmp:
+        image.save(Path(tmp), format="PNG", optimize=True)
+
+
+def write_png(pdf, filename, dpi=DEFAULT_DPI, page=1, grayscale=False, colors=None):
+    image = rasterize(pdf, dpi=dpi, page=page, grayscale=grayscale, colors=colors)
+    save_png(image, filename)
+    image.close()
+
+
+def write_pngs(
+    jobs, dpi=DEFAULT_DPI, page=1, grayscale=False, colors=None, workers=None
+):
+    """Rasterize many pdfs concurrently.
+
+    pdftoppm only accepts one document per invocation, so the batch is spread
+    over a pool of threads, each of them waiting on its own poppler process.
+
+    :param jobs: iterable of (pdf, filename) pairs
+    :param workers: size of the pool. Defaults to ThreadPoolExecutor's default
+    """
+
+    def job(args):
+        pdf, filename = args
+        write_png(pdf, filename, dpi=dpi, page=page, grayscale=grayscale, colors=colors)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # consume the iterator so that exceptions are raised here
+        list(pool.map(job, jobs))
@@ -0,0 +1,185 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .latex import FORMAT_DIR
+
+# timings of the sheets rendered by previous runs, shared by all of them
+TIMINGS = FORMAT_DIR.parent / "timings.jsonl"
+# amount of timings kept in the file
+MAX_TIMINGS = 5000
+# coefficients of the features, see CostModel.features(). Only relative costs matter,
+# so a single default is used for all formats until timings are recorded.
+DEFAULT_COEFFICIENTS = [0.0, 1.0, 0.02, 0.1]
+# timings needed before the coefficients of a format are fitted
+MIN_TIMINGS = 20
+
+
+def sheet_features(content):
+    """
+    (leaves, height, versions) of a sheet, read from its grid without building the tree:
+    the words of the "W" row, the bracket rows above the "P" row and the rows below "W".
+    """
+    rows = [row for row in csv.reader(content.split("\n"), delimiter="\t") if row]
+    markers = [row[0] for row in rows]
+    rows = [[c for c in row[1:] if c.strip()] for row in rows]
+    p = markers.index("P") if "P" in markers else len(markers)
+    w = markers.index("W") if "W" in markers else len(markers)
+    leaves = len(rows[w]) if w < len(rows) else 0
+    height = sum(1 for row in rows[:p] if row) + 2
+    versions = sum(1 for row in rows[w + 1 :] if row)
+    return leaves, height, versions
+
+
+class CostModel:
+    """
+    Linear estimate of the seconds a sheet takes to render, with one set of coefficients
+    per format, fitted by least squares on the timings of previous runs.
+    """
+
+    def __init__(self, coefficients=None):
+        self.coefficients = coefficients or {}
+
+    @staticmethod
+    def features(leaves, height, versions, write_all):
+        renders = 1 + (versions if write_all else 0)
+        return [1.0, renders, renders * leaves, renders * height]
+
+    def estimate(self, format, leaves, height, versions, write_all):
+        x = self.features(leaves, height, versions, write_all)
+        coefficients = self.coefficients.get(format, DEFAULT_COEFFICIENTS)
+        return max(0.0, sum(c * v for c, v in zip(coefficients, x)))
+
+    @classmethod
+    def fit(cls, records):
+        """
+        :param records: dicts with format, leaves, height, versions, write_all and seconds
+        """
+        by_format = {}
+        for r in records:
+            x = cls.features(r["leaves"], r["height"], r["versions"], r["write_all"])
+            by_format.setdefault(r["format"], []).append((x, r["seconds"]))
+        coefficients = {}
+        for format, samples in by_format.items():
+            if len(samples) >= MIN_TIMINGS:
+                coefficients[format] = least_squares(samples)
+        return cls(coefficients)
+
+    @classmethod
+    def load(cls, filename=TIMINGS):
+        return cls.fit(read_timings(filename))
+
+
+def least_squares(samples, ridge=1e-6):
+    """Solves the normal equations (X'X + ridge I) b = X'y by Gaussian elimination"""
+    n = len(samples[0][0])
+    a = [[ridge if i == j else 0.0 for j in range(n)] + [0.0] for i in range(n)]
+    for x, y in samples:
+        for i in range(n):
+            for j in range(n):
+                a[i][j] += x[i] * x[j]
+            a[i][n] += x[i] * y
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        if abs(a[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col:
+                factor = a[r][col] / a[col][col]
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+    return [a[i][n] / a[i][i] if abs(a[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+def read_timings(filename=TIMINGS):
+    records = []
+    try:
+        lines = filename.read_text(encoding="utf-8").split("\n")
+    except FileNotFoundError:
+        return records
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def write_timings(records, filename=TIMINGS):
+    """Appends the records, keeping the last MAX_TIMINGS of the file"""
+    records = (read_timings(filename) + records)[-MAX_TIMINGS:]
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmp = filename.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    tmp.replace(filename)
+
+
+class Scheduler:
+    """
+    Runs the sheets of a batch on a fixed amount of worker threads, the most expensive first,
+    so that no worker is left with a large tree at the end of the batch. The rendering is
+    done by latex and poppler processes, so threads are enough to keep the workers busy.
+
+    The time taken by every sheet is recorded to refine the cost model of later runs.
+    """
+
+    def __init__(self, format, write_all=False, workers=1, timings=None):
+        """
+        :param timings: file of the recorded timings, TIMINGS by default. False to disable them.
+        """
+        self.format = format
+        self.write_all = write_all
+        self.workers = workers
+        self.timings = TIMINGS if timings is None else timings
+        self.model = CostModel.load(self.timings) if self.timings else CostModel()
+        # (cost, order, sheet id, features, func, args, kwargs)
+        self.jobs = []
+
+    def add(self, sheet_id, content, func, *args, **kwargs):
+        """Schedules func(*args, **kwargs) for the sheet whose tsv content is given"""
+        features = sheet_features(content)
+        cost = self.model.estimate(self.format, *features, self.write_all)
+        self.jobs.append((cost, len(self.jobs), sheet_id, features, func, args, kwargs))
+
+    def run(self, journal):
+        """
+        Runs the jobs through journal.run(), largest first.
+        :return: the amount of jobs that succeeded
+        """
+        jobs = sorted(self.jobs, key=lambda j: (-j[0], j[1]))
+        self.jobs = []
+        records = []
+        lock = threading.Lock()
+
+        def run(job):
+            _, _, sheet_id, (leaves, height, versions), func, args, kwargs = job
+            print("\t", sheet_id)
+            start = time.perf_counter()
+            ok = journal.run(sheet_id, func, *args, **kwargs)
+            if ok:
+                with lock:
+                    records.append(
+                        {
+                            "format": self.format,
+                            "write_all": self.write_all,
+                            "leaves": leaves,
+                            "height": height,
+                            "versions": versions,
+                            "seconds": time.perf_counter() - start,
+                        }
+                    )
+            return ok
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                done = sum(pool.map(run, jobs))
+        else:
+            done = sum(map(run, jobs))
+
+        if self.timings and records:
+            write_timings(records, self.timings)
+        return done
@@ -0,0 +1,290 @@
+"""
+Structural queries over the trees of a corpus, in a subset of the tgrep syntax.
+
+Nodes:
+    ཚིག་གྲུབ།         a node with that label, or a word. "NP|VP" matches any of the alternatives
+    "བཙུན་མོ་"        a word
+    /regex/          a label or word matching the regular expression
+    __               any node
+
+Relations, all of them attached to the node on their left, unless parentheses are used:
+    A < B     A immediately dominates B
+    A > B     A is immediately dominated by B
+    A << B    A dominates B
+    A >> B    A is dominated by B
+    A $ B     A is a sister of B
+    A $. B    A is the sister immediately preceding B
+    A $, B    A is the sister immediately following B
+    A !< B    negation of any of the relations above
+
+    S < (NP < NOUN) < VP    an S that dominates both an NP (itself dominating a NOUN) and a VP
+"""
+
+import pickle
+import re
+from collections import defaultdict
+
+from nltk.grammar import Nonterminal, Production
+from nltk.tree import Tree
+
+from .analysis import BoTree, tagset
+from .corpus import iter_sheets, iter_trees
+
+RELATIONS = ["<<", ">>", "$.", "$,", "<", ">", "$"]
+TOKENS = re.compile(
+    r'\s*(\(|\)|!|<<|>>|\$\.|\$,|<|>|\$|/(?:[^/\\]|\\.)*/|"[^"]*"|[^\s()<>$!"]+)'
+)
+
+
+class QueryNode:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        # list of (negated, relation, QueryNode)
+        self.relations = []
+
+        if pattern == "__":
+            self.kind, self.value = "any", None
+        elif pattern.startswith("/"):
+            self.kind, self.value = "regex", re.compile(pattern[1:-1])
+        elif pattern.startswith('"'):
+            self.kind, self.value = "word", pattern[1:-1]
+        else:
+            self.kind, self.value = "label", set(pattern.split("|"))
+
+    def matches(self, node):
+        name = node.label() if isinstance(node, Tree) else node
+        if self.kind == "any":
+            return True
+        if self.kind == "regex":
+            return bool(self.value.search(name))
+        if self.kind == "word":
+            return not isinstance(node, Tree) and name == self.value
+        return name in self.value
+
+    def literals(self):
+        """The labels or words that must be present in a tree for this node to match."""
+        if self.kind == "word":
+            return {self.value}
+        if self.kind == "label" and len(self.value) == 1:
+            return set(self.value)
+        return set()
+
+    def required(self):
+        """All the literals required by this node and its non negated relations."""
+        required = [self.literals()] if self.literals() else []
+        for negated, _, target in self.relations:
+            if not negated:
+                required.extend(target.required())
+        return required
+
+
+def parse_query(query, translate_tree="en_bo"):
+    tokens = TOKENS.findall(query)
+    if "".join(tokens) != re.sub(r"\s+", "", query):
+        raise SyntaxError(f"Can't parse query: {query}")
+    translation = query_translation(translate_tree)
+
+    def atom(i):
+        if i >= len(tokens):
+            raise SyntaxError(f"Unexpected end of query: {query}")
+        if tokens[i] == "(":
+            node, i = expression(i + 1)
+            if i >= len(tokens) or tokens[i] != ")":
+                raise SyntaxError(f"Missing closing parenthesis: {query}")
+            return node, i + 1
+        if tokens[i] in RELATIONS or tokens[i] in ["!", ")"]:
+            raise SyntaxError(f'Expected a node, found "{tokens[i]}": {query}')
+        pattern = tokens[i]
+        if not pattern.startswith(("/", '"')):
+            pattern = "|".join(translation.get(p, p) for p in pattern.split("|"))
+        return QueryNode(pattern), i + 1
+
+    def expression(i):
+        node, i = atom(i)
+        while i < len(tokens) and tokens[i] != ")":
+            negated = tokens[i] == "!"
+            if negated:
+                i += 1
+            if i >= len(tokens) or tokens[i] not in RELATIONS:
+                raise SyntaxError(f"Expected a relation: {query}")
+            relation = tokens[i]
+            target, i = atom(i + 1)
+            node.relations.append((negated, relation, target))
+        return node, i
+
+    node, i = expression(0)
+    if i != len(tokens):
+        raise SyntaxError(f"Unbalanced parenthesis: {query}")
+    return node
+
+
+def query_translation(translate_tree):
+    """Maps the labels of the tagset to the ones used in the index."""
+    if translate_tree == "en_bo":
+        return dict(tagset)
+    if translate_tree == "bo_en":
+        return {tib: ud for ud, tib in tagset}
+    return {}
+
+
+def related(tree, pos, relation):
+    """The positions in tree that are in the given relation to the node at pos."""
+    node = tree[pos]
+    if relation == "<":
+        if isinstance(node, Tree):
+            return [pos + (i,) for i in range(len(node))]
+        return []
+    if relation == ">":
+        return [pos[:-1]] if pos else []
+    if relation == "<<":
+        if isinstance(node, Tree):
+            return [pos + p for p in node.treepositions() if p]
+        return []
+    if relation == ">>":
+        return [pos[:i] for i in range(len(pos))]
+    if not pos:
+        return []
+    siblings = len(tree[pos[:-1]])
+    if relation == "$":
+        return [pos[:-1] + (i,) for i in range(siblings) if i != pos[-1]]
+    if relation == "$.":
+        return [pos[:-1] + (pos[-1] + 1,)] if pos[-1] + 1 < siblings else []
+    if relation == "$,":
+        return [pos[:-1] + (pos[-1] - 1,)] if pos[-1] > 0 else []
+    raise SyntaxError(f"Unknown relation: {relation}")
+
+
+def match(query, tree, pos):
+    if not query.matches(tree[pos]):
+        return False
+    for negated, relation, target in query.relations:
+        found = any(match(target, tree, p) for p in related(tree, pos, relation))
+        if found == negated:
+            return False
+    return True
+
+
+class TreeIndex:
+    """
+    Inverted index of the trees of a corpus.
+
+    Productions, labels, words and (word, POS) pairs are mapped to the sheets and tree positions
+    where they occur. Queries only check the trees that contain everything they require,
+    starting from the positions where the queried node occurs.
+    """
+
+    def __init__(self, translate_tree="en_bo"):
+        self.translate_tree = translate_tree
+        # sheet ids, as "<workbook>/<sheet>", and the trees as bracketed strings
+        self.sheets = []
+        self.trees = []
+        # key -> [(sheet number, tree position), ...]
+        self.productions = defaultdict(list)
+        self.labels = defaultdict(list)
+        self.words = defaultdict(list)
+        self.words_pos = defaultdict(list)
+        self._parsed = {}
+
+    def add(self, sheet_id, tree):
+        num = len(self.sheets)
+        self.sheets.append(sheet_id)
+        self.trees.append(re.sub(r"\s+", " ", str(tree)))
+        self._parsed[num] = tree
+
+        for pos in tree.treepositions():
+            node = tree[pos]
+            if not isinstance(node, Tree):
+                self.words[node].append((num, pos))
+                self.words_pos[(node, tree[pos[:-1]].label())].append((num, pos))
+                continue
+            self.labels[node.label()].append((num, pos))
+            rhs = [Nonterminal(c.label()) if isinstance(c, Tree) else c for c in node]
+            production = Production(Nonterminal(node.label()), rhs)
+            self.productions[str(production)].append((num, pos))
+
+    def tree(self, num):
+        if num not in self._parsed:
+            self._parsed[num] = BoTree.fromstring(self.trees[num])
+        return self._parsed[num]
+
+    def sheet_ids(self, postings):
+        return sorted({self.sheets[num] for num, _ in postings})
+
+    def find_production(self, production):
+        """
+        :param production: as found in the _rules.txt files, "NP -> NOUN ADP"
+        :return: list of (sheet id, tree position)
+        """
+        return [(self.sheets[n], p) for n, p in self.productions.get(production, [])]
+
+    def find_word(self, word, pos=None):
+        postings = (
+            self.words_pos.get((word, pos), []) if pos else self.words.get(word, [])
+        )
+        return [(self.sheets[n], p) for n, p in postings]
+
+    def postings(self, literal):
+        return self.labels.get(literal, []) + self.words.get(literal, [])
+
+    def search(self, query):
+        """
+        :param query: a query, see the documentation of this module
+        :return: list of (sheet id, tree position) of the nodes matching the query
+        """
+        if isinstance(query, str):
+            query = parse_query(query, translate_tree=self.translate_tree)
+
+        # prune: only the sheets where all required literals occur
+        candidates = None
+        for literals in query.required():
+            sheets = {n for lit in literals for n, _ in self.postings(lit)}
+            candidates = sheets if candidates is None else candidates & sheets
+            if not candidates:
+                return []
+
+        # start positions
+        if query.literals():
+            starts = defaultdict(list)
+            for lit in query.literals():
+                for n, pos in self.postings(lit):
+                    starts[n].append(pos)
+        else:
+            nums = candidates if candidates is not None else range(len(self.sheets))
+            starts = {n: self.tree(n).treepositions() for n in nums}
+
+        results = []
+        for n in sorted(starts):
+            if candidates is not None and n not in candidates:
+                continue
+            tree = self.tree(n)
+            for pos in sorted(starts[n]):
+                if match(query, tree, pos):
+                    results.append((self.sheets[n], pos))
+        return results
+
+    def save(self, filename):
+        state = {k: v for k, v in self.__dict__.items() if k != "_parsed"}
+        with open(filename, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        index = cls()
+        with open(filename, "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        return index
+
+
+def build_index(in_dir, header_sheets=0, translate_tree="en_bo", filename=None):
+    """
+    Indexes the main tree of every sheet of in_dir. Sheets that can't be parsed are skipped.
+    If filename is given, the index is saved there.
+    """
+    index = TreeIndex(translate_tree=translate_tree)
+    sheets = iter_sheets(in_dir, header_sheets=header_sheets)
+    for workbook, sheet, tree, _ in iter_trees(sheets, translate_tree=translate_tree):
+        index.add(f"{workbook}/{sheet}", tree)
+
+    if filename:
+        index.save(filename)
+    return index
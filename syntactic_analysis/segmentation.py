@@ -0,0 +1,417 @@
+import json
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from difflib import SequenceMatcher
+
+from .file_utils import atomic_file
+from .textunits import (
+    extract_chunks,
+    get_sentence_indices,
+    is_endpart_n_punct,
+    join_no_verb_sentences,
+    split_chunks,
+)
+
+# the attributes of the tokens textunits works on
+Token = namedtuple("Token", "content type pos syls")
+
+VERSION = 1
+# sentences of this length or less may be joined to a neighbour, see join_no_verb_sentences()
+JOIN_THRESHOLD = 4
+# lines edited beyond which diff_lines() gives up, the whole text being segmented again
+MAX_EDITS = 2000
+
+
+def token_starts(text, tokens, offset=0):
+    """The position of every token in text, plus offset"""
+    starts, pos = [], 0
+    for token in tokens:
+        start = text.find(token.content, pos)
+        if start == -1:
+            raise ValueError(f"the token {token.content!r} is not in the text")
+        starts.append(start + offset)
+        pos = start + len(token.content)
+    return starts
+
+
+def diff_lines(a, b, max_edits=MAX_EDITS):
+    """
+    The blocks of lines that differ between a and b, as (a start, a end, b start, b end),
+    by Myers' algorithm: O((len(a) + len(b)) * edits), which stays fast on long texts with
+    many repeated lines, unlike difflib. Beyond max_edits, a single block is returned.
+    """
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(v)
+        v = dict(v)
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x, y = x + 1, y + 1
+            v[k] = x
+            if x >= n and y >= m:
+                return edit_blocks(trace, n, m)
+    return [(0, n, 0, m)] if n or m else []
+
+
+def edit_blocks(trace, x, y):
+    """The edits found by diff_lines(), followed back from (x, y) and merged in blocks"""
+    edits = []
+    for d in range(len(trace) - 1, 0, -1):
+        v, k = trace[d], x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        edits.append(
+            (
+                prev_x,
+                prev_y,
+                *((prev_x, prev_y + 1) if prev_k == k + 1 else (prev_x + 1, prev_y)),
+            )
+        )
+        x, y = prev_x, prev_y
+    blocks = []
+    for x1, y1, x2, y2 in reversed(edits):
+        if blocks and blocks[-1][1] == x1 and blocks[-1][3] == y1:
+            blocks[-1] = (blocks[-1][0], x2, blocks[-1][2], y2)
+        else:
+            blocks.append((x1, x2, y1, y2))
+    return blocks
+
+
+def diff_ranges(old, new):
+    """
+    The lines that differ between two texts, as character ranges
+    (old start, old end, new start, new end)
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    # the common lines at both ends are skipped before diffing, edits being usually few
+    prefix = 0
+    while (
+        prefix < min(len(old_lines), len(new_lines))
+        and old_lines[prefix] == new_lines[prefix]
+    ):
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < min(len(old_lines), len(new_lines)) - prefix
+        and old_lines[-1 - suffix] == new_lines[-1 - suffix]
+    ):
+        suffix += 1
+    old_offsets, new_offsets = [0], [0]
+    for line in old_lines:
+        old_offsets.append(old_offsets[-1] + len(line))
+    for line in new_lines:
+        new_offsets.append(new_offsets[-1] + len(line))
+
+    blocks = diff_lines(
+        old_lines[prefix : len(old_lines) - suffix],
+        new_lines[prefix : len(new_lines) - suffix],
+    )
+    return [
+        (
+            old_offsets[prefix + i1],
+            old_offsets[prefix + i2],
+            new_offsets[prefix + j1],
+            new_offsets[prefix + j2],
+        )
+        for i1, i2, j1, j2 in blocks
+    ]
+
+
+def match_sentences(old_keys, new_keys):
+    """
+    Pairs the sentences of a region before and after it was edited: the identical ones in
+    order, then the identical ones that moved, then the others one for one where as many
+    sentences replace as many.
+    :return: ({old index: new index}, indices of the new sentences that are new or edited)
+    """
+    matches = {}
+    replaced = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(
+        None, old_keys, new_keys, autojunk=False
+    ).get_opcodes():
+        if tag == "equal":
+            matches.update((i1 + k, j1 + k) for k in range(i2 - i1))
+        elif tag == "replace" and i2 - i1 == j2 - j1:
+            replaced.extend((i1 + k, j1 + k) for k in range(i2 - i1))
+
+    moved = defaultdict(list)
+    taken = set(matches.values())
+    for j, key in enumerate(new_keys):
+        if j not in taken:
+            moved[key].append(j)
+    for i, key in enumerate(old_keys):
+        if i not in matches and moved[key]:
+            matches[i] = moved[key].pop(0)
+    unchanged = set(matches.values())
+
+    for i, j in replaced:
+        if i not in matches and j not in unchanged:
+            matches[i] = j
+    return matches, set(range(len(new_keys))) - unchanged
+
+
+class Segmentation:
+    """
+    The tokens of a text and its sentences, as found by textunits.get_sentence_indices(),
+    kept so that the next versions of the text are segmented incrementally.
+
+    Sentences are numbered in the order of the text, like the sheets of prepare_file().
+    """
+
+    def __init__(self, text, tokens, starts, sentences):
+        self.text = text
+        self.tokens = tokens
+        self.starts = starts
+        # {"start", "end", "len"}, token indices with end included
+        self.sentences = sentences
+
+    def __len__(self):
+        return len(self.sentences)
+
+    @classmethod
+    def from_text(cls, text, tokenizer):
+        tokens = tokenizer(text)
+        return cls(
+            text, tokens, token_starts(text, tokens), get_sentence_indices(tokens)
+        )
+
+    def sentence_tokens(self):
+        """The sentences in the format of textunits.sentencify()"""
+        return [
+            (s["len"], self.tokens[s["start"] : s["end"] + 1]) for s in self.sentences
+        ]
+
+    def save(self, filename):
+        data = {
+            "version": VERSION,
+            "text": self.text,
+            "tokens": [list(t) for t in self.tokens],
+            "starts": self.starts,
+            "sentences": [[s["start"], s["end"], s["len"]] for s in self.sentences],
+        }
+        with atomic_file(filename) as tmp:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != VERSION:
+            raise ValueError(f"{filename} was written by another version")
+        return cls(
+            data["text"],
+            [Token(*t) for t in data["tokens"]],
+            data["starts"],
+            [{"start": s, "end": e, "len": n} for s, e, n in data["sentences"]],
+        )
+
+    def update(self, text, tokenizer):
+        """
+        Segments a new version of the text, only tokenizing and segmenting again the regions
+        that changed. A region is extended on both sides to a boundary of step 1 of
+        get_sentence_indices() (an ending particle followed by punctuation) whose neighbouring
+        sentences are too long to be joined across it, so that the result is the same as
+        segmenting the whole text. The tokenizer is expected to give the same tokens for a
+        region as for the whole text, which holds at such boundaries.
+
+        :return: (the new Segmentation, {old sentence number: new number, or None if the
+                 sentence is gone}, the new numbers of the sentences that are new or edited)
+        """
+        if text == self.text:
+            return self, {i: i for i in range(len(self))}, set()
+        n = len(self.tokens)
+
+        regions = []  # [b, c, new tokens, new starts, new sentences, delta]
+        changes = diff_ranges(self.text, text)
+        delta = 0  # of the characters before the current region
+        i = 0
+        while i < len(changes):
+            lo, hi = self._touched(changes[i])
+            group_delta = changes[i][3] - changes[i][2] - changes[i][1] + changes[i][0]
+            i += 1
+            b, c = self._edge_before(lo), self._edge_after(hi)
+            while True:
+                # the changes inside the region are segmented with it
+                while i < len(changes) and changes[i][0] <= self._char(c):
+                    _, h = self._touched(changes[i])
+                    group_delta += (
+                        changes[i][3] - changes[i][2] - changes[i][1] + changes[i][0]
+                    )
+                    c = max(c, self._edge_after(h))
+                    i += 1
+                if regions and b < regions[-1][1]:
+                    previous = regions.pop()
+                    b = previous[0]
+                    delta -= previous[5]
+                    group_delta += previous[5]
+                    continue
+                region = self._segment(b, c, text, delta, group_delta, tokenizer)
+                if region is not None:
+                    break
+                b = self._edge_before(b - 1) if b > 0 else 0
+                c = self._edge_after(c + 1) if c < n else n
+            regions.append([b, c, *region, group_delta])
+            delta += group_delta
+
+        return self._splice(text, regions)
+
+    def _char(self, t):
+        """The position in the text of the token t, the end of the text after the last one"""
+        return self.starts[t] if t < len(self.tokens) else len(self.text)
+
+    def _touched(self, change):
+        """The tokens that may be tokenized differently after a change, with a margin"""
+        old_start, old_end, _, _ = change
+        lo = max(bisect_right(self.starts, old_start) - 2, 0)
+        hi = min(bisect_left(self.starts, old_end) + 1, len(self.tokens))
+        return lo, hi
+
+    def _is_chunk_start(self, b):
+        tokens = self.tokens
+        if b == 0 or b == len(tokens):
+            return True
+        if b == 1:
+            # extract_chunks() compares the first token with the last one
+            return is_endpart_n_punct(tokens[-1], tokens[0])
+        return is_endpart_n_punct(tokens[b - 2], tokens[b - 1])
+
+    def _chunk_sentences(self, a, b):
+        """The sentences of the chunk of tokens [a, b) before they are joined"""
+        return split_chunks([{"start": a, "end": b - 1, "len": b - a}], self.tokens)
+
+    def _edge_before(self, t):
+        """The last boundary at or before the token t that the old sentences can't cross"""
+        b = max(t, 0)
+        while not self._is_chunk_start(b):
+            b -= 1
+        while b > 0:
+            a = b - 1
+            while not self._is_chunk_start(a):
+                a -= 1
+            sentences = self._chunk_sentences(a, b)
+            if sentences and sentences[-1]["len"] > JOIN_THRESHOLD:
+                return b
+            b = a
+        return 0
+
+    def _edge_after(self, t):
+        """The first boundary at or after the token t that the old sentences can't cross"""
+        n = len(self.tokens)
+        c = min(t, n)
+        while not self._is_chunk_start(c):
+            c += 1
+        while c < n:
+            d = c + 1
+            while not self._is_chunk_start(d):
+                d += 1
+            sentences = self._chunk_sentences(c, d)
+            if sentences and sentences[0]["len"] > JOIN_THRESHOLD:
+                return c
+            c = d
+        return n
+
+    def _segment(self, b, c, text, delta, group_delta, tokenizer):
+        """
+        Tokenizes and segments the new text of the old tokens [b, c).
+        :return: (tokens, starts, sentences) with indices relative to the region, or None if
+                 the region can't be segmented apart from the rest of the text
+        """
+        n = len(self.tokens)
+        start = self._char(b) + delta if b > 0 else 0
+        end = self._char(c) + delta + group_delta if c < n else len(text)
+        tokens = tokenizer(text[start:end])
+        starts = token_starts(text[start:end], tokens, start)
+        if b == 0 and c == n:
+            return tokens, starts, get_sentence_indices(tokens)
+        if not tokens:
+            return None
+
+        if c < n and (
+            len(tokens) < 2 or not is_endpart_n_punct(tokens[-2], tokens[-1])
+        ):
+            return None
+        if b > 0 and is_endpart_n_punct(tokens[-1], tokens[0]):
+            return None
+        if b == 0 and is_endpart_n_punct(self.tokens[-1], tokens[0]):
+            return None
+        if b > 0 and c == n:
+            if is_endpart_n_punct(
+                self.tokens[-1], self.tokens[0]
+            ) != is_endpart_n_punct(tokens[-1], self.tokens[0]):
+                return None
+
+        chunks = extract_chunks(is_endpart_n_punct, tokens, 0, 0)
+        if not chunks and b > 0 and len(tokens) > 1:
+            # the rest of the text after the last boundary, see extract_chunks()
+            chunks = [{"start": 0, "end": len(tokens) - 1, "len": len(tokens)}]
+        sentences = split_chunks(chunks, tokens)
+        if b > 0 and (not sentences or sentences[0]["len"] <= JOIN_THRESHOLD):
+            return None
+        if c < n and (not sentences or sentences[-1]["len"] <= JOIN_THRESHOLD):
+            return None
+        return tokens, starts, join_no_verb_sentences(sentences, tokens)
+
+    def _splice(self, text, regions):
+        tokens, starts, sentences = [], [], []
+        mapping, changed = {}, set()
+        s = 0  # next old sentence
+        previous, delta = 0, 0
+
+        def copy_until(t):
+            nonlocal s
+            shift = len(tokens) - previous
+            while s < len(self.sentences) and self.sentences[s]["start"] < t:
+                old = self.sentences[s]
+                mapping[s] = len(sentences)
+                sentences.append(
+                    {
+                        "start": old["start"] + shift,
+                        "end": old["end"] + shift,
+                        "len": old["len"],
+                    }
+                )
+                s += 1
+            tokens.extend(self.tokens[previous:t])
+            starts.extend(x + delta for x in self.starts[previous:t])
+
+        for b, c, new_tokens, new_starts, new_sentences, group_delta in regions:
+            copy_until(b)
+            old_first = s
+            while s < len(self.sentences) and self.sentences[s]["start"] < c:
+                s += 1
+            old_keys = [self._key(self.tokens, x) for x in self.sentences[old_first:s]]
+            new_keys = [self._key(new_tokens, x) for x in new_sentences]
+            first = len(sentences)
+            matches, edited = match_sentences(old_keys, new_keys)
+            for i in range(len(old_keys)):
+                j = matches.get(i)
+                mapping[old_first + i] = None if j is None else first + j
+            changed.update(first + j for j in edited)
+
+            shift = len(tokens)
+            sentences.extend(
+                {"start": x["start"] + shift, "end": x["end"] + shift, "len": x["len"]}
+                for x in new_sentences
+            )
+            tokens.extend(new_tokens)
+            starts.extend(new_starts)
+            previous, delta = c, delta + group_delta
+        copy_until(len(self.tokens))
+        return Segmentation(text, tokens, starts, sentences), mapping, changed
+
+    @staticmethod
+    def _key(tokens, sentence):
+        return tuple(t.content for t in tokens[sentence["start"] : sentence["end"] + 1])
@@ -0,0 +1,287 @@
+"""
+Local HTTP service rendering sheets, for annotation tools that need a tree on every edit.
+
+    python -m syntactic_analysis.server --port 8765
+
+POST /render with the tsv content of a sheet as body, and as query parameters:
+    format       svg (default), png, rules or mshang
+    version      0 for the main tree (default), n for the tree of the n-th simplified sentence
+    translate    en_bo (default), bo_en or none
+    square       1 to draw squares around the leafs
+    embed        1 to embed the subset of the font used in svgs
+    dpi          resolution of png images
+
+GET /health answers "ok".
+
+Errors: 400 if the sheet can't be parsed, 503 with a Retry-After header when the queue is full,
+500 if the tree can't be rendered.
+"""
+
+import argparse
+import hashlib
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from .analysis import font_path, generate_analysis, generate_mshang_link, roof_height
+from .cache import LRUCache
+from .corpus import SHEET_ERRORS
+from .latex import LatexMkBuilder
+from .raster import DEFAULT_DPI, rasterize
+
+FORMATS = {
+    "svg": "image/svg+xml; charset=utf-8",
+    "png": "image/png",
+    "rules": "text/plain; charset=utf-8",
+    "mshang": "text/plain; charset=utf-8",
+}
+TRANSLATIONS = {"en_bo": "en_bo", "bo_en": "bo_en", "none": False}
+# seconds a request waits for its result
+TIMEOUT = 60
+
+
+class Busy(Exception):
+    """The queue of the service is full"""
+
+
+class Job:
+    def __init__(
+        self, key, content, format, version, translate_tree, square, dpi, embed
+    ):
+        self.key = key
+        self.content = content
+        self.format = format
+        self.version = version
+        self.translate_tree = translate_tree
+        self.square = square
+        self.dpi = dpi
+        self.embed = embed
+        self.future = Future()
+
+
+class RenderService:
+    """
+    Renders sheets on a fixed pool of worker threads.
+
+    Requests wait in a bounded queue: when it is full, submit() raises Busy instead of letting
+    the backlog grow. Each worker takes all the jobs waiting, up to batch_size, and renders
+    them together: the pdfs of the png jobs are compiled with the same builder and rasterized
+    concurrently. Identical requests made while one is pending share its result, and recent
+    results are kept in an LRU cache.
+    """
+
+    def __init__(
+        self, workers=2, queue_size=64, batch_size=16, cache_size=256, font=None
+    ):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.cache = LRUCache(cache_size)
+        self.font = font
+        # key -> Future of the jobs queued or being rendered
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(
+        self,
+        content,
+        format="svg",
+        version=0,
+        translate_tree="en_bo",
+        square=False,
+        dpi=DEFAULT_DPI,
+        embed=False,
+    ):
+        """
+        :return: a Future of (content type, bytes)
+        """
+        if format not in FORMATS:
+            raise ValueError(f"allowed formats are: {', '.join(FORMATS)}")
+        if version < 0:
+            raise ValueError("version must be positive")
+        params = f"{format}\t{version}\t{translate_tree}\t{square}\t{dpi}\t{embed}"
+        key = hashlib.sha1(f"{params}\n{content}".encode("utf-8")).hexdigest()
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            job = Job(key, content, format, version, translate_tree, square, dpi, embed)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                raise Busy(f"{self.queue.maxsize} requests are already waiting")
+            self.pending[key] = job.future
+        return job.future
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._render(batch)
+
+    def _render(self, batch):
+        pngs = []
+        for job in batch:
+            try:
+                tree, versions, rules = generate_analysis(
+                    job.content, translate_tree=job.translate_tree
+                )
+                if job.version:
+                    tree = versions[job.version - 1]
+                if job.format == "svg":
+                    svg = tree.build_svg(font=self.font, embed_font=job.embed)
+                    self._done(job, svg.encode("utf-8"))
+                elif job.format == "rules":
+                    self._done(job, rules.encode("utf-8"))
+                elif job.format == "mshang":
+                    self._done(job, generate_mshang_link(tree).encode("utf-8"))
+                else:
+                    pngs.append((job, tree))
+            except Exception as e:
+                self._failed(job, e)
+
+        if pngs:
+            self._render_pngs(pngs)
+
+    def _render_pngs(self, pngs):
+        builder = LatexMkBuilder()
+        rasterize_jobs = []
+        for job, tree in pngs:
+            try:
+                source = tree.gen_latex(
+                    from_roof=roof_height(tree), draw_square=job.square, font=self.font
+                )
+                pdf = builder.build_pdf(source, [], depends=[font_path(self.font)])
+                rasterize_jobs.append((job, pdf))
+            except Exception as e:
+                self._failed(job, e)
+
+        def to_png(args):
+            job, pdf = args
+            try:
+                image = rasterize(pdf, dpi=job.dpi)
+                buffer = BytesIO()
+                image.save(buffer, format="PNG", optimize=True)
+                image.close()
+                self._done(job, buffer.getvalue())
+            except Exception as e:
+                self._failed(job, e)
+
+        with ThreadPoolExecutor() as pool:
+            list(pool.map(to_png, rasterize_jobs))
+
+    def _done(self, job, data):
+        result = (FORMATS[job.format], data)
+        self.cache.put(job.key, result)
+        with self.lock:
+            self.pending.pop(job.key, None)
+        job.future.set_result(result)
+
+    def _failed(self, job, error):
+        with self.lock:
+            self.pending.pop(job.key, None)
+        job.future.set_exception(error)
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._respond(200, "text/plain; charset=utf-8", b"ok")
+        else:
+            self._respond(404, "text/plain; charset=utf-8", b"not found")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/render":
+            self._respond(404, "text/plain; charset=utf-8", b"not found")
+            return
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        try:
+            # a bad length or a body that isn't utf-8 is a ValueError too
+            length = int(self.headers.get("Content-Length", 0))
+            content = self.rfile.read(length).decode("utf-8-sig")
+            future = self.service.submit(
+                content,
+                format=query.get("format", "svg"),
+                version=int(query.get("version", 0)),
+                translate_tree=TRANSLATIONS[query.get("translate", "en_bo")],
+                square=query.get("square") == "1",
+                dpi=int(query.get("dpi", DEFAULT_DPI)),
+                embed=query.get("embed") == "1",
+            )
+            content_type, data = future.result(timeout=TIMEOUT)
+        except Busy as e:
+            self._respond(
+                503, "text/plain; charset=utf-8", str(e).encode(), {"Retry-After": "1"}
+            )
+        except (KeyError,) + SHEET_ERRORS as e:
+            self._respond(400, "text/plain; charset=utf-8", str(e).encode())
+        except Exception as e:
+            self._respond(500, "text/plain; charset=utf-8", str(e).encode())
+        else:
+            self._respond(200, content_type, data)
+
+    def _respond(self, status, content_type, data, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host="127.0.0.1", port=8765, service=None):
+    """
+    :return: the HTTPServer, to be run with serve_forever()
+    """
+    handler = type("Handler", (RenderHandler,), {"service": service or RenderService()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--cache-size", type=int, default=256)
+    parser.add_argument("--font", default=None)
+    args = parser.parse_args()
+
+    service = RenderService(
+        workers=args.workers,
+        queue_size=args.queue_size,
+        cache_size=args.cache_size,
+        font=args.font,
+    )
+    server = make_server(args.host, args.port, service)
+    print(f"serving on http://{args.host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
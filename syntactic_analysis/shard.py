@@ -0,0 +1,140 @@
+import json
+import posixpath
+import shutil
+import zipfile
+from hashlib import sha1
+from pathlib import Path
+from xml.etree import ElementTree
+
+from .journal import JOURNAL
+
+MANIFEST = ".shard.json"
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+PACKAGE_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def stable_hash(key):
+    """Same value on every machine and run, unlike hash()"""
+    return int.from_bytes(sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+def sheet_weights(in_dir, header_sheets=0):
+    """
+    {sheet id: size} of the sheets analyze_constituency() processes in in_dir, with the same
+    ids as its journal: "<tsv stem>" and "<workbook stem>/<sheet>".
+    Sizes are those of the files, and of the xml parts of the sheets as listed in the zip
+    directory of the workbooks: no sheet is read, every shard can compute them.
+    """
+    in_dir = Path(in_dir)
+    weights = {}
+    for tsv in sorted(in_dir.glob("*.tsv")):
+        weights[tsv.stem] = tsv.stat().st_size
+    for xlsx in sorted(in_dir.glob("*.xlsx")):
+        sizes = workbook_sheet_sizes(xlsx)
+        for sheet in list(sizes)[header_sheets:]:
+            weights[f"{xlsx.stem}/{sheet}"] = sizes[sheet]
+    return weights
+
+
+def workbook_sheet_sizes(xlsx):
+    """
+    {sheet name: uncompressed size of its xml part}, in the order of the sheets, read from
+    the workbook part and the zip directory only
+    """
+    with zipfile.ZipFile(xlsx) as z:
+        rels = ElementTree.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        targets = {
+            rel.get("Id"): rel.get("Target")
+            for rel in rels.iter(f"{PACKAGE_NS}Relationship")
+        }
+        workbook = ElementTree.fromstring(z.read("xl/workbook.xml"))
+        sizes = {}
+        for sheet in workbook.iter(f"{MAIN_NS}sheet"):
+            target = targets[sheet.get(REL_ID)]
+            # relative to xl/, or absolute in the package
+            if target.startswith("/"):
+                part = target[1:]
+            else:
+                part = posixpath.normpath(posixpath.join("xl", target))
+            sizes[sheet.get("name")] = z.getinfo(part).file_size
+    return sizes
+
+
+def partition(weights, shards):
+    """
+    Splits the sheets in shards of about the same total size: the largest sheets are placed
+    first, each one in the lightest shard. Ties are broken by stable_hash(), so that every
+    process computes the same partition.
+    :return: list of sets of sheet ids
+    """
+    parts = [set() for _ in range(shards)]
+    loads = [0] * shards
+    for key in sorted(weights, key=lambda k: (-weights[k], stable_hash(k), k)):
+        lightest = min(range(shards), key=lambda s: (loads[s], s))
+        parts[lightest].add(key)
+        loads[lightest] += weights[key]
+    return parts
+
+
+def shard_sheets(in_dir, shards, shard, header_sheets=0):
+    if not 0 <= shard < shards:
+        raise ValueError(f"shard must be between 0 and {shards - 1}")
+    return partition(sheet_weights(in_dir, header_sheets), shards)[shard]
+
+
+def write_manifest(out_dir, shards, shard, sheets):
+    manifest = {"shards": shards, "shard": shard, "sheets": sorted(sheets)}
+    Path(out_dir / MANIFEST).write_text(
+        json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8"
+    )
+
+
+def merge_shards(shard_dirs, out_dir):
+    """
+    Combines the output folders of the shards of a run into out_dir, with the layout of a
+    run done in a single process: the outputs are copied and the journals are merged.
+    Stats can then be computed on out_dir as usual.
+
+    :return: the sheets that failed, as in Journal.failed()
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    manifests = [
+        json.loads((Path(d) / MANIFEST).read_text(encoding="utf-8")) for d in shard_dirs
+    ]
+    shards = {m["shards"] for m in manifests}
+    if len(shards) != 1:
+        raise ValueError("the folders come from runs with different amounts of shards")
+    missing = set(range(shards.pop())) - {m["shard"] for m in manifests}
+    if missing:
+        raise ValueError(f"missing shards: {sorted(missing)}")
+
+    entries = []
+    for shard_dir in map(Path, shard_dirs):
+        for path in sorted(shard_dir.rglob("*")):
+            relative = path.relative_to(shard_dir)
+            if path.is_dir() or relative.name == MANIFEST:
+                continue
+            if relative == Path(JOURNAL):
+                for line in path.read_text(encoding="utf-8").split("\n"):
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # empty line or line cut by an interrupted run
+                        continue
+                continue
+            target = out_dir / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(path, target)
+
+    failed = {}
+    with (out_dir / JOURNAL).open("w", encoding="utf-8") as f:
+        for entry in sorted(entries, key=lambda e: e["time"]):
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if entry["status"] == "failed":
+                failed[entry["sheet"]] = entry.get("error")
+            else:
+                failed.pop(entry["sheet"], None)
+    return failed
@@ -1,91 +1,262 @@
 # coding: utf-8
 from pathlib import Path
-import xlrd
+import os
 from openpyxl import Workbook, load_workbook
+from openpyxl.packaging.custom import StringProperty
 import csv
-from copy import deepcopy
+import pickle
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from hashlib import sha1
 
-from .analysis import normalize_raw_tree
+from tempdir import TempDir
 
+from .analysis import tagset
+from .corpus import rows_to_tsv
+from .file_utils import atomic_file
 
-def xlsx_to_tsv(filename, out_dir):
+# workbooks opened read-only by this process, see open_workbook()
+MAX_OPEN_WORKBOOKS = 4
+_workbooks = OrderedDict()
+
+
+def open_workbook(filename):
+    """
+    filename loaded read-only, once per process: the sheets of a workbook read by the jobs
+    a worker runs share it instead of each parsing the workbook and its shared strings again.
+    A workbook modified since it was opened is opened again.
+    """
+    filename = Path(filename).resolve()
+    stat = filename.stat()
+    key = (filename, stat.st_size, stat.st_mtime_ns)
+    if key in _workbooks:
+        _workbooks.move_to_end(key)
+        return _workbooks[key]
+    workbook = load_workbook(filename=filename, read_only=True)
+    _workbooks[key] = workbook
+    while len(_workbooks) > MAX_OPEN_WORKBOOKS:
+        _workbooks.popitem(last=False)[1].close()
+    return workbook
+
+
+def close_workbooks():
+    """Closes the workbooks open_workbook() kept open in this process"""
+    while _workbooks:
+        _workbooks.popitem()[1].close()
+
+
+def xlsx_to_tsv(filename, out_dir, workers=None):
+    """
+    Writes every sheet of filename in out_dir/<filename stem>/<sheet>.tsv
+    Sheets are read in parallel, the ones whose tsv is already up to date are not written again
+    and the tsv files of sheets that were removed from the workbook are deleted.
+    """
     filename, out_dir = Path(filename), Path(out_dir)
 
-    # create and / or empty output folder
-    if not out_dir.is_dir():
-        out_dir.mkdir(exist_ok=True)
-    out_dir = out_dir / filename.stem
-    out_dir.mkdir(exist_ok=True)
-    for f in out_dir.glob("*.*"):
-        f.unlink()
-
-    # write all sheets to temp tsv files
-    workbook = xlrd.open_workbook(filename)
-    sheets = workbook.sheet_names()
-    for s in sheets:
-        sheet = workbook.sheet_by_name(s)
-        tsv = out_dir / f"{s}.tsv"
-        with tsv.open("w", encoding='utf-8-sig') as w:
-            writer = csv.writer(w, delimiter="\t")
-            for rownum in range(sheet.nrows):
-                writer.writerow(sheet.row_values(rownum))
-
-
-def tsv_to_xlsx(tsv_dir):
+    jobs = _sheet_jobs(filename, out_dir / filename.stem)
+    try:
+        return sum(ordered_map(_sheet_to_tsv, jobs, workers))
+    finally:
+        close_workbooks()
+
+
+def _sheet_jobs(filename, tsv_dir):
+    """Creates tsv_dir, removes the tsv files of deleted sheets and lists the sheets to convert"""
+    tsv_dir.mkdir(parents=True, exist_ok=True)
+    # not kept open: the processes of the pool would share its file
+    workbook = load_workbook(filename=filename, read_only=True)
+    sheets = workbook.sheetnames
+    workbook.close()
+    for f in tsv_dir.glob("*.tsv"):
+        if f.stem not in sheets:
+            f.unlink()
+    return [(filename, s, tsv_dir / f"{s}.tsv") for s in sheets]
+
+
+def _sheet_to_tsv(job):
+    filename, sheet, tsv = job
+    # csv's default line ending, that the tsv files kept under version control have
+    content = rows_to_tsv(open_workbook(filename)[sheet].values, lineterminator='\r\n')
+    return write_if_changed(tsv, content.encode('utf-8-sig'))
+
+
+def tsv_to_xlsx(tsv_dir, filename=None):
+    """
+    Writes all the .tsv files of tsv_dir as sheets of <tsv_dir>.xlsx, or filename if given.
+    The hash of the tsv files is kept in the workbook's properties, so that an up to date
+    workbook is not written again.
+    :return: True if the workbook was written
+    """
     tsv_dir = Path(tsv_dir)
     if not tsv_dir.is_dir():
         raise NotADirectoryError
-    if not tsv_dir.glob('*.tsv'):
+    tsvs = sorted(tsv_dir.glob('*.tsv'))
+    if not tsvs:
         raise FileNotFoundError
+    filename = Path(filename) if filename else Path(str(tsv_dir) + '.xlsx')
+
+    digest = sha1()
+    for t in tsvs:
+        digest.update(t.stem.encode('utf-8') + b'\0')
+        digest.update(sha1(t.read_bytes()).digest())
+    digest = digest.hexdigest()
+    if filename.is_file() and workbook_hash(filename) == digest:
+        return False
 
-    workbook = Workbook()
-    workbook.remove_sheet(workbook.active)
-    for t in sorted(tsv_dir.glob('*.tsv')):
+    workbook = Workbook(write_only=True)
+    workbook.custom_doc_props.append(StringProperty(name=HASH_PROPERTY, value=digest))
+    for t in tsvs:
         sheet = workbook.create_sheet(title=t.stem)
-        reader = csv.reader(t.open(encoding='utf-8-sig'), delimiter='\t')
-        for row in reader:
-            sheet.append(row)
+        with t.open(encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f, delimiter='\t'):
+                sheet.append(row)
+
+    with atomic_file(filename) as tmp:
+        workbook.save(filename=tmp)
+    return True
+
+
+HASH_PROPERTY = 'tsv-sha1'
+
+
+def workbook_hash(filename):
+    try:
+        workbook = load_workbook(filename=filename, read_only=True)
+    except (OSError, KeyError, ValueError):
+        return None
+    try:
+        for prop in workbook.custom_doc_props:
+            if prop.name == HASH_PROPERTY:
+                return prop.value
+    finally:
+        workbook.close()
+    return None
+
+
+def convert_dir(in_dir, out_dir, to='tsv', workers=None):
+    """
+    Converts a whole directory tree, keeping its structure.
+     - to="tsv": every .xlsx file becomes a folder of .tsv files, one per sheet
+     - to="xlsx": every folder containing .tsv files becomes a .xlsx file
+    Everything is written atomically and the targets that are up to date are left untouched.
+    :return: the amount of files written
+    """
+    in_dir, out_dir = Path(in_dir), Path(out_dir)
+    if not in_dir.is_dir():
+        raise NotADirectoryError
+
+    if to == 'tsv':
+        jobs = []
+        for xlsx in sorted(in_dir.rglob('*.xlsx')):
+            if xlsx.name.startswith('~$'):
+                continue
+            tsv_dir = out_dir / xlsx.relative_to(in_dir).parent / xlsx.stem
+            jobs.extend(_sheet_jobs(xlsx, tsv_dir))
+        # all the sheets of all the workbooks share the pool
+        try:
+            return sum(ordered_map(_sheet_to_tsv, jobs, workers))
+        finally:
+            close_workbooks()
+
+    elif to == 'xlsx':
+        jobs = []
+        for tsv_dir in sorted({t.parent for t in in_dir.rglob('*.tsv')}):
+            rel = tsv_dir.relative_to(in_dir)
+            xlsx = out_dir / rel.parent / ((rel.name or in_dir.name) + '.xlsx')
+            xlsx.parent.mkdir(parents=True, exist_ok=True)
+            jobs.append((tsv_dir, xlsx))
+        return sum(ordered_map(_tsv_to_xlsx, jobs, workers))
 
-    workbook.save(filename=str(tsv_dir) + '.xlsx')
+    else:
+        raise SyntaxError('to is either "tsv" or "xlsx"')
+
+
+def _tsv_to_xlsx(job):
+    return tsv_to_xlsx(*job)
+
+
+def write_if_changed(filename, content):
+    """Atomically writes content (bytes) to filename, unless it already holds the same content"""
+    filename = Path(filename)
+    if filename.is_file() and filename.stat().st_size == len(content):
+        if sha1(filename.read_bytes()).digest() == sha1(content).digest():
+            return False
+    with atomic_file(filename) as tmp:
+        Path(tmp).write_bytes(content)
+    return True
 
 
 def translate_tsv(tsv):
-    en = normalize_raw_tree(deepcopy(tsv), mode='bo_en')
-    bo = normalize_raw_tree(deepcopy(tsv), mode='en_bo')
+    en, bo = [], []
+    for row in tsv:
+        en_row, bo_row = translate_row(row)
+        en.append(en_row)
+        bo.append(bo_row)
+    return en, bo
+
+
+@lru_cache(maxsize=4096)
+def translate_cell(cell):
+    """
+    Same replacements as normalize_raw_tree(), in both directions at once
+    :return: the cell in english and in tibetan
+    """
+    en = bo = cell
+    for ud, tib in tagset:
+        en = en.replace(tib, ud)
+        bo = bo.replace(ud, tib)
+    return en, bo
+
+
+def translate_row(row):
+    en, bo = [], []
+    for cell in row:
+        if cell is None:
+            cell = ''
+        if isinstance(cell, str) and cell:
+            en_cell, bo_cell = translate_cell(cell)
+        else:
+            en_cell = bo_cell = cell
+        en.append(en_cell)
+        bo.append(bo_cell)
     return en, bo
 
 
-def translate_trees(filename):
+def translate_trees(filename, workers=None):
+    """
+    Writes <filename>_en and <filename>_bo next to filename, a .tsv or .xlsx file.
+    Workbooks are streamed row by row, their sheets being translated in parallel. The
+    workers write the translated rows to temporary files, read back one row at a time.
+    """
     filename = Path(filename)
     if filename.suffix == '.tsv':
-        reader = csv.reader(filename.open(encoding='utf-8-sig'), delimiter='\t')
-        en, bo = translate_tsv(list(reader))
-        for lang, tree in [('en', en), ('bo', bo)]:
-            tsv = filename.parent / f"{filename.stem}_{lang}.tsv"
-            with tsv.open("w", encoding='utf-8-sig') as w:
-                writer = csv.writer(w, delimiter="\t")
-                for row in tree:
-                    writer.writerow(row)
+        translate_tsv_file(
+            filename,
+            filename.parent / f"{filename.stem}_en.tsv",
+            filename.parent / f"{filename.stem}_bo.tsv",
+        )
     elif filename.suffix == '.xlsx':
-        workbook = load_workbook(filename=filename)
-        workbook_en = Workbook()
-        workbook_en.remove_sheet(workbook_en.active)
-        workbook_bo = Workbook()
-        workbook_bo.remove_sheet(workbook_bo.active)
-        sheets = workbook.sheetnames
-        for s in sheets:
-            sheet = workbook.get_sheet_by_name(s)
-            values = []
-            for row in sheet.values:
-                row = [r if r else '' for r in row]
-                values.append(row)
-            en, bo = translate_tsv(values)
-            ws_en = workbook_en.create_sheet(s)
-            for row in en:
-                ws_en.append(row)
-            ws_bo = workbook_bo.create_sheet(s)
-            for row in bo:
-                ws_bo.append(row)
+        sheets = open_workbook(filename).sheetnames
+        close_workbooks()
+
+        workbook_en = Workbook(write_only=True)
+        workbook_bo = Workbook(write_only=True)
+        with TempDir() as tmp_dir:
+            jobs = [
+                (filename, s, Path(tmp_dir) / f"{n}.pickle")
+                for n, s in enumerate(sheets)
+            ]
+            try:
+                for s, rows in zip(sheets, ordered_map(_translate_sheet, jobs, workers)):
+                    ws_en = workbook_en.create_sheet(s)
+                    ws_bo = workbook_bo.create_sheet(s)
+                    for en, bo in load_rows(rows):
+                        ws_en.append(en)
+                        ws_bo.append(bo)
+                    rows.unlink()
+            finally:
+                close_workbooks()
 
         workbook_en.save(filename=str(filename.parent / filename.stem) + '_en.xlsx')
         workbook_bo.save(filename=str(filename.parent / filename.stem) + '_bo.xlsx')
@@ -93,7 +264,38 @@ def translate_trees(filename):
         raise NotImplementedError
 
 
-def translate_tsv_dir(tsv_dir):
+def _translate_sheet(job):
+    """Writes the (en, bo) translations of the rows of a sheet to a file, see load_rows()"""
+    filename, sheet, rows = job
+    with open(rows, 'wb') as f:
+        for row in open_workbook(filename)[sheet].values:
+            pickle.dump(translate_row(row), f, pickle.HIGHEST_PROTOCOL)
+    return rows
+
+
+def load_rows(filename):
+    """Yields the rows pickled one after the other in filename"""
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def translate_tsv_file(in_file, en_file, bo_file):
+    with open(in_file, encoding='utf-8-sig', newline='') as r, \
+            open(en_file, 'w', encoding='utf-8-sig', newline='') as w_en, \
+            open(bo_file, 'w', encoding='utf-8-sig', newline='') as w_bo:
+        en_writer = csv.writer(w_en, delimiter="\t")
+        bo_writer = csv.writer(w_bo, delimiter="\t")
+        for row in csv.reader(r, delimiter='\t'):
+            en, bo = translate_row(row)
+            en_writer.writerow(en)
+            bo_writer.writerow(bo)
+
+
+def translate_tsv_dir(tsv_dir, workers=None):
     tsv_dir = Path(tsv_dir)
     if not tsv_dir.is_dir():
         raise NotADirectoryError
@@ -105,12 +307,34 @@ def translate_tsv_dir(tsv_dir):
     bo_dir = tsv_dir.parent / (tsv_dir.name + '_bo')
     bo_dir.mkdir(exist_ok=True)
 
-    for t in tsv_dir.glob('*.tsv'):
-        reader = csv.reader(t.open(encoding='utf-8-sig'), delimiter='\t')
-        en, bo = translate_tsv(list(reader))
-        for lang, tree, dir in [('en', en, en_dir), ('bo', bo, bo_dir)]:
-            tsv = dir / f"{t.stem}_{lang}.tsv"
-            with tsv.open("w", encoding='utf-8-sig') as w:
-                writer = csv.writer(w, delimiter="\t")
-                for row in tree:
-                    writer.writerow(row)
+    jobs = [
+        (t, en_dir / f"{t.stem}_en.tsv", bo_dir / f"{t.stem}_bo.tsv")
+        for t in tsv_dir.glob('*.tsv')
+    ]
+    for _ in ordered_map(_translate_tsv_file, jobs, workers):
+        pass
+
+
+def _translate_tsv_file(job):
+    translate_tsv_file(*job)
+
+
+def ordered_map(func, items, workers=None):
+    """
+    Like map(), in a pool of processes. Results are yielded in order, and only a few
+    jobs are submitted ahead of the one being consumed, to keep the memory bounded.
+    workers=1 runs everything in the current process.
+    """
+    if workers == 1:
+        yield from map(func, items)
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,6 +1,255 @@
+import csv
+import json
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import combinations
 from pathlib import Path
 
-in_path = '../output/བུ་ཡུག་རྩུབ་ཀྱི་བྱམས་བརྩེ།'
-for f in Path(in_path).glob('*.txt'):
-    content = f.read_text(encoding='utf-8-sig')
-    print()
\ No newline at end of file
+from .corpus import iter_trees, iter_workbooks, iter_workbook_sheets
+
+# frequency tables, all of them Counters
+TABLES = [
+    "rules",
+    "extra_rules",
+    "pos",
+    "vocab",
+    "depth",
+    "branching",
+    "sentence_length",
+    "cooccurrence",
+]
+# tables that have integers as keys
+NUMERIC_TABLES = ["depth", "branching", "sentence_length"]
+# breakdowns of the corpus and the counts they hold
+GROUPS = ["workbook", "annotator"]
+GROUP_COUNTS = ["sheets", "tokens", "rules", "errors"]
+
+
+class CorpusStats:
+    """
+    Frequencies computed over analyzed sheets.
+    Sheets are added one at a time, and stats computed on parts of the corpus
+    (by parallel workers for instance) can be merged with `+`.
+    """
+
+    def __init__(self):
+        self.tables = {name: Counter() for name in TABLES}
+        self.groups = {group: defaultdict(Counter) for group in GROUPS}
+
+    def add_tree(self, tree, version_trees=(), workbook=None, annotator=None):
+        rules = set()
+        phrases = set()
+        for production in tree.productions():
+            if production.is_lexical():
+                self.tables["pos"][str(production.lhs())] += 1
+                self.tables["vocab"][str(production)] += 1
+            else:
+                rules.add(str(production))
+                self.tables["rules"][str(production)] += 1
+        for subtree in tree.subtrees():
+            if subtree.height() > 2:
+                self.tables["branching"][len(subtree)] += 1
+                phrases.add(subtree.label())
+
+        extra_rules = set()
+        for version in version_trees:
+            for production in version.productions():
+                rule = re.sub(r"--extra\d+", "", str(production))
+                if not production.is_lexical() and rule not in rules:
+                    extra_rules.add(rule)
+        self.tables["extra_rules"].update(extra_rules)
+
+        self.tables["depth"][tree.height()] += 1
+        self.tables["sentence_length"][len(tree.leaves())] += 1
+        self.tables["cooccurrence"].update(
+            f"{a} + {b}" for a, b in combinations(sorted(phrases), 2)
+        )
+        self._count_groups(workbook, annotator, 1, len(tree.leaves()), len(rules), 0)
+
+    def add_rules(self, content, workbook=None, annotator=None):
+        """
+        Adds a sheet from the content of a _rules.txt file written by analyze_constituency().
+        Those don't keep the shape of the tree, so the depth and co-occurrences are not counted.
+        """
+        sections = parse_rules(content)
+        for rule in sections["rules"]:
+            self.tables["rules"][rule] += 1
+            self.tables["branching"][len(rule.split(" -> ")[1].split())] += 1
+        self.tables["extra_rules"].update(sections["extra rules"])
+        for entry in sections["vocab"]:
+            self.tables["pos"][entry.split(" -> ")[0]] += 1
+            self.tables["vocab"][entry] += 1
+        self.tables["sentence_length"][len(sections["vocab"])] += 1
+        self._count_groups(
+            workbook,
+            annotator,
+            1,
+            len(sections["vocab"]),
+            len(set(sections["rules"])),
+            0,
+        )
+
+    def add_error(self, workbook=None, annotator=None):
+        self._count_groups(workbook, annotator, 0, 0, 0, 1)
+
+    def _count_groups(self, workbook, annotator, *counts):
+        for group, name in [("workbook", workbook), ("annotator", annotator)]:
+            if name is not None:
+                self.groups[group][name].update(dict(zip(GROUP_COUNTS, counts)))
+
+    def __iadd__(self, other):
+        for name in TABLES:
+            self.tables[name].update(other.tables[name])
+        for group in GROUPS:
+            for name, counts in other.groups[group].items():
+                self.groups[group][name].update(counts)
+        return self
+
+    def __add__(self, other):
+        merged = CorpusStats()
+        merged += self
+        merged += other
+        return merged
+
+    def to_dict(self):
+        return {
+            "tables": {
+                name: {str(k): v for k, v in table.most_common()}
+                for name, table in self.tables.items()
+            },
+            "groups": {
+                group: {name: dict(counts) for name, counts in sorted(names.items())}
+                for group, names in self.groups.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        for name, table in d["tables"].items():
+            if name in NUMERIC_TABLES:
+                table = {int(k): v for k, v in table.items()}
+            stats.tables[name].update(table)
+        for group, names in d["groups"].items():
+            for name, counts in names.items():
+                stats.groups[group][name].update(counts)
+        return stats
+
+    def to_json(self, filename):
+        Path(filename).write_text(
+            json.dumps(self.to_dict(), ensure_ascii=False, indent=1), encoding="utf-8"
+        )
+
+    @classmethod
+    def from_json(cls, filename):
+        return cls.from_dict(json.loads(Path(filename).read_text(encoding="utf-8")))
+
+    def to_csv(self, out_dir):
+        """Writes one csv file per table and per breakdown in out_dir"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(exist_ok=True)
+        for name, table in self.tables.items():
+            if name in NUMERIC_TABLES:
+                rows = sorted(table.items())
+            else:
+                rows = table.most_common()
+            with (out_dir / f"{name}.csv").open("w", encoding="utf-8-sig") as w:
+                writer = csv.writer(w)
+                writer.writerow([name, "count"])
+                writer.writerows(rows)
+        for group, names in self.groups.items():
+            with (out_dir / f"{group}s.csv").open("w", encoding="utf-8-sig") as w:
+                writer = csv.writer(w)
+                writer.writerow([group] + GROUP_COUNTS)
+                for name, counts in sorted(names.items()):
+                    writer.writerow([name] + [counts[c] for c in GROUP_COUNTS])
+
+
+def parse_rules(content):
+    """Splits the content of a _rules.txt file into its "rules", "extra rules" and "vocab" sections"""
+    sections = {"rules": [], "extra rules": [], "vocab": []}
+    current = None
+    for line in content.split("\n"):
+        line = line.strip()
+        if line[:-1] in sections and line.endswith(":"):
+            current = line[:-1]
+        elif line and current:
+            sections[current].append(line)
+    return sections
+
+
+def workbook_stats(
+    workbook, path, header_sheets=0, translate_tree="en_bo", annotators=None
+):
+    """Stats of a single workbook. Sheets that can't be parsed are only counted as errors."""
+    annotator = annotators.get(workbook) if annotators else None
+    stats = CorpusStats()
+    sheets = (
+        (workbook, sheet, content)
+        for sheet, content in iter_workbook_sheets(path, header_sheets=header_sheets)
+    )
+    for _, _, tree, version_trees in iter_trees(
+        sheets,
+        translate_tree=translate_tree,
+        on_error=lambda *_: stats.add_error(workbook, annotator),
+    ):
+        stats.add_tree(tree, version_trees, workbook=workbook, annotator=annotator)
+    return stats
+
+
+def output_stats(out_dir, annotators=None):
+    """Stats of a folder written by analyze_excel_file()"""
+    out_dir = Path(out_dir)
+    workbook = out_dir.name
+    annotator = annotators.get(workbook) if annotators else None
+    stats = CorpusStats()
+    for rules in sorted(out_dir.glob("*_rules.txt")):
+        stats.add_rules(
+            rules.read_text(encoding="utf-8-sig"),
+            workbook=workbook,
+            annotator=annotator,
+        )
+    return stats
+
+
+def corpus_stats(
+    in_dir, header_sheets=0, translate_tree="en_bo", annotators=None, workers=1
+):
+    """
+    Stats over all the workbooks of in_dir (see corpus.iter_workbooks()).
+    Labels are normalized to Tibetan by default, so that sheets annotated with either tagset add up.
+
+    :param annotators: optional mapping of workbook names to annotators
+    :param workers: amount of processes, each one processing whole workbooks
+    """
+    job = partial(
+        _workbook_stats,
+        header_sheets=header_sheets,
+        translate_tree=translate_tree,
+        annotators=annotators,
+    )
+    return _merge(job, list(iter_workbooks(in_dir)), workers)
+
+
+def corpus_output_stats(out_dir, annotators=None, workers=1):
+    """Stats over the _rules.txt files found in the subfolders of out_dir, as written by analyze_constituency()"""
+    dirs = sorted(d for d in Path(out_dir).iterdir() if d.is_dir())
+    return _merge(partial(output_stats, annotators=annotators), dirs, workers)
+
+
+def _workbook_stats(workbook, **kwargs):
+    return workbook_stats(*workbook, **kwargs)
+
+
+def _merge(job, items, workers):
+    stats = CorpusStats()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial_stats in pool.map(job, items):
+                stats += partial_stats
+    else:
+        for item in items:
+            stats += job(item)
+    return stats
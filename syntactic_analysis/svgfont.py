@@ -0,0 +1,94 @@
+import base64
+import os
+from functools import lru_cache
+from hashlib import sha1
+from io import BytesIO
+
+from nltk.tree import Tree
+
+from .latex import FORMAT_DIR
+
+try:
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    subset = None
+
+# subsets written by previous runs, next to the precompiled LaTeX formats
+SUBSET_DIR = FORMAT_DIR.parent / "fonts"
+
+
+class FontSubset:
+    """A subset of a font, as a woff file to be embedded in svgs"""
+
+    def __init__(self, family, data):
+        self.family = family
+        self.data = data
+
+    def css(self):
+        data = base64.b64encode(self.data).decode("ascii")
+        return (
+            f'@font-face {{ font-family: "{self.family}"; '
+            f'src: url(data:font/woff;base64,{data}) format("woff"); }}'
+        )
+
+    def style(self):
+        """The <style> element to put in an svg or html page using the subset"""
+        return f"<style>{self.css()}</style>"
+
+
+def tree_text(trees):
+    """All the characters of the labels and words of the trees"""
+    chars = set()
+    for tree in trees:
+        for node in tree.subtrees():
+            chars.update(node.label())
+            chars.update(c for leaf in node if not isinstance(leaf, Tree) for c in leaf)
+    return "".join(sorted(chars))
+
+
+def font_subset(text, font=None):
+    """
+    Subset of a font of the fonts folder (the Monlam font by default) covering the characters
+    of text, with the glyphs its Tibetan stacks are shaped with.
+    Subsets are cached by the hash of their character set, in memory and on disk.
+    """
+    from .analysis import font_path
+
+    return _font_subset("".join(sorted(set(text))), str(font_path(font)))
+
+
+@lru_cache(maxsize=64)
+def _font_subset(chars, font_file):
+    if subset is None:
+        raise ImportError("embedding fonts in svgs requires fontTools")
+    stat = os.stat(font_file)
+    key = sha1(
+        f"{font_file}\t{stat.st_size}\t{stat.st_mtime_ns}\t{chars}".encode("utf-8")
+    ).hexdigest()
+    family = f"bo-{key[:12]}"
+    cached = SUBSET_DIR / f"{family}.woff"
+    if cached.is_file():
+        return FontSubset(family, cached.read_bytes())
+
+    options = subset.Options()
+    options.flavor = "woff"
+    options.hinting = False
+    font = TTFont(font_file)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=chars)
+    subsetter.subset(font)
+    buffer = BytesIO()
+    font.save(buffer)
+    data = buffer.getvalue()
+
+    SUBSET_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, cached)
+    return FontSubset(family, data)
+
+
+def batch_subset(trees, font=None):
+    """A single subset for all the trees, so that it is embedded or computed only once"""
+    return font_subset(tree_text(trees), font=font)
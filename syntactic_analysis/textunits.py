@@ -130,10 +130,28 @@ def get_sentence_indices(tokens):
 
     Output: list of sentences, each in the following format: (sentence-length, [word1, word2, ...])
     """
+    sentence_idx = split_sentence_indices(tokens)
+
+    # joining the sentences without verbs to either the one preceding them or following them
+    sentence_idx = join_no_verb_sentences(sentence_idx, tokens)
+
+    return sentence_idx
+
+
+def split_sentence_indices(tokens):
+    """
+    steps 1 to 4 of get_sentence_indices(), before the sentences without verbs are joined.
+    The sentences of a chunk found in step 1 only depend on the tokens of the chunk.
+    """
     # 1. find unambiguous sentence end markers: ending particles followed by punctuation
     previous_end = 0
     sentence_idx = extract_chunks(is_endpart_n_punct, tokens, 0, previous_end)
 
+    return split_chunks(sentence_idx, tokens)
+
+
+def split_chunks(sentence_idx, tokens):
+    """steps 2 to 4 of get_sentence_indices(), each chunk of step 1 being split on its own"""
     # 2. find clause boundaries followed by punctuation
     sentence_idx = piped_sentencify(sentence_idx, tokens, is_clause_boundary_n_punct)
 
@@ -143,9 +161,6 @@ def get_sentence_indices(tokens):
     # 4. find verbs followed by clause boundaries
     sentence_idx = piped_sentencify(sentence_idx, tokens, is_verb_n_clause_boundary, threshold=30)  # max size to check
 
-    # joining the sentences without verbs to either the one preceding them or following them
-    sentence_idx = join_no_verb_sentences(sentence_idx, tokens)
-
     return sentence_idx
 
 
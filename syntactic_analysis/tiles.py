@@ -0,0 +1,118 @@
+from collections import deque
+
+from nltk.tree import Tree
+
+# trees larger than this are split in tiles: xelatex gets slow on them (and its boxes
+# overflow past about 16000pt), and their pngs take hundreds of megabytes to rasterize
+MAX_LEAVES = 60
+MAX_HEIGHT = 16
+
+TIBETAN_DIGITS = str.maketrans("0123456789", "༠༡༢༣༤༥༦༧༨༩")
+
+
+def measure(tree):
+    """
+    (amount of leaves, height) of a tree, the height as Tree.height() counts it.
+    Iterative, so it works at any depth.
+    """
+    leaves = height = 0
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if isinstance(node, Tree):
+            stack.extend((child, depth + 1) for child in node)
+        else:
+            leaves += 1
+            height = max(height, depth)
+    return leaves, height
+
+
+def subtree_sizes(tree):
+    """id of every subtree -> (amount of leaves, height), in a single post-order pass"""
+    sizes = {}
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((c, False) for c in node if isinstance(c, Tree))
+            continue
+        leaves, height = 0, 1
+        for child in node:
+            if isinstance(child, Tree):
+                child_leaves, child_height = sizes[id(child)]
+            else:
+                child_leaves, child_height = 1, 1
+            leaves += child_leaves
+            height = max(height, child_height + 1)
+        sizes[id(node)] = (leaves, height)
+    return sizes
+
+
+def stub(n):
+    """The leaf standing for tile n in the tile it was cut from"""
+    return f"༺{str(n).translate(TIBETAN_DIGITS)}༻"
+
+
+def split_tree(tree, max_leaves=MAX_LEAVES, max_height=MAX_HEIGHT):
+    """
+    Cuts a large tree in tiles of at most max_leaves leaves and max_height levels, so that
+    rendering time and memory stay proportional to the size of the tree.
+
+    The first tile has the root of the tree. The subtrees that don't fit in a tile are
+    replaced by a node with their label and a stub leaf (see stub()), and become the root
+    of the next tiles, numbered in breadth-first order. Subtrees are shared with the tiles,
+    not copied.
+
+    The stubs count as leaves of their tile. Every child of a node takes at least a leaf,
+    so a tile whose root has more than max_leaves children has one leaf per child.
+
+    :return: [(tile, {number of a tile: its stub in this tile})], a single tile with
+             no stubs for the trees small enough
+    """
+    sizes = subtree_sizes(tree)
+    leaves, height = sizes[id(tree)]
+    if leaves <= max_leaves and height <= max_height:
+        return [(tree, {})]
+
+    tiles = []
+    pending = deque([tree])
+    while pending:
+        root = pending.popleft()
+        stubs = {}
+        # a leaf is set aside for every child of the nodes kept in the tile, the budget is
+        # what is left for the children to take more than that
+        budget = [max_leaves - len(root)]
+
+        def cut(node, depth):
+            children = []
+            for child in node:
+                if not isinstance(child, Tree):
+                    children.append(child)
+                    continue
+                leaves, height = sizes[id(child)]
+                # a stub takes a leaf and two levels: cutting smaller subtrees saves nothing
+                if leaves == 1 or (
+                    leaves - 1 <= budget[0]
+                    and (height <= 2 or depth + height <= max_height)
+                ):
+                    children.append(child)
+                    budget[0] -= leaves - 1
+                elif (
+                    leaves > max_leaves
+                    and height > 2
+                    and depth + 3 <= max_height
+                    and len(child) <= budget[0]
+                ):
+                    # a subtree larger than a tile: its top is kept in this one
+                    budget[0] -= len(child) - 1
+                    children.append(cut(child, depth + 1))
+                else:
+                    n = len(tiles) + len(pending) + 1
+                    stubs[n] = stub(n)
+                    children.append(type(child)(child.label(), [stubs[n]]))
+                    pending.append(child)
+            return type(node)(node.label(), children)
+
+        tiles.append((cut(root, 1), stubs))
+    return tiles
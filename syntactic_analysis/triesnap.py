@@ -0,0 +1,205 @@
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from array import array
+from hashlib import sha1
+from pathlib import Path
+
+from .file_utils import atomic_file
+
+# magic, amount of nodes, of syllables, of edge slots, length of the syllables, of the data
+HEADER = struct.Struct("<8s5I")
+MAGIC = b"BOTRIE01"
+LEAF, CHILDREN = 1, 2
+
+
+class SnapshotNode:
+    """A node of a TrieSnapshot, with the part of botok's trie Node that Tokenize uses"""
+
+    __slots__ = ("trie", "index")
+
+    def __init__(self, trie, index):
+        self.trie = trie
+        self.index = index
+
+    def is_match(self):
+        return bool(self.trie.flags[self.index] & LEAF)
+
+    def can_walk(self):
+        return bool(self.trie.flags[self.index] & CHILDREN)
+
+    @property
+    def data(self):
+        """Decoded on every access: the tokenizer modifies it, the snapshot is read-only"""
+        start, end = self.trie.data_offsets[self.index : self.index + 2]
+        if start == end:
+            return {"_": {}}
+        return pickle.loads(self.trie.data[start:end])
+
+
+class TrieSnapshot:
+    """
+    botok's trie, written once to a file that processes map read-only instead of each
+    building (or unpickling) its own copy: it loads at once, and the processes tokenizing
+    in parallel share its pages.
+
+    The file is a few flat arrays: an open-addressing hash table of the edges, keyed by the
+    parent node and the syllable, the syllables, the flags of the nodes and the pickled data
+    of the words. It is in the byte order of the machine that wrote it.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, nodes, syls, slots, syl_size, data_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a trie snapshot")
+        # name, size of the section, arrays of unsigned ints
+        sections = [
+            ("edges", 12 * slots, True),
+            ("syl_offsets", 4 * (syls + 1), True),
+            ("data_offsets", 4 * (nodes + 1), True),
+            ("flags", nodes, False),
+            ("syls", syl_size, False),
+            ("data", data_size, False),
+        ]
+        start = HEADER.size
+        for name, size, ints in sections:
+            section = view[start : start + size]
+            setattr(self, name, section.cast("I") if ints else section)
+            start += size
+        self._mask = slots - 1
+
+    def walk(self, syl, current_node=None):
+        """The child of current_node (the root if None) for syl, None if there is none"""
+        parent = 0 if current_node is None else current_node.index
+        key = syl.encode("utf-8")
+        edges, offsets = self.edges, self.syl_offsets
+        slot = zlib.crc32(key, parent) & self._mask
+        while True:
+            owner = edges[3 * slot]
+            if not owner:
+                return None
+            if owner == parent + 1:
+                s = edges[3 * slot + 1]
+                if self.syls[offsets[s] : offsets[s + 1]] == key:
+                    return SnapshotNode(self, edges[3 * slot + 2])
+            slot = (slot + 1) & self._mask
+
+
+def write_snapshot(head, filename):
+    """Writes the trie with the root node head (a botok Node) to filename, atomically"""
+    nodes, edges = [head], []
+    syl_ids, syls = {}, []
+    for parent, node in enumerate(nodes):  # breadth-first, nodes grows as it goes
+        for syl, child in node.children.items():
+            if syl not in syl_ids:
+                syl_ids[syl] = len(syls)
+                syls.append(syl.encode("utf-8"))
+            edges.append((parent, syl_ids[syl], len(nodes)))
+            nodes.append(child)
+
+    slots = 8
+    while slots < 2 * len(edges):
+        slots *= 2
+    table = array("I", [0]) * (3 * slots)
+    for parent, s, child in edges:
+        slot = zlib.crc32(syls[s], parent) & (slots - 1)
+        while table[3 * slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[3 * slot : 3 * slot + 3] = array("I", [parent + 1, s, child])
+
+    syl_offsets = array("I", [0])
+    for syl in syls:
+        syl_offsets.append(syl_offsets[-1] + len(syl))
+
+    flags = bytearray(len(nodes))
+    data_offsets, data = array("I", [0]), bytearray()
+    for n, node in enumerate(nodes):
+        flags[n] = (LEAF if node.leaf else 0) | (CHILDREN if node.children else 0)
+        # the data of the nodes that are not words is never read
+        if node.leaf:
+            data += pickle.dumps(node.data, pickle.HIGHEST_PROTOCOL)
+        data_offsets.append(len(data))
+
+    syl_text = b"".join(syls)
+    with atomic_file(filename) as tmp:
+        with open(tmp, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC, len(nodes), len(syls), slots, len(syl_text), len(data)
+                )
+            )
+            for section in [table, syl_offsets, data_offsets, flags, syl_text, data]:
+                f.write(section)
+
+
+def snapshot_name(config):
+    """
+    Name of the snapshot of the trie of a botok Config: its profile, the botok version and
+    a digest of the files of the dialect pack, so that editing them invalidates it.
+    """
+    from botok.vars import __version__
+
+    files = sorted(
+        str(f)
+        for component in (config.dictionary, config.adjustments)
+        for paths in component.values()
+        for f in paths
+    )
+    digest = sha1()
+    for f in files:
+        stat = os.stat(f)
+        digest.update(f"{f}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    return f"{config.profile}_{__version__}_{digest.hexdigest()[:12]}.trie"
+
+
+def snapshot_tokenizer(config=None, snapshot_dir=None, ignore_chars=None):
+    """
+    botok's WordTokenizer, with its trie mapped from a snapshot. The first call for a
+    dialect pack builds the trie as botok does and writes the snapshot.
+
+    :param config: botok Config, the default dialect pack if None
+    :param snapshot_dir: folder of the snapshots, the one of the dialect packs if None
+    """
+    from botok import Config, WordTokenizer
+    from botok.modifytokens.adjusttokens import AdjustTokens
+    from botok.textunits.bosyl import BoSyl
+    from botok.tokenizers.tokenize import Tokenize
+    from botok.tokenizers.wordtokenizer import get_part_lemmas
+    from botok.tries.trie import Trie
+
+    if config is None:
+        config = Config()
+    if snapshot_dir is None:
+        snapshot_dir = config.dialect_pack_path.parent
+    filename = Path(snapshot_dir) / snapshot_name(config)
+    if not filename.is_file():
+        # the custom entries are in the snapshot, added after the main ones as botok does
+        trie = Trie(
+            BoSyl,
+            config.profile,
+            main_data=config.dictionary,
+            custom_data=config.adjustments,
+            pickle_path=config.dialect_pack_path.parent,
+        )
+        write_snapshot(trie.head, filename)
+
+    # what WordTokenizer.__init__() sets up, the trie aside
+    tokenizer = WordTokenizer.__new__(WordTokenizer)
+    tokenizer.config = config
+    tokenizer.ignore_chars = ignore_chars
+    tokenizer.tok = Tokenize(TrieSnapshot(filename))
+    tokenizer.adj = AdjustTokens(
+        main=config.dictionary["rules"], custom=config.adjustments["rules"]
+    )
+    tokenizer.part_lemmas = get_part_lemmas(
+        config.dialect_pack_path
+        / "dictionary"
+        / "words_non_inflected"
+        / "particles.tsv"
+    )
+    return tokenizer
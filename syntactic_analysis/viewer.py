@@ -0,0 +1,144 @@
+from html import escape
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from .analysis import generate_analysis
+from .cache import LRUCache
+from .corpus import SHEET_ERRORS, rows_to_tsv
+from .svgfont import batch_subset
+
+
+class HTMLView:
+    """Displayed as html by notebooks"""
+
+    def __init__(self, html):
+        self.html = html
+
+    def _repr_html_(self):
+        return self.html
+
+
+class TreeViewer:
+    """
+    Pages through the trees of a workbook in a notebook: an .xlsx file, a folder of .tsv files
+    or a single .tsv file. Only the sheets of the page being displayed are read and rendered,
+    and the pages recently rendered are kept in an LRU cache.
+    With embed_font, each sheet embeds the subset of the font its trees use, instead of
+    relying on the fonts installed.
+
+        viewer = TreeViewer("input/workbook.xlsx", page_size=5)
+        viewer               # first page
+        viewer.next()        # following page
+        viewer.sheet("12")   # a single sheet
+        viewer.find("12")    # the page containing that sheet
+    """
+
+    def __init__(
+        self,
+        path,
+        page_size=10,
+        header_sheets=0,
+        translate_tree="en_bo",
+        versions=False,
+        font=None,
+        embed_font=False,
+        cache_size=64,
+    ):
+        self.path = Path(path)
+        self.page_size = page_size
+        self.translate_tree = translate_tree
+        self.versions = versions
+        self.font = font
+        self.embed_font = embed_font
+        self.cache = LRUCache(cache_size)
+        self.current = 0
+        self._workbook = None
+
+        if self.path.is_dir():
+            self.names = [tsv.stem for tsv in sorted(self.path.glob("*.tsv"))]
+        elif self.path.suffix == ".xlsx":
+            self._workbook = load_workbook(filename=self.path, read_only=True)
+            self.names = self._workbook.sheetnames[header_sheets:]
+        elif self.path.suffix == ".tsv":
+            self.names = [self.path.stem]
+        else:
+            raise NotImplementedError
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.names) // self.page_size))
+
+    def content(self, name):
+        """The tsv content of a sheet, read without reading the others"""
+        if name not in self.names:
+            raise KeyError(name)
+        if self._workbook is not None:
+            return rows_to_tsv(self._workbook[name].values)
+        path = self.path / f"{name}.tsv" if self.path.is_dir() else self.path
+        return path.read_text(encoding="utf-8-sig")
+
+    def render(self, name):
+        """The html of a sheet: its name, its tree and the versions if asked for"""
+        html = self.cache.get(name)
+        if html is not None:
+            return html
+        parts = [f"<h3>{escape(name)}</h3>"]
+        try:
+            tree, version_trees, _ = generate_analysis(
+                self.content(name), translate_tree=self.translate_tree
+            )
+        except SHEET_ERRORS as e:
+            parts.append(f'<pre style="color: red">{escape(str(e))}</pre>')
+        else:
+            trees = [tree] + (version_trees if self.versions else [])
+            subset = None
+            if self.embed_font:
+                # embedded once for the tree and its versions
+                subset = batch_subset(trees, self.font)
+                parts.append(subset.style())
+            for num, t in enumerate(trees):
+                if num:
+                    parts.append(f"<h4>version {num}</h4>")
+                parts.append(t.build_svg(font=self.font, subset=subset))
+        html = "\n".join(parts)
+        self.cache.put(name, html)
+        return html
+
+    def sheet(self, name):
+        return HTMLView(self.render(name))
+
+    def page(self, number):
+        """Displays the page, numbered from 0"""
+        self.current = min(max(number, 0), self.pages - 1)
+        return self
+
+    def next(self):
+        return self.page(self.current + 1)
+
+    def previous(self):
+        return self.page(self.current - 1)
+
+    def find(self, name):
+        """Displays the page containing the sheet"""
+        return self.page(self.names.index(name) // self.page_size)
+
+    def page_names(self, number=None):
+        number = self.current if number is None else number
+        return self.names[number * self.page_size : (number + 1) * self.page_size]
+
+    def _repr_html_(self):
+        names = self.page_names()
+        start = self.current * self.page_size
+        header = (
+            f"<p>page {self.current + 1}/{self.pages}, "
+            f"sheets {start + 1}-{start + len(names)} of {len(self.names)}</p>"
+        )
+        return "\n".join([header] + [self.render(name) for name in names])
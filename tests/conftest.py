@@ -0,0 +1,31 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from syntactic_analysis import schedule
+
+
+@pytest.fixture(autouse=True)
+def timings(tmp_path, monkeypatch):
+    """The Schedulers of the tests record their timings in tmp_path, not in the user's cache"""
+    monkeypatch.setattr(schedule, "TIMINGS", tmp_path / "timings.jsonl")
+    return tmp_path / "timings.jsonl"
+
+
+@pytest.fixture
+def in_file():
+    """The annotated sheet the tests run on"""
+    return Path(__file__).parent / "input" / "test_processed.tsv"
+
+
+@pytest.fixture
+def copy_sheet(in_file):
+    """copy_sheet(*paths) copies in_file to every path, creating the folders they are in"""
+
+    def copy(*paths):
+        for path in paths:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(in_file, path)
+
+    return copy
@@ -0,0 +1,15 @@
+from syntactic_analysis.prepare import Token
+
+
+def fake_tokenizer(string):
+    """Tokens written as word/POS, separated by spaces"""
+    tokens = []
+    for item in string.split():
+        word, pos = item.rsplit("/", 1)
+        start, syls = 0, []
+        for syl in word.split("་"):
+            if syl:
+                syls.append(list(range(start, start + len(syl))))
+            start += len(syl) + 1
+        tokens.append(Token(word, "punct" if pos == "punct" else "syl", pos, syls))
+    return tokens
@@ -0,0 +1,45 @@
+from syntactic_analysis.agreement import (
+    Labels,
+    compare_annotators,
+    decode,
+    per_annotator,
+    sheet_spans,
+    tree_spans,
+)
+from syntactic_analysis.analysis import generate_trees
+
+
+def test_grid_and_tree_spans(in_file):
+    content = in_file.read_text()
+    tree, _ = generate_trees(content, translate_tree="en_bo")
+    labels = Labels()
+    spans = tree_spans(tree, labels)
+    assert spans == sheet_spans(content, labels)
+    assert len(spans) == 9
+    assert (0, 18) in [decode(s) for s in spans]
+
+
+def test_compare_annotators(tmp_path, in_file, copy_sheet):
+    rows = in_file.read_text().split("\n")
+    # second annotator: NP over the first two words relabeled, VP over "སྙེད་" moved one word left
+    changed = list(rows)
+    num = [n for n, row in enumerate(rows) if "[བྱ་ཚོགས།]" in row][0]
+    changed[num] = changed[num].replace("[མིང་ཚོགས།", "[AdvP", 1)
+    changed[num] = changed[num].replace("\t[བྱ་ཚོགས།]\t", "\t[བྱ་ཚོགས།\t]", 1)
+
+    for annotator, content in [("a", rows), ("b", rows), ("c", changed)]:
+        (tmp_path / annotator / "book").mkdir(parents=True)
+        (tmp_path / annotator / "book" / "1.tsv").write_text("\n".join(content))
+    copy_sheet(tmp_path / "a" / "book" / "2.tsv")
+
+    results = compare_annotators({a: tmp_path / a for a in "abc"})
+    identical = results[("a", "b")]["total"]
+    assert identical.counts["sheets"] == 1
+    assert identical.scores()["labeled"]["f1"] == 1
+
+    scores = results[("a", "c")]["workbooks"]["book"].scores()
+    assert scores["unlabeled"]["f1"] == 8 / 9
+    assert scores["labeled"]["f1"] == 7 / 9
+    assert results[("a", "c")]["total"].confusion[("མིང་ཚོགས།", "བསྣན་ཚོགས།")] == 1
+
+    assert per_annotator(results)["c"].counts["sheets"] == 2
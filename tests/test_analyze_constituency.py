@@ -0,0 +1,134 @@
+from syntactic_analysis import analysis, analyze_constituency
+from syntactic_analysis.analysis import BoTree, generate_trees
+from syntactic_analysis.journal import JOURNAL, Journal
+from syntactic_analysis.latex import LatexMkBuilder
+
+
+def test_resume(tmp_path, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "good.tsv")
+    (in_dir / "broken.tsv").write_text("P\tNOUN\n")
+
+    # the broken sheet doesn't stop the batch
+    analyze_constituency(in_dir, out_dir, format="mshang", translate_tree="en_bo")
+    assert (out_dir / "good_mshang.txt").is_file()
+    journal = Journal(out_dir / JOURNAL)
+    assert journal.is_done("good")
+    assert list(journal.failed()) == ["broken"]
+
+    # only the failed sheet is processed again
+    (out_dir / "good_mshang.txt").unlink()
+    copy_sheet(in_dir / "broken.tsv")
+    analyze_constituency(
+        in_dir, out_dir, format="mshang", translate_tree="en_bo", resume=True
+    )
+    assert not (out_dir / "good_mshang.txt").exists()
+    assert (out_dir / "broken_mshang.txt").is_file()
+    assert not Journal(out_dir / JOURNAL).failed()
+
+
+def test_resume_other_outputs(tmp_path, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    analyze_constituency(in_dir, out_dir, format="mshang", translate_tree="en_bo")
+
+    # done for mshang, not for svg
+    analyze_constituency(
+        in_dir, out_dir, format="svg", translate_tree="en_bo", resume=True
+    )
+    assert (out_dir / "a.svg").is_file()
+
+    (out_dir / "a.svg").unlink()
+    analyze_constituency(
+        in_dir, out_dir, format="svg", translate_tree="en_bo", resume=True
+    )
+    assert not (out_dir / "a.svg").exists()
+
+
+def test_identical_trees_rendered_once(tmp_path, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    copy_sheet(in_dir / "b.tsv")
+
+    analyze_constituency(
+        in_dir, out_dir, format="svg", write_all=True, translate_tree="en_bo"
+    )
+    for name in ["", "_version1", "_version5"]:
+        a, b = out_dir / f"a{name}.svg", out_dir / f"b{name}.svg"
+        assert a.read_bytes() == b.read_bytes()
+        assert a.stat().st_nlink == 2
+
+
+def test_linked_files_not_overwritten(tmp_path, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    copy_sheet(in_dir / "b.tsv")
+    analyze_constituency(in_dir, out_dir, format="svg", translate_tree="en_bo")
+    a, b = out_dir / "a.svg", out_dir / "b.svg"
+    assert a.stat().st_nlink == 2
+    before = b.read_bytes()
+
+    # a changes, b is rendered again but its link to a.svg must not follow a
+    content = (in_dir / "a.tsv").read_text(encoding="utf-8-sig")
+    content = content.replace("རྒྱལ་པོ་", "བཙུན་མོ་", 1)
+    (in_dir / "a.tsv").write_text(content, encoding="utf-8-sig")
+    analyze_constituency(in_dir, out_dir, format="svg", translate_tree="en_bo")
+    assert b.read_bytes() == before
+    assert a.read_bytes() != before
+
+
+def test_several_formats(tmp_path, monkeypatch, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+
+    # the LaTeX source of a tree is generated once, for latex and pdf
+    sources = []
+    monkeypatch.setattr(
+        LatexMkBuilder,
+        "build_pdf",
+        lambda self, source, texinputs=[], depends=(): sources.append(source)
+        or b"%PDF",
+    )
+    gen_latex = BoTree.gen_latex
+    generated = []
+
+    def counted(tree, **kwargs):
+        generated.append(tree)
+        return gen_latex(tree, **kwargs)
+
+    monkeypatch.setattr(BoTree, "gen_latex", counted)
+
+    analyze_constituency(
+        in_dir,
+        out_dir,
+        format={"svg", "latex", "pdf", "mshang"},
+        write_all=True,
+        translate_tree="en_bo",
+    )
+    for suffix in [".svg", ".tex", ".pdf", "_mshang.txt", "_rules.txt"]:
+        assert (out_dir / f"a{suffix}").is_file()
+    assert (out_dir / "a_version5.pdf").read_bytes() == b"%PDF"
+    assert len(generated) == len(sources) == 6
+    assert (out_dir / "a.tex").read_text(encoding="utf-8-sig") in sources
+
+
+def test_build_png(tmp_path, monkeypatch, in_file):
+    tree, _ = generate_trees(
+        in_file.read_text(encoding="utf-8-sig"), translate_tree="en_bo"
+    )
+    monkeypatch.setattr(
+        LatexMkBuilder,
+        "build_pdf",
+        lambda self, source, texinputs=[], depends=(): b"%PDF",
+    )
+    written = []
+    monkeypatch.setattr(
+        analysis, "write_png", lambda pdf, filename, **kwargs: written.append(filename)
+    )
+    tree.build_png(tmp_path / "a.png", dpi=100)
+    assert written == [tmp_path / "a.png"]
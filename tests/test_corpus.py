@@ -0,0 +1,17 @@
+from syntactic_analysis.corpus import iter_sheets, iter_trees
+
+
+def test_iter_trees(tmp_path, copy_sheet, capsys):
+    copy_sheet(tmp_path / "book" / "1.tsv")
+    (tmp_path / "book" / "2.tsv").write_text("P\tNOUN\n", encoding="utf-8")
+
+    failed = []
+    trees = list(
+        iter_trees(
+            iter_sheets(tmp_path),
+            on_error=lambda workbook, sheet: failed.append((workbook, sheet)),
+        )
+    )
+    assert [(workbook, sheet) for workbook, sheet, _, _ in trees] == [("book", "1")]
+    assert trees[0][3] and failed == [("book", "2")]
+    assert "book/2" in capsys.readouterr().out
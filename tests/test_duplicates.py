@@ -0,0 +1,86 @@
+import csv
+
+import pytest
+from helpers import fake_tokenizer
+from openpyxl import load_workbook
+
+from syntactic_analysis.analysis import check_tree
+from syntactic_analysis.duplicates import (
+    DuplicateIndex,
+    normalize,
+    project_rows,
+    sheet_words_n_rows,
+)
+from syntactic_analysis.prepare import generate_sheet, prepare_file
+
+
+@pytest.fixture
+def corpus(tmp_path, copy_sheet):
+    in_dir = tmp_path / "annotated"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    return in_dir
+
+
+def test_index(in_file, corpus):
+    index = DuplicateIndex.from_corpus(corpus)
+    words, rows = sheet_words_n_rows(in_file.read_text(encoding="utf-8-sig"))
+    words = [normalize(w) for w in words]
+    assert len(index) == 1
+
+    match = index.query(words)
+    assert match.kind == "exact" and match.key == "annotated/a"
+    assert project_rows(match.rows, match.words, words) == [r[:19] for r in rows]
+
+    changed = words[:-1] + ["།"]
+    match = index.query(changed)
+    assert match.kind == "near" and match.similarity >= index.threshold
+    assert index.query(words[:4]) is None
+
+    inserted = words[:3] + ["ཁོ"] + words[3:]
+    projected = project_rows(rows, words, inserted)
+    assert not check_tree([row[1:] for row in projected])
+    assert all(len(row) == len(inserted) + 1 for row in projected)
+
+
+def test_prepare_file(tmp_path, corpus):
+    sentences = [
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+        "ཁོ/PRON ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+    ]
+    sheet = generate_sheet((5, fake_tokenizer(sentences[1])), 2, 1)
+    sheet[0] = ["", "[S", "", "", "", "]"]
+    sheet[1] = ["", "[NP]", "[VP", "", "]", ""]
+    with (corpus / "b.tsv").open("w", encoding="utf-8") as f:
+        csv.writer(f, delimiter="\t", lineterminator="\n").writerows(sheet)
+
+    text = tmp_path / "text.txt"
+    text.write_text("\n".join(sentences), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    found = prepare_file(
+        text,
+        out_dir,
+        duplicates="prefill",
+        index=DuplicateIndex.from_corpus(corpus),
+        tokenizer=fake_tokenizer,
+    )
+    assert {num: m.key for num, m in found.items()} == {1: "annotated/b", 2: "text/0"}
+    report = (out_dir / "text_duplicates.tsv").read_text(encoding="utf-8")
+    assert report.split("\n")[1:3] == [
+        "1\texact\t1.00\tannotated/b",
+        "2\texact\t1.00\ttext/0",
+    ]
+
+    workbook = load_workbook(out_dir / "text.xlsx", read_only=True)
+    assert workbook.sheetnames == ["0", "1", "2"]
+    rows = [[c or "" for c in row] for row in workbook["1"].values]
+    assert rows[8:10] == [r + [""] * (len(rows[8]) - len(r)) for r in sheet[:2]]
+    assert not any(c for row in workbook["2"].values for c in row[1:] if c == "[S")
+    workbook.close()
+
+    found = prepare_file(text, out_dir, duplicates="skip", tokenizer=fake_tokenizer)
+    assert list(found) == [2]
+    workbook = load_workbook(out_dir / "text.xlsx", read_only=True)
+    assert workbook.sheetnames == ["0", "1"]
+    workbook.close()
@@ -0,0 +1,40 @@
+import json
+
+from syntactic_analysis.analysis import BoTree
+from syntactic_analysis.export import export_corpus, parse_bits, to_penn
+
+
+def test_formats():
+    tree = BoTree.fromstring("(S--extra1 (NP (NOUN a) (ADP b)) (VERB c))")
+    tree.append(BoTree("PUNCT", ["("]))
+    assert to_penn(tree) == "(S (NP (NOUN a) (ADP b)) (VERB c) (PUNCT -LRB-))"
+    assert parse_bits(tree) == ["(S(NP*", "*)", "*", "*)"]
+
+
+def test_export_corpus(tmp_path, copy_sheet):
+    (tmp_path / "input" / "book").mkdir(parents=True)
+    for num in range(10):
+        copy_sheet(tmp_path / "input" / "book" / f"{num}.tsv")
+
+    shards = export_corpus(tmp_path / "input", tmp_path / "out", max_bytes=10000)
+    assert len(shards["penn"]) > 1
+
+    records = [
+        json.loads(line)
+        for shard in shards["jsonl"]
+        for line in shard.read_text(encoding="utf-8").splitlines()
+    ]
+    # the main tree and 5 versions for each sheet
+    assert len(records) == 60
+    assert records[0]["id"] == "book/0"
+    assert records[0]["labels"] == "en_bo"
+    assert len(records[0]["words"]) == 18
+    assert [r["version"] for r in records[:6]] == list(range(6))
+
+    penn = [
+        l for s in shards["penn"] for l in s.read_text(encoding="utf-8").splitlines()
+    ]
+    assert [r["tree"] for r in records] == penn
+
+    conll = "".join(s.read_text(encoding="utf-8") for s in shards["conll"])
+    assert conll.count("# sent_id = book/9") == 6
@@ -0,0 +1,32 @@
+import os
+import stat
+
+from syntactic_analysis.file_utils import atomic_file
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_atomic_file(tmp_path):
+    filename = tmp_path / "a.txt"
+    with atomic_file(filename) as tmp:
+        tmp.write_text("a")
+    assert filename.read_text() == "a"
+    # the mode of a file created with open()
+    (tmp_path / "b.txt").write_text("b")
+    assert mode(filename) == mode(tmp_path / "b.txt")
+
+    # a file replaced keeps its mode, a failed write leaves it as it was
+    os.chmod(filename, 0o600)
+    try:
+        with atomic_file(filename) as tmp:
+            tmp.write_text("c")
+            raise ValueError
+    except ValueError:
+        pass
+    assert filename.read_text() == "a"
+    with atomic_file(filename) as tmp:
+        tmp.write_text("c")
+    assert filename.read_text() == "c" and mode(filename) == 0o600
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.txt", "b.txt"]
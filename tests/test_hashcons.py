@@ -0,0 +1,39 @@
+from syntactic_analysis.analysis import generate_trees
+from syntactic_analysis.hashcons import TreeTable
+
+
+def test_intern(in_file):
+    content = in_file.read_text(encoding="utf-8-sig")
+    tree, versions = generate_trees(content, translate_tree="en_bo")
+    table = TreeTable()
+
+    interned = table.intern(tree)
+    assert interned == tree
+    assert table.intern(tree.copy(deep=True)) is interned
+    # the versions share the subtrees they have in common with the main tree
+    size = len(table)
+    for version in versions:
+        table.intern(version)
+    assert len(table) < size * (len(versions) + 1)
+
+
+def test_dedupe(tmp_path, in_file):
+    content = in_file.read_text(encoding="utf-8-sig")
+    tree, versions = generate_trees(content, translate_tree="en_bo")
+    table = TreeTable()
+
+    render, links = table.dedupe(
+        [(tree, "a"), (versions[0], "b"), (tree.copy(deep=True), "c")], "svg"
+    )
+    assert [f for _, f in render] == ["a", "b"]
+    assert links == [("a", "c")]
+    # the trees of the sheet are rendered, with the suffix of the versions
+    assert render[0][0] is tree and render[1][0] is versions[0]
+    assert render[1][0].label().endswith("--extra1")
+    # other render parameters are rendered again
+    render, links = table.dedupe([(tree, "d")], "png")
+    assert [f for _, f in render] == ["d"] and not links
+
+    table.forget(["a"])
+    render, links = table.dedupe([(tree, "e")], "svg")
+    assert [f for _, f in render] == ["e"] and not links
@@ -0,0 +1,55 @@
+from syntactic_analysis.analysis import generate_trees
+from syntactic_analysis.lexicon import Lexicon, LexiconIndex, build_lexicon
+
+
+def test_index(tmp_path, in_file):
+    tree, _ = generate_trees(
+        in_file.read_text(encoding="utf-8-sig"), translate_tree="en_bo"
+    )
+    lexicon = Lexicon()
+    lexicon.add_sheet("a/1", tree)
+    lexicon.add_sheet("a/2", tree)
+    filename = tmp_path / "lexicon.bin"
+    lexicon.save(filename)
+
+    with LexiconIndex(filename) as index:
+        words = sorted({w for w, _ in tree.pos()}, key=lambda w: w.encode("utf-8"))
+        assert [index.word(i) for i in range(len(index))] == words
+        word, pos = tree.pos()[0]
+        assert index.lookup(word)[pos] == 2 * tree.pos().count((word, pos))
+        assert index.suggest(word) == pos
+        assert index.sheets_of(word) == ["a/1", "a/2"]
+        assert index.lookup("missing") == {} and "missing" not in index
+        assert index.prefix(word[:2]) == [w for w in words if w.startswith(word[:2])]
+        assert index.prefix(word[:2], limit=1) == [index.prefix(word[:2])[0]]
+
+    loaded = Lexicon.load(filename)
+    assert loaded.entries() == lexicon.entries()
+
+
+def test_conflicts_and_updates(tmp_path, in_file, copy_sheet):
+    in_dir = tmp_path / "input"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    filename = tmp_path / "lexicon.bin"
+    lexicon = build_lexicon(in_dir, filename)
+    assert not lexicon.conflicts()
+
+    # the same sheet with another POS for one of its words
+    content = in_file.read_text(encoding="utf-8-sig")
+    tree, _ = generate_trees(content, translate_tree="en_bo")
+    word, pos = tree.pos()[0]
+    rows = [row.split("\t") for row in content.split("\n")]
+    p = [n for n, row in enumerate(rows) if row[0] == "P"][0]
+    rows[p][1] = "PART" if pos != "PART" else "NOUN"
+    (in_dir / "b.tsv").write_text(
+        "\n".join("\t".join(r) for r in rows), encoding="utf-8"
+    )
+
+    assert Lexicon.load(filename).update_corpus(in_dir) == (1, 0)
+    lexicon = build_lexicon(in_dir, filename)
+    conflict = [c for c in lexicon.conflicts() if c["word"] == word][0]
+    assert len(conflict["pos"]) == 2
+
+    (in_dir / "b.tsv").unlink()
+    assert Lexicon.load(filename).update_corpus(in_dir) == (0, 1)
@@ -0,0 +1,90 @@
+import csv
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from syntactic_analysis.analysis import generate_trees, parse_tree
+from syntactic_analysis.parser import (
+    Grammar,
+    parse,
+    prefill_sheet,
+    prefill_workbook,
+    tree_to_rows,
+)
+
+
+@pytest.fixture
+def gold(in_file):
+    return generate_trees(in_file.read_text(), translate_tree="en_bo")
+
+
+def test_tree_to_rows(gold):
+    tree, _ = gold
+    words, tags = zip(*tree.pos())
+    assert parse_tree(tree_to_rows(tree) + [list(tags)], words) == tree
+
+
+def test_parse(gold):
+    tree, versions = gold
+    grammar = Grammar()
+    grammar.add_tree(tree)
+    words, tags = zip(*tree.pos())
+
+    parsed = parse(grammar, tags, words)
+    assert parsed == tree
+    # the same with the binarized n-ary rules shared with the versions
+    for version in versions:
+        grammar.add_tree(version)
+    parsed = parse(grammar, tags, words)
+    assert parsed.label() == tree.label()
+    assert parsed.leaves() == tree.leaves()
+
+    assert parse(grammar, ["unknown"], ["word"]) is None
+
+
+def test_prefill_sheet(in_file, gold):
+    tree, _ = gold
+    grammar = Grammar()
+    grammar.add_tree(tree)
+    rows = list(csv.reader(in_file.read_text().split("\n"), delimiter="\t"))
+    rows = [r for r in rows if r]
+    p = [n for n, r in enumerate(rows) if r[0] == "P"][0]
+    assert prefill_sheet(rows, grammar) is None
+
+    empty = [[""] * len(r) for r in rows[:p]] + rows[p:]
+    filled = prefill_sheet(empty, grammar, translate_tree=False)
+    assert len(filled) == len(rows)
+    assert filled[p:] == rows[p:]
+    content = "\n".join("\t".join(r) for r in filled)
+    assert generate_trees(content, translate_tree="en_bo")[0] == tree
+
+
+def test_prefill_workbook(tmp_path, in_file, gold):
+    tree, _ = gold
+    grammar = Grammar()
+    grammar.add_tree(tree)
+    rows = [r for r in csv.reader(in_file.read_text().split("\n"), delimiter="\t") if r]
+    p = [n for n, r in enumerate(rows) if r[0] == "P"][0]
+    empty = [[""] * len(r) for r in rows[:p]] + rows[p:]
+
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    # a header sheet laid out as a sentence is left as is, a notes sheet is skipped
+    for name in ["header", "notes", "1"]:
+        sheet = workbook.create_sheet(name)
+        for row in [["some notes"]] if name == "notes" else empty:
+            sheet.append(row)
+    workbook.save(tmp_path / "in.xlsx")
+
+    out_file = tmp_path / "out.xlsx"
+    filled = prefill_workbook(
+        tmp_path / "in.xlsx", grammar, out_file, translate_tree=False, header_sheets=1
+    )
+    assert filled == 1
+    out = load_workbook(out_file, read_only=True)
+    assert out.sheetnames == ["header", "notes", "1"]
+    assert not any(
+        c for r in out["header"].values for c in r[1:] if c and c.startswith("[")
+    )
+    assert any(c for r in out["1"].values for c in r[1:] if c and c.startswith("["))
+    out.close()
@@ -0,0 +1,97 @@
+import random
+
+from syntactic_analysis import analyze_constituency, schedule
+from syntactic_analysis.analysis import generate_trees
+from syntactic_analysis.journal import Journal
+from syntactic_analysis.schedule import CostModel, Scheduler, sheet_features
+
+
+def test_features(in_file):
+    content = in_file.read_text(encoding="utf-8-sig")
+    tree, versions = generate_trees(content, translate_tree="en_bo")
+    leaves, height, n_versions = sheet_features(content)
+    assert leaves == len(tree.leaves())
+    assert height == tree.height()
+    assert n_versions == len(versions)
+
+
+def test_fit():
+    coefficients = [0.1, 0.5, 0.02, 0.05]
+    rng = random.Random(0)
+    records = []
+    for _ in range(50):
+        r = {
+            "format": "png",
+            "write_all": True,
+            "leaves": rng.randint(3, 60),
+            "height": rng.randint(3, 10),
+            "versions": rng.randint(0, 6),
+        }
+        x = CostModel.features(r["leaves"], r["height"], r["versions"], True)
+        r["seconds"] = sum(c * v for c, v in zip(coefficients, x))
+        records.append(r)
+    model = CostModel.fit(records)
+    assert all(
+        abs(a - b) < 1e-4 for a, b in zip(model.coefficients["png"], coefficients)
+    )
+    # too few timings for svg
+    assert "svg" not in model.coefficients
+
+
+def test_timings_loaded(timings):
+    rng = random.Random(0)
+    records = []
+    for _ in range(schedule.MIN_TIMINGS):
+        records.append(
+            {
+                "format": "svg",
+                "write_all": False,
+                "leaves": rng.randint(3, 60),
+                "height": rng.randint(3, 10),
+                "versions": 0,
+                "seconds": rng.random(),
+            }
+        )
+    schedule.write_timings(records, timings)
+    # the recorded timings are used by default
+    assert "svg" in Scheduler("svg").model.coefficients
+    assert not Scheduler("svg", timings=False).model.coefficients
+
+
+def test_largest_first(tmp_path, in_file):
+    content = in_file.read_text(encoding="utf-8-sig")
+    # no brackets and no simplified sentences
+    small = "\n".join(
+        line for line in content.split("\n") if line.startswith(("P", "W"))
+    )
+    order = []
+    scheduler = Scheduler("png", write_all=True, timings=tmp_path / "timings.jsonl")
+    scheduler.add("small", small, order.append, "small")
+    scheduler.add("large", content, order.append, "large")
+    assert scheduler.run(Journal(tmp_path / "journal")) == 2
+    assert order == ["large", "small"]
+    assert len(schedule.read_timings(tmp_path / "timings.jsonl")) == 2
+
+
+def test_workers(tmp_path, copy_sheet):
+    in_dir = tmp_path / "input"
+    in_dir.mkdir()
+    for name in "abcdef":
+        copy_sheet(in_dir / f"{name}.tsv")
+
+    outputs = {}
+    for workers in [1, 3]:
+        out_dir = tmp_path / f"output{workers}"
+        analyze_constituency(
+            in_dir,
+            out_dir,
+            format="svg",
+            write_all=True,
+            translate_tree="en_bo",
+            workers=workers,
+        )
+        outputs[workers] = {
+            p.name: p.read_bytes() for p in out_dir.iterdir() if p.suffix == ".svg"
+        }
+    assert len(outputs[1]) == 6 * 6
+    assert outputs[1] == outputs[3]
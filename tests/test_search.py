@@ -0,0 +1,43 @@
+import pytest
+
+from syntactic_analysis.search import TreeIndex, build_index, parse_query
+
+
+@pytest.fixture
+def index(tmp_path, copy_sheet):
+    in_dir = tmp_path / "input"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "1.tsv")
+    return build_index(in_dir, filename=tmp_path / "index.pkl")
+
+
+def test_lookups(index):
+    assert index.find_production("སྦྱོར་ཚོགས། -> མིང་ཚོགས། ཕྲད་ཚིག") == [
+        ("input/1", (0,))
+    ]
+    assert len(index.find_word("ནི་")) == 2
+    assert index.find_word("ནི་", pos="ཕྲད་ཚིག") == index.find_word("ནི་")
+    assert index.find_word("ནི་", pos="མིང་ཚིག") == []
+
+
+def test_structural_queries(index, tmp_path):
+    assert index.search("ཚིག་གྲུབ། < སྦྱོར་ཚོགས།") == [("input/1", ())]
+    # labels of the tagset are translated like the trees
+    assert index.search("S < PP") == [("input/1", ())]
+    assert len(index.search("ཚིག་གྲུབ། << NP")) == 2
+    assert index.search('NOUN < "བཙུན་མོ་"') == [("input/1", (1, 0, 0, 0))]
+    assert len(index.search("NP < (S < VP)")) == 1
+    assert index.search("NP !> S") == [("input/1", (0, 0))]
+    assert index.search("PP $. NP") == [("input/1", (0,))]
+    assert index.search("PP $, NP") == []
+    assert index.search("/ཚོགས།$/ < AuxP") == []
+
+    loaded = TreeIndex.load(tmp_path / "index.pkl")
+    assert loaded.search("NP < (S < VP)") == index.search("NP < (S < VP)")
+
+
+def test_query_errors():
+    with pytest.raises(SyntaxError):
+        parse_query("NP < (S < VP")
+    with pytest.raises(SyntaxError):
+        parse_query("NP <")
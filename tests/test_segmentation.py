@@ -0,0 +1,153 @@
+import random
+
+from helpers import fake_tokenizer
+
+from syntactic_analysis.prepare import prepare_file
+from syntactic_analysis.segmentation import Segmentation, diff_lines
+
+WORDS = [
+    "ང/PRON",
+    "ཁྱིམ/NOUN",
+    "ལ/ADP",
+    "འགྲོ/VERB",
+    "གོ/PART",
+    "།/punct",
+    "ཁོ/PRON",
+    "ནས/ADP",
+    "ཡིན/VERB",
+    "བ/PART",
+    "ན/SCONJ",
+    "ཏེ/SCONJ",
+    "འོ/PART",
+    "ཡི་གེ/NOUN",
+    "འབྲི/VERB",
+]
+
+
+def random_line(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 12)))
+
+
+def test_diff_lines():
+    assert diff_lines(list("abcd"), list("abcd")) == []
+    assert diff_lines(list("abcd"), list("axcd")) == [(1, 2, 1, 2)]
+    assert diff_lines(list("abcd"), list("abd")) == [(2, 3, 2, 2)]
+    assert diff_lines(list("abcd"), list("dcba"), max_edits=2) == [(0, 4, 0, 4)]
+
+
+def test_same_as_full_segmentation():
+    rng = random.Random(0)
+    for _ in range(300):
+        lines = [random_line(rng) for _ in range(rng.randrange(1, 30))]
+        segmentation = Segmentation.from_text("\n".join(lines), fake_tokenizer)
+        for _ in range(rng.randrange(1, 4)):
+            k = rng.randrange(len(lines) + 1)
+            edit = rng.random()
+            if edit < 0.4 and k < len(lines):
+                lines[k] = random_line(rng)
+            elif edit < 0.7:
+                lines.insert(k, random_line(rng))
+            elif k < len(lines):
+                del lines[k]
+        text = "\n".join(lines)
+
+        updated, mapping, changed = segmentation.update(text, fake_tokenizer)
+        full = Segmentation.from_text(text, fake_tokenizer)
+        assert updated.tokens == full.tokens
+        assert updated.starts == full.starts
+        assert updated.sentences == full.sentences
+        old, new = segmentation.sentence_tokens(), updated.sentence_tokens()
+        for i, j in mapping.items():
+            if j is not None and j not in changed:
+                assert old[i] == new[j]
+
+
+def test_only_the_edit_is_tokenized(tmp_path):
+    sentences = [
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+        "ཁོ/PRON ཡི་གེ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+    ]
+    lines = [sentences[i % 2] for i in range(200)]
+    segmentation = Segmentation.from_text("\n".join(lines), fake_tokenizer)
+    filename = tmp_path / "text.segments.json"
+    segmentation.save(filename)
+    segmentation = Segmentation.load(filename)
+
+    lines[100] = "ཁོ/PRON ཁྱིམ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct"
+    del lines[150]
+    tokenized = []
+
+    def tokenizer(string):
+        tokenized.append(string)
+        return fake_tokenizer(string)
+
+    updated, mapping, changed = segmentation.update("\n".join(lines), tokenizer)
+    assert len(updated) == 199 and changed == {100}
+    assert sum(map(len, tokenized)) < 500
+    assert mapping[99] == 99 and mapping[100] == 100
+    assert mapping[150] is None and mapping[151] == 150 and mapping[199] == 198
+
+
+def test_prepare_file_incremental(tmp_path):
+    text = tmp_path / "text.txt"
+    lines = [
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+        "ཁོ/PRON ཡི་གེ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+    ]
+    text.write_text("\n".join(lines), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    prepare_file(text, out_dir, tokenizer=fake_tokenizer, incremental=True)
+    assert (out_dir / "text.segments.json").is_file()
+
+    text.write_text("\n".join(lines[1:] + lines[:1]), encoding="utf-8")
+    prepare_file(text, out_dir, tokenizer=fake_tokenizer, incremental=True)
+    renumbered = (out_dir / "text_renumbered.tsv").read_text(encoding="utf-8")
+    assert renumbered.split("\n")[:3] == ["old\tnew", "0\t1", "1\t0"]
+
+
+def test_prepare_file_incremental_csv(tmp_path):
+    text = tmp_path / "text.txt"
+    lines = [
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+        "ཁོ/PRON ཡི་གེ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+    ]
+    text.write_text("\n".join(lines), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    prepare_file(text, out_dir, xlsx=False, tokenizer=fake_tokenizer, incremental=True)
+    (out_dir / "text_1.csv").write_text("annotated", encoding="utf-8")
+    (out_dir / "text_2.csv").write_text("annotated", encoding="utf-8")
+
+    # only the sheet of the edited sentence is written again
+    lines[1] = lines[1].replace("ཡི་གེ/NOUN ནས", "ཁྱིམ/NOUN ནས")
+    text.write_text("\n".join(lines), encoding="utf-8")
+    prepare_file(text, out_dir, xlsx=False, tokenizer=fake_tokenizer, incremental=True)
+    assert (out_dir / "text_1.csv").read_text(encoding="utf-8") == "annotated"
+    assert "ཁྱིམ" in (out_dir / "text_2.csv").read_text()
+
+
+def test_prepare_file_renumbered_csv(tmp_path):
+    text = tmp_path / "text.txt"
+    lines = [
+        "ང/PRON ཁྱིམ/NOUN ལ/ADP འགྲོ/VERB གོ/PART །/punct",
+        "ཁོ/PRON ཡི་གེ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+        "ཁོ/PRON ཁྱིམ/NOUN ནས/ADP ཡི་གེ/NOUN འབྲི/VERB འོ/PART །/punct",
+    ]
+    text.write_text("\n".join(lines), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    prepare_file(text, out_dir, xlsx=False, tokenizer=fake_tokenizer, incremental=True)
+    for n in range(1, 4):
+        (out_dir / f"text_{n}.csv").write_text(f"annotated {n}", encoding="utf-8")
+
+    def sheets():
+        return {f.name: f.read_text(encoding="utf-8") for f in out_dir.glob("*.csv")}
+
+    # the annotated sheets follow their sentences
+    text.write_text("\n".join(lines[1:]), encoding="utf-8")
+    prepare_file(text, out_dir, xlsx=False, tokenizer=fake_tokenizer, incremental=True)
+    assert sheets() == {"text_1.csv": "annotated 2", "text_2.csv": "annotated 3"}
+
+    text.write_text("\n".join(lines), encoding="utf-8")
+    prepare_file(text, out_dir, xlsx=False, tokenizer=fake_tokenizer, incremental=True)
+    found = sheets()
+    assert found["text_2.csv"] == "annotated 2" and found["text_3.csv"] == "annotated 3"
+    assert "ཁྱིམ" in found["text_1.csv"]
@@ -0,0 +1,71 @@
+import http.client
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+
+import pytest
+
+from syntactic_analysis.server import Busy, RenderService, make_server
+
+
+@pytest.fixture
+def server():
+    server = make_server(port=0, service=RenderService(workers=1))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return response.headers["Content-Type"], response.read().decode("utf-8")
+
+
+def test_render(server, in_file):
+    content = in_file.read_bytes()
+    content_type, svg = post(f"{server}/render?format=svg", content)
+    assert content_type.startswith("image/svg+xml")
+    assert svg.startswith("<svg")
+
+    _, rules = post(f"{server}/render?format=rules", content)
+    assert rules.startswith("rules:")
+    _, link = post(f"{server}/render?format=mshang&version=1", content)
+    assert link.startswith("http://mshang.ca/syntree/")
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        post(f"{server}/render", b"P\tNOUN\n")
+    assert e.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as e:
+        post(f"{server}/render", "P\tNOUN\n".encode("utf-16"))
+    assert e.value.code == 400
+
+    # a bad Content-Length
+    connection = http.client.HTTPConnection(urlparse(server).netloc)
+    connection.putrequest("POST", "/render")
+    connection.putheader("Content-Length", "many")
+    connection.endheaders()
+    assert connection.getresponse().status == 400
+    connection.close()
+
+
+def test_backpressure(in_file):
+    # no workers: the queue is never emptied
+    service = RenderService(workers=0, queue_size=1)
+    content = in_file.read_text(encoding="utf-8-sig")
+    first = service.submit(content)
+    # identical requests share the pending one
+    assert service.submit(content) is first
+    with pytest.raises(Busy):
+        service.submit(content, format="rules")
+
+
+def test_cache(in_file):
+    service = RenderService(workers=1)
+    content = in_file.read_text(encoding="utf-8-sig")
+    result = service.submit(content).result(timeout=10)
+    assert service.cache.get(next(iter(service.cache.items))) == result
+    assert service.submit(content).result(timeout=0) == result
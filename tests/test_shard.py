@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from openpyxl import Workbook
+
+from syntactic_analysis import analyze_constituency, corpus
+from syntactic_analysis.journal import JOURNAL, Journal
+from syntactic_analysis.shard import merge_shards, partition, sheet_weights
+
+package = Path(__file__).parent.parent
+
+
+def test_partition():
+    weights = {f"sheet{i}": i for i in range(20)}
+    parts = partition(weights, 3)
+    assert parts == partition(dict(reversed(list(weights.items()))), 3)
+    assert set().union(*parts) == set(weights)
+    loads = [sum(weights[k] for k in part) for part in parts]
+    assert max(loads) - min(loads) <= max(weights.values())
+
+
+def test_sheet_weights(tmp_path, monkeypatch, copy_sheet):
+    workbook = Workbook()
+    workbook.active.title = "header"
+    for name, rows in [("big", 50), ("small", 5)]:
+        sheet = workbook.create_sheet(name)
+        for _ in range(rows):
+            sheet.append(["x"] * 10)
+    workbook.save(tmp_path / "book.xlsx")
+    copy_sheet(tmp_path / "a.tsv")
+
+    # the sheets are not read
+    monkeypatch.setattr(corpus, "load_workbook", None)
+    weights = sheet_weights(tmp_path, header_sheets=1)
+    assert set(weights) == {"a", "book/big", "book/small"}
+    assert weights["book/big"] > 5 * weights["book/small"]
+
+
+def run_shard(in_dir, out_dir, shards, shard):
+    code = (
+        "import sys\n"
+        "from pathlib import Path\n"
+        "from syntactic_analysis import analyze_constituency\n"
+        "analyze_constituency(Path(sys.argv[1]), Path(sys.argv[2]), format='mshang',"
+        " translate_tree='en_bo', shards=int(sys.argv[3]), shard=int(sys.argv[4]))\n"
+    )
+    # the timings and latex formats are cached next to out_dir, not in the user's cache
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(package),
+        XDG_CACHE_HOME=str(out_dir.parent / f"{out_dir.name}_cache"),
+    )
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            code,
+            str(in_dir),
+            str(out_dir),
+            str(shards),
+            str(shard),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def outputs(out_dir):
+    return {
+        p.relative_to(out_dir): p.read_bytes()
+        for p in out_dir.rglob("*")
+        if p.is_file() and p.name != JOURNAL
+    }
+
+
+def test_shards(tmp_path, copy_sheet):
+    in_dir = tmp_path / "input"
+    in_dir.mkdir()
+    for name in "abcde":
+        copy_sheet(in_dir / f"{name}.tsv")
+    (in_dir / "broken.tsv").write_text("P\tNOUN\n")
+
+    single = tmp_path / "single"
+    analyze_constituency(in_dir, single, format="mshang", translate_tree="en_bo")
+
+    shard_dirs = [tmp_path / f"shard{k}" for k in range(3)]
+    processes = [run_shard(in_dir, d, 3, k) for k, d in enumerate(shard_dirs)]
+    assert all(p.wait(timeout=120) == 0 for p in processes)
+
+    merged = tmp_path / "merged"
+    failed = merge_shards(shard_dirs, merged)
+    assert list(failed) == ["broken"]
+    assert outputs(merged) == outputs(single)
+    journal = Journal(merged / JOURNAL)
+    assert all(journal.is_done(name) for name in "abcde")
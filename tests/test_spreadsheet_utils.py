@@ -0,0 +1,104 @@
+from copy import deepcopy
+import csv
+
+from openpyxl import Workbook, load_workbook
+
+from syntactic_analysis import spreadsheet_utils
+from syntactic_analysis.analysis import normalize_raw_tree
+from syntactic_analysis.spreadsheet_utils import (
+    convert_dir,
+    translate_trees,
+    translate_tsv,
+    xlsx_to_tsv,
+)
+
+
+def read_tsv(filename):
+    return list(csv.reader(filename.open(encoding="utf-8-sig"), delimiter="\t"))
+
+
+def test_translate_tsv(in_file):
+    rows = read_tsv(in_file)
+    en, bo = translate_tsv(rows)
+    assert en == normalize_raw_tree(deepcopy(rows), mode="bo_en")
+    assert bo == normalize_raw_tree(deepcopy(rows), mode="en_bo")
+    assert ["", "[S"] in [row[:2] for row in en]
+
+
+def test_translate_workbook(tmp_path, in_file):
+    rows = read_tsv(in_file)
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name in ["1", "2"]:
+        sheet = workbook.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(tmp_path / "book.xlsx")
+
+    translate_trees(tmp_path / "book.xlsx", workers=2)
+
+    en, bo = translate_tsv(rows)
+    for lang, expected in [("en", en), ("bo", bo)]:
+        translated = load_workbook(tmp_path / f"book_{lang}.xlsx", read_only=True)
+        assert translated.sheetnames == ["1", "2"]
+        values = [[c or "" for c in row] for row in translated["2"].values]
+        assert values == [row + [""] * (len(values[0]) - len(row)) for row in expected]
+
+
+def test_convert_dir(tmp_path, in_file):
+    tsv_dir = tmp_path / "tsv" / "texts" / "book"
+    tsv_dir.mkdir(parents=True)
+    for name in ["1", "2"]:
+        (tsv_dir / f"{name}.tsv").write_bytes(in_file.read_bytes())
+
+    assert convert_dir(tmp_path / "tsv", tmp_path / "xlsx", to="xlsx") == 1
+    assert (tmp_path / "xlsx" / "texts" / "book.xlsx").is_file()
+    # up to date
+    assert convert_dir(tmp_path / "tsv", tmp_path / "xlsx", to="xlsx") == 0
+
+    assert convert_dir(tmp_path / "xlsx", tmp_path / "back", to="tsv", workers=2) == 2
+    back = tmp_path / "back" / "texts" / "book"
+    assert read_tsv(back / "2.tsv") == read_tsv(tsv_dir / "2.tsv")
+    assert convert_dir(tmp_path / "xlsx", tmp_path / "back", to="tsv") == 0
+
+    (tsv_dir / "2.tsv").unlink()
+    assert convert_dir(tmp_path / "tsv", tmp_path / "xlsx", to="xlsx") == 1
+    assert convert_dir(tmp_path / "xlsx", tmp_path / "back", to="tsv") == 0
+    assert not (back / "2.tsv").exists()
+
+
+def workbook_n_loads(tmp_path, monkeypatch, in_file):
+    """A workbook of three sheets, and the list of the calls to load_workbook()"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name in ["1", "2", "3"]:
+        sheet = workbook.create_sheet(name)
+        for row in read_tsv(in_file):
+            sheet.append(row)
+    workbook.save(tmp_path / "book.xlsx")
+
+    loaded = []
+
+    def counted(*args, **kwargs):
+        loaded.append(kwargs["filename"])
+        return load_workbook(*args, **kwargs)
+
+    monkeypatch.setattr(spreadsheet_utils, "load_workbook", counted)
+    return tmp_path / "book.xlsx", loaded
+
+
+def test_translate_loads_workbook_once(tmp_path, monkeypatch, in_file):
+    filename, loaded = workbook_n_loads(tmp_path, monkeypatch, in_file)
+    translate_trees(filename, workers=1)
+    # once for the names of the sheets (closed before the pool forks), once for the sheets
+    assert len(loaded) == 2
+    translated = load_workbook(tmp_path / "book_en.xlsx", read_only=True)
+    assert translated.sheetnames == ["1", "2", "3"]
+
+
+def test_xlsx_to_tsv_loads_workbook_once(tmp_path, monkeypatch, in_file):
+    filename, loaded = workbook_n_loads(tmp_path, monkeypatch, in_file)
+    assert xlsx_to_tsv(filename, tmp_path / "tsv", workers=1) == 3
+    assert len(loaded) == 2
+    tsv = (tmp_path / "tsv" / "book" / "3.tsv").read_bytes()
+    assert tsv.count(b"\r\n") == tsv.count(b"\n") == len(read_tsv(in_file))
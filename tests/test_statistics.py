@@ -0,0 +1,39 @@
+from syntactic_analysis import generate_analysis
+from syntactic_analysis.analysis import generate_trees
+from syntactic_analysis.statistics import CorpusStats, corpus_stats
+
+
+def test_tree_and_rules_agree(in_file):
+    content = in_file.read_text()
+    tree, version_trees = generate_trees(content, translate_tree="en_bo")
+    _, _, rules = generate_analysis(content, translate_tree="en_bo")
+
+    from_tree, from_rules = CorpusStats(), CorpusStats()
+    from_tree.add_tree(tree, version_trees, workbook="test")
+    from_rules.add_rules(rules, workbook="test")
+
+    for table in ["rules", "extra_rules", "pos", "vocab", "sentence_length"]:
+        assert from_tree.tables[table] == from_rules.tables[table]
+    assert from_tree.tables["sentence_length"] == {18: 1}
+    assert from_tree.tables["depth"] == {6: 1}
+    assert from_tree.groups["workbook"]["test"]["sheets"] == 1
+
+
+def test_merge(tmp_path, copy_sheet):
+    in_dir = tmp_path / "input"
+    for num in range(3):
+        (in_dir / "book").mkdir(parents=True, exist_ok=True)
+        copy_sheet(in_dir / "book" / f"{num}.tsv")
+    (in_dir / "book" / "broken.tsv").write_text("P\tNOUN\n")
+
+    stats = corpus_stats(in_dir, annotators={"book": "someone"})
+    assert stats.groups["annotator"]["someone"]["sheets"] == 3
+    assert stats.groups["workbook"]["book"]["errors"] == 1
+
+    stats.to_json(tmp_path / "stats.json")
+    doubled = stats + CorpusStats.from_json(tmp_path / "stats.json")
+    assert doubled.tables["depth"] == {6: 6}
+    assert doubled.groups["workbook"]["book"]["sheets"] == 6
+
+    doubled.to_csv(tmp_path / "csv")
+    assert (tmp_path / "csv" / "rules.csv").is_file()
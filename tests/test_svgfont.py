@@ -0,0 +1,35 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from syntactic_analysis import svgfont
+from syntactic_analysis.analysis import generate_trees
+
+TTFont = pytest.importorskip("fontTools.ttLib").TTFont
+
+
+def test_embedded_subset(tmp_path, monkeypatch, in_file):
+    monkeypatch.setattr(svgfont, "SUBSET_DIR", tmp_path)
+    svgfont._font_subset.cache_clear()
+    content = in_file.read_text(encoding="utf-8-sig")
+    tree, versions = generate_trees(content, translate_tree="en_bo")
+
+    svg = tree.build_svg(embed_font=True)
+    subset = svgfont.font_subset(svgfont.tree_text([tree]))
+    assert "@font-face" in svg and f"font-family: {subset.family}" in svg
+    # cached in memory and on disk
+    assert svgfont.font_subset(svgfont.tree_text([tree])) is subset
+    assert (tmp_path / f"{subset.family}.woff").is_file()
+
+    font = TTFont(BytesIO(subset.data))
+    cmap = font.getBestCmap()
+    assert all(ord(c) in cmap for c in svgfont.tree_text([tree]) if c.strip())
+    font_file = Path(svgfont.__file__).parent / "fonts" / "monlam_uni_ouchan2.ttf"
+    assert len(subset.data) < font_file.stat().st_size / 10
+
+    # one subset for the whole batch, that the svgs can leave to the page to embed
+    batch = svgfont.batch_subset([tree] + versions)
+    assert svgfont.batch_subset([tree] + versions) is batch
+    svg = versions[0].build_svg(subset=batch)
+    assert "@font-face" not in svg and batch.family in svg
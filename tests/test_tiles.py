@@ -0,0 +1,89 @@
+import random
+
+from syntactic_analysis import analyze_constituency
+from syntactic_analysis.analysis import BoTree
+from syntactic_analysis.tiles import measure, split_tree, stub
+
+
+def random_tree(rng, leaves):
+    if leaves == 1:
+        return BoTree("N", [f"w{rng.randrange(100)}"])
+    k = rng.randint(2, min(4, leaves))
+    cuts = [0] + sorted(rng.sample(range(1, leaves), k - 1)) + [leaves]
+    return BoTree("X", [random_tree(rng, b - a) for a, b in zip(cuts, cuts[1:])])
+
+
+def glue(tiles, n=0):
+    """The tree the tiles were cut from"""
+    tile, stubs = tiles[n]
+    by_stub = {leaf: k for k, leaf in stubs.items()}
+
+    def rebuild(node):
+        if len(node) == 1 and node[0] in by_stub:
+            return glue(tiles, by_stub[node[0]])
+        return BoTree(
+            node.label(),
+            [rebuild(c) if isinstance(c, BoTree) else c for c in node],
+        )
+
+    return rebuild(tile)
+
+
+def test_split_tree():
+    rng = random.Random(0)
+    small = random_tree(rng, 40)
+    assert measure(small) == (40, small.height())
+    assert split_tree(small) == [(small, {})]
+
+    for leaves in [100, 500, 3000]:
+        tree = random_tree(rng, leaves)
+        tiles = split_tree(tree, max_leaves=40, max_height=10)
+        assert len(tiles) > leaves // 40
+        assert glue(tiles) == tree
+        for tile, stubs in tiles:
+            assert measure(tile)[1] <= 10
+            assert measure(tile)[0] <= 40
+
+    # a node with more children than fit in a tile has a tile of its own
+    flat = BoTree("NP", [BoTree("N", [f"w{n}"]) for n in range(50)])
+    tree = BoTree("S", [random_tree(rng, 30), flat, random_tree(rng, 30)])
+    tiles = split_tree(tree, max_leaves=40, max_height=10)
+    assert glue(tiles) == tree
+    assert [tile for tile, _ in tiles if measure(tile)[0] > 40] == [flat]
+
+
+def test_svg_tiles(tmp_path, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+
+    analyze_constituency(
+        in_dir, out_dir, format="svg", translate_tree="en_bo", max_leaves=6
+    )
+    svg = (out_dir / "a.svg").read_text(encoding="utf-8-sig")
+    assert '<a href="a_tile1.svg">' in svg and stub(1) in svg
+    assert (out_dir / "a_tile4.svg").is_file()
+    assert not (out_dir / "a_tile5.svg").exists()
+
+    # trees are written whole by default
+    analyze_constituency(
+        in_dir, tmp_path / "whole", format="svg", translate_tree="en_bo"
+    )
+    assert not list((tmp_path / "whole").glob("*_tile*"))
+
+
+def test_tiles_of_other_sheets(tmp_path, in_file, copy_sheet):
+    in_dir, out_dir = tmp_path / "input", tmp_path / "output"
+    in_dir.mkdir()
+    copy_sheet(in_dir / "a.tsv")
+    # the same tree but for a word in one of the tiles
+    content = in_file.read_text(encoding="utf-8-sig")
+    (in_dir / "b.tsv").write_text(content.replace("བཅུ་", "ཁོ་"), encoding="utf-8-sig")
+
+    analyze_constituency(
+        in_dir, out_dir, format="svg", translate_tree="en_bo", max_leaves=6
+    )
+    for name in "ab":
+        svg = (out_dir / f"{name}.svg").read_text(encoding="utf-8-sig")
+        assert f'<a href="{name}_tile1.svg">' in svg
+    assert (out_dir / "a.svg").stat().st_nlink == 1
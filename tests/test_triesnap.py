@@ -0,0 +1,50 @@
+from botok import Config, WordTokenizer
+
+from syntactic_analysis.triesnap import snapshot_name, snapshot_tokenizer
+
+WORDS = [
+    "ཁྱིམ\tNOUN\t\t\t",
+    "ཡི་གེ\tNOUN\t\t\t10",
+    "འབྲི\tVERB\t\t\t",
+    "བཀྲ་ཤིས\tNOUN\t\t\t",
+    "བཀྲ་ཤིས་བདེ་ལེགས\tNOUN\t\t\t",
+]
+TEXT = "བཀྲ་ཤིས་བདེ་ལེགས། ཁོ་ཡིས་ཡི་གེ་འབྲི་གི་འདུག ཁྱིམ་དུ་ཡི་གེར་ཕྱིན།"
+
+
+def dialect_pack(tmp_path):
+    """A small dialect pack, so that botok doesn't download the general one"""
+    words = tmp_path / "packs" / "test" / "dictionary" / "words"
+    words.mkdir(parents=True)
+    (words / "words.tsv").write_text("\n".join(WORDS), encoding="utf-8")
+    remove = tmp_path / "packs" / "test" / "adjustments" / "remove"
+    remove.mkdir(parents=True)
+    (remove / "remove.tsv").write_text("ཁྱིམ\n", encoding="utf-8")
+    return Config("test", tmp_path / "packs")
+
+
+def tokens(tokenizer):
+    return [(t.text, t.pos, t.lemma, t.senses) for t in tokenizer.tokenize(TEXT)]
+
+
+def test_same_tokens(tmp_path):
+    config = dialect_pack(tmp_path)
+    expected = tokens(WordTokenizer(config))
+
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    assert tokens(snapshot_tokenizer(config, snapshots)) == expected
+    assert [f.name for f in snapshots.iterdir()] == [snapshot_name(config)]
+    # loaded from the snapshot, and not modified by the tokenizer
+    assert tokens(snapshot_tokenizer(config, snapshots)) == expected
+    assert tokens(snapshot_tokenizer(config, snapshots)) == expected
+
+
+def test_snapshot_name(tmp_path):
+    config = dialect_pack(tmp_path)
+    name = snapshot_name(config)
+    assert name.startswith("test_")
+
+    words = config.dialect_pack_path / "dictionary" / "words" / "words.tsv"
+    words.write_text("\n".join(WORDS[:2]), encoding="utf-8")
+    assert snapshot_name(config) != name
@@ -0,0 +1,24 @@
+from syntactic_analysis.viewer import TreeViewer
+
+
+def test_pages(tmp_path, copy_sheet):
+    for num in range(5):
+        copy_sheet(tmp_path / f"{num}.tsv")
+    (tmp_path / "broken.tsv").write_text("P\tNOUN\n")
+
+    viewer = TreeViewer(tmp_path, page_size=2, cache_size=2)
+    assert viewer.pages == 3
+    html = viewer._repr_html_()
+    assert "page 1/3, sheets 1-2 of 6" in html
+    assert html.count("<svg") == 2
+    assert len(viewer.cache.items) == 2
+
+    assert viewer.next().next().next().current == 2
+    assert viewer.page_names() == ["4", "broken"]
+    html = viewer._repr_html_()
+    assert html.count("<svg") == 1 and "color: red" in html
+    # older pages are dropped from the cache
+    assert set(viewer.cache.items) == {"4", "broken"}
+
+    assert viewer.find("2").current == 1
+    assert viewer.sheet("3")._repr_html_().startswith("<h3>3</h3>")